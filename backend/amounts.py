@@ -0,0 +1,90 @@
+# amounts.py
+"""
+Montos en unidades enteras: 1 BBC = 10^8 unidades.
+
+Balances, comisiones, recompensas y montos del escrow se guardan como int,
+así que las sumas y comparaciones son exactas y la serialización canónica
+no depende del redondeo de floats. La conversión a BBC se hace solo en el
+borde de la API: to_units() al leer una petición y to_bbc() / *_view() al
+responder.
+
+Los bloques y transacciones anteriores guardaron sus montos como float en
+BBC y su hash y firma dependen de esa representación, así que no se
+reescriben: un float en un campo de monto se interpreta como BBC y un int
+como unidades (ver amount_units).
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+UNITS_PER_BBC = 10 ** 8
+BPS = 10000  # Denominador de las comisiones porcentuales (puntos básicos)
+
+INITIAL_WALLET_BALANCE = 10 * UNITS_PER_BBC    # Saldo que /generate_wallet asigna fuera de la cadena
+INITIAL_ESCROW_BALANCE = 1000 * UNITS_PER_BBC  # Saldo inicial del contrato de custodia
+
+AMOUNT_FIELDS = ('amount', 'fee')
+AGREEMENT_AMOUNT_FIELDS = ('amount', 'mediator_fee', 'reserved_mining_fees')
+
+
+def to_units(bbc):
+    """Convierte un monto en BBC recibido por la API (número o cadena) a unidades"""
+    try:
+        value = Decimal(str(bbc))
+    except InvalidOperation:
+        raise ValueError(f"Monto inválido: {bbc}")
+    if not value.is_finite():
+        raise ValueError(f"Monto inválido: {bbc}")
+    return int((value * UNITS_PER_BBC).to_integral_value(ROUND_HALF_EVEN))
+
+
+def amount_units(value):
+    """Monto guardado (int en unidades o float heredado en BBC) en unidades"""
+    if isinstance(value, float):
+        return to_units(value)
+    return value
+
+
+def to_bbc(value):
+    """Monto guardado en BBC, para las respuestas de la API"""
+    if isinstance(value, float):
+        return value
+    return value / UNITS_PER_BBC
+
+
+def mul_bps(units, bps):
+    """Porcentaje en puntos básicos de un monto, redondeado al entero más cercano"""
+    return (units * bps + BPS // 2) // BPS
+
+
+def transaction_view(transaction):
+    """Copia de la transacción con los montos en BBC"""
+    view = dict(transaction)
+    for field in AMOUNT_FIELDS:
+        if field in view:
+            view[field] = to_bbc(view[field])
+    return view
+
+
+def agreement_view(agreement):
+    view = dict(agreement)
+    for field in AGREEMENT_AMOUNT_FIELDS:
+        if field in view:
+            view[field] = to_bbc(view[field])
+    return view
+
+
+def balances_view(balances):
+    return {address: to_bbc(value) for address, value in balances.items()}
+
+
+def transaction_from_view(transaction):
+    """
+    Transacción tal como la devolvió la API (montos en BBC) con los montos
+    pasados a unidades, para recalcular su hash. Solo es la transacción
+    original si esta ya usaba unidades; los llamadores prueban ambas.
+    """
+    stored = dict(transaction)
+    for field in AMOUNT_FIELDS:
+        if field in stored:
+            stored[field] = to_units(stored[field])
+    return stored
@@ -1,14 +1,27 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from flask.json import JSONEncoder
 from flask_cors import CORS
 from blockchain import Blockchain
-import traceback
+from mining_jobs import MiningJobQueue
+from escrow_scheduler import EscrowExpiryWorker
+from logging_config import configure_logging
+from encoding import ENCODING_JSON, serialize_transaction
+from snapshot import DEFAULT_SNAPSHOT_INTERVAL
+from merkle import verify_proof
+from records import Record
+from amounts import (agreement_view, amount_units, balances_view,
+                     to_bbc, to_units, transaction_from_view, transaction_view)
+import logging
+import atexit
+from functools import wraps
 import re
 import hashlib
 import json
 from time import time
 from wallet_generator import WalletGenerator
-from crypto_utils import verify_signature, sign_transaction
+from crypto_utils import verify_signature, sign_transaction, get_cache_stats
 import secrets
+import os
 
 from Crypto.Cipher import AES
 from Crypto.Protocol.KDF import PBKDF2
@@ -16,7 +29,20 @@ from Crypto.Util.Padding import pad, unpad
 from Crypto.Random import get_random_bytes
 import base64
 
+# Niveles de log configurables con LOG_LEVEL y LOG_LEVELS (ver logging_config.py)
+configure_logging()
+logger = logging.getLogger('app')
+
+class RecordJSONEncoder(JSONEncoder):
+    """Las respuestas muestran los Block y Transaction compactos (records.py) como los dicts de siempre"""
+
+    def default(self, o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return super().default(o)
+
 app = Flask(__name__)
+app.json_encoder = RecordJSONEncoder
 CORS(app, resources={
     r"/*": {
         "origins": ["http://localhost:3000"],
@@ -24,78 +50,144 @@ CORS(app, resources={
         "allow_headers": ["Content-Type"]
     }
 })
-blockchain = Blockchain()
-
-blockchain.public_keys = {}
+# Si se define BLOCKCHAIN_DATA_DIR la cadena se guarda en disco y sobrevive a reinicios,
+# junto con un snapshot del estado cada BLOCKCHAIN_SNAPSHOT_INTERVAL bloques (0 lo desactiva).
+# BLOCKCHAIN_ENCODING=1 firma y hashea los bloques y transacciones nuevos con la
+# codificación binaria (ver encoding.py); 0 (por defecto) mantiene el JSON original
+blockchain = Blockchain(data_dir=os.environ.get('BLOCKCHAIN_DATA_DIR'),
+                        encoding=int(os.environ.get('BLOCKCHAIN_ENCODING', ENCODING_JSON)),
+                        snapshot_interval=int(os.environ.get('BLOCKCHAIN_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL)))
+# Al salir se guarda el estado para no perder wallets, acuerdos ni la mempool
+atexit.register(blockchain.shutdown)
 
 def clean_public_key(key):
     return re.sub(r'\s+', '', key)
 
+def writes_state(route):
+    """
+    Ejecuta la ruta con el lock de escritura de blockchain.state_lock. Se
+    aplica a las rutas que modifican balances, claves, mempool o acuerdos.
+    /mine solo encola el trabajo: el hilo de minado toma el lock al armar y
+    al aplicar el bloque, no durante la prueba de trabajo.
+    """
+    @wraps(route)
+    def wrapper(*args, **kwargs):
+        with blockchain.state_lock.write():
+            return route(*args, **kwargs)
+    return wrapper
+
+def reads_state(route):
+    """
+    Ejecuta la ruta con el lock de lectura: las consultas corren en paralelo
+    entre sí y nunca ven un bloque aplicado a medias (ver concurrency.py).
+    """
+    @wraps(route)
+    def wrapper(*args, **kwargs):
+        with blockchain.state_lock.read():
+            return route(*args, **kwargs)
+    return wrapper
+
 @app.route('/generate_wallet', methods=['GET'])
 def generate_wallet():
     try:
-        print("Iniciando generación de wallet...")
+        # La derivación de claves no toca el estado: corre sin el lock
+        logger.debug("Iniciando generación de wallet...")
         wallet_gen = WalletGenerator()
         wallet_data = wallet_gen.generate_wallet()
         
-        print(f"Wallet generada exitosamente: {wallet_data['address']}")
+        logger.info("Wallet generada exitosamente: %s", wallet_data['address'])
         
         # Almacenar la clave pública y establecer balance inicial
-        blockchain.public_keys[wallet_data['address']] = wallet_data['public_key']
-        blockchain.balances[wallet_data['address']] = 10
+        with blockchain.state_lock.write():
+            blockchain.register_wallet(wallet_data['address'], wallet_data['public_key'])
         
         return jsonify(wallet_data), 200
     except Exception as e:
-        print(f"Error en la ruta generate_wallet: {str(e)}")
-        traceback.print_exc()  # Imprime el stack trace completo
+        logger.exception("Error en la ruta generate_wallet: %s", e)
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/mine', methods=['POST'])
-def mine():
-    print("\n===== INICIO DE MINADO =====")
+def mine_block(miner_address, selected_transactions, max_transactions, cancel=None):
+    """Mina un bloque; se ejecuta en el hilo de la cola de minado, no en la petición HTTP"""
+    logger.debug("===== INICIO DE MINADO =====")
     try:
-        values = request.get_json()
-        miner_address = clean_public_key(values.get('miner_address'))
-        selected_transactions = values.get('selected_transactions', [])
+        # Sin selección explícita se arma la plantilla con las de mayor comisión
+        if not selected_transactions and max_transactions:
+            with blockchain.state_lock.read():
+                selected_transactions = blockchain.select_transactions(int(max_transactions))
         
-        print(f"Direccion del minero: {miner_address}")
-        print(f"Transacciones seleccionadas: {selected_transactions}")
+        logger.debug("Direccion del minero: %s", miner_address)
+        logger.debug("Transacciones seleccionadas: %s", selected_transactions)
         
-        # Detener cualquier minado en curso
-        blockchain.stop_mining()
+        block = blockchain.mine(miner_address, selected_transactions, cancel)
+        if block is None:
+            raise ValueError("Minado detenido manualmente")
+        logger.debug("Bloque minado exitosamente: %s", block)
         
-        try:
-            block = blockchain.mine(miner_address, selected_transactions)
-            print(f"Bloque minado exitosamente: {block}")
-            
+        with blockchain.state_lock.write():
             if not blockchain.validate_chain():
-                print("Error: La cadena quedó inválida después del minado")
-                blockchain.chain.pop()
-                return jsonify({'message': 'Mining failed: invalid blockchain state'}), 500
-            
-            result = {
-                'message': "New Block Forged",
-                'index': block['index'],
-                'transactions': block['transactions'],
-                'previous_hash': block['previous_hash'],
-                'hash': block['hash'],
-                'nonce': block['nonce']
-            }
-            
-            print(f"Resultado del minado: {result}")
-            return jsonify(result), 200
-            
-        except ValueError as ve:
-            print(f"Minado interrumpido: {str(ve)}")
-            return jsonify({'message': 'Mining stopped'}), 200
-            
+                logger.error("Error: La cadena quedó inválida después del minado")
+                blockchain.revert_last_block()
+                raise ValueError("Mining failed: invalid blockchain state")
+        
+        result = {
+            'message': "New Block Forged",
+            'index': block['index'],
+            'transactions': [transaction_view(tx) for tx in block['transactions']],
+            'previous_hash': block['previous_hash'],
+            'hash': block['hash'],
+            'nonce': block['nonce']
+        }
+        
+        logger.debug("Resultado del minado: %s", result)
+        return result
+        
     except Exception as e:
-        print(f"ERROR durante el minado: {str(e)}")
-        traceback.print_exc()
+        logger.exception("ERROR durante el minado: %s", e)
+        raise
+
+mining_jobs = MiningJobQueue(blockchain, mine_block)
+# Reembolsa o libera los acuerdos del escrow que vencen en su estado (ver escrow_scheduler.py)
+escrow_expiry = EscrowExpiryWorker(blockchain)
+
+@app.route('/mine', methods=['POST'])
+def mine():
+    """Encola un trabajo de minado y responde de inmediato con su ID"""
+    try:
+        values = request.get_json()
+        miner_address = clean_public_key(values.get('miner_address'))
+        job = mining_jobs.submit(
+            miner_address,
+            values.get('selected_transactions', []),
+            values.get('max_transactions')
+        )
+        return jsonify({
+            'message': 'Mining job queued',
+            'job_id': job['id'],
+            'status': job['status'],
+            'position': job['position']
+        }), 202
+    except Exception as e:
+        logger.error("ERROR al encolar el minado: %s", e)
         return jsonify({'message': f'Mining failed: {str(e)}'}), 500
-    finally:
-        blockchain.mining_stopped = True
+
+@app.route('/mine/jobs', methods=['GET'])
+def list_mining_jobs():
+    return jsonify({'jobs': mining_jobs.list()}), 200
+
+@app.route('/mine/jobs/<job_id>', methods=['GET'])
+def get_mining_job(job_id):
+    job = mining_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
+@app.route('/mine/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_mining_job(job_id):
+    job = mining_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
 
 @app.route('/mine/progress', methods=['GET'])
 def get_mining_progress():
@@ -103,12 +195,43 @@ def get_mining_progress():
         progress = blockchain.get_mining_progress()
         return jsonify(progress), 200
     except Exception as e:
-        print(f"Error al obtener progreso de minado: {str(e)}")
+        logger.error("Error al obtener progreso de minado: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    Flujo Server-Sent Events con los eventos del nodo: block-appended,
+    mempool-changed, mining-progress, balance-changed y overflow (el cliente
+    perdió eventos y debe volver a consultar el estado).
+
+    Cada cliente ocupa un hilo del servidor mientras está conectado; con
+    MAX_EVENT_CLIENTS configurado (ver serve.py) los que exceden el límite
+    reciben 503 en lugar de quitarle hilos al resto de las rutas.
+    """
+    subscription = blockchain.events.subscribe(app.config.get('MAX_EVENT_CLIENTS'))
+    if subscription is None:
+        return jsonify({'message': 'Too many event clients'}), 503
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                pending = subscription.get(timeout=15)
+                if not pending:
+                    yield ': keepalive\n\n'
+                for event_type, data in pending:
+                    yield f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            blockchain.events.unsubscribe(subscription)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/transactions/new', methods=['POST'])
+@writes_state
 def new_transaction():
-    print("\n====== INICIO DE NUEVA TRANSACCIÓN ======\n")
+    logger.debug("====== INICIO DE NUEVA TRANSACCIÓN ======")
     try:
         values = request.get_json()
         required = ['sender', 'recipient', 'amount', 'fee', 'privateKey']
@@ -116,11 +239,11 @@ def new_transaction():
             return jsonify({'message': 'Missing values'}), 400
 
         # 1. Preparar datos de la transacción
-        print("1. Preparando datos de la transacción")
+        logger.debug("1. Preparando datos de la transacción")
         sender = clean_public_key(values['sender'])
         recipient = clean_public_key(values['recipient'])
-        amount = float(values['amount'])
-        fee = float(values['fee'])
+        amount = to_units(values['amount'])
+        fee = to_units(values['fee'])
         private_key = values['privateKey']
 
         # 2. Crear objeto de transacción
@@ -132,52 +255,149 @@ def new_transaction():
             'timestamp': time(),
             'type': 'normal'  # Todas las transacciones nuevas son de tipo normal
         }
+        blockchain.tag_encoding(transaction)
 
         # 3. Firmar la transacción
-        print("2. Firmando transacción...")
+        logger.debug("2. Firmando transacción...")
         signature = sign_transaction(private_key, transaction)
         transaction['signature'] = signature.hex()
 
         # 4. Añadir a la mempool
-        print("3. Añadiendo a la mempool...")
-        blockchain.add_to_mempool(transaction)
+        logger.debug("3. Añadiendo a la mempool...")
+        txid = blockchain.add_to_mempool(transaction)
         
-        return jsonify({'message': 'Transaction added to mempool'}), 201
+        return jsonify({'message': 'Transaction added to mempool', 'txid': txid}), 201
 
     except Exception as e:
-        print(f"ERROR en nueva transacción: {str(e)}")
+        logger.error("ERROR en nueva transacción: %s", e)
         return jsonify({'message': f'Error processing transaction: {str(e)}'}), 500
 
 @app.route('/mempool', methods=['GET'])
+@reads_state
 def get_mempool():
     """Endpoint para obtener las transacciones pendientes en la mempool"""
     mempool = blockchain.get_mempool()
     current_reward = blockchain.calculate_block_reward()
     
     return jsonify({
-        'pending_transactions': mempool,
-        'current_block_reward': current_reward,
+        'pending_transactions': [transaction_view(tx) for tx in mempool],
+        'current_block_reward': to_bbc(current_reward),
         'mempool_size': len(mempool)
     }), 200
 
+CHAIN_PAGE_SIZE = 100       # Bloques por página cuando se usa paginación
+MAX_CHAIN_PAGE_SIZE = 1000  # Límite superior para ?limit=
+
+def block_view(block, headers_only):
+    """Bloque completo con los montos en BBC, o solo su encabezado con el número de transacciones"""
+    if not headers_only:
+        return dict(block, transactions=[transaction_view(tx) for tx in block['transactions']])
+    header = {key: value for key, value in block.items() if key != 'transactions'}
+    header['transaction_count'] = len(block['transactions'])
+    return header
+
 @app.route('/chain', methods=['GET'])
+@reads_state
 def full_chain():
-    """Endpoint para obtener la cadena completa"""
+    """
+    Endpoint para obtener la cadena.
+
+    Parámetros opcionales:
+        from_height: índice del primer bloque a devolver (por defecto 1)
+        limit: cantidad de bloques (por defecto CHAIN_PAGE_SIZE si se pagina)
+        view=headers: omite las transacciones de cada bloque
+        format=ndjson: transmite un bloque por línea a medida que se serializa
+
+    Sin from_height ni limit se devuelve la cadena completa, como antes.
+    """
     try:
         if not blockchain.validate_chain():
             return jsonify({'message': 'The blockchain is invalid'}), 400
-            
+
+        from_height = request.args.get('from_height', default=1, type=int)
+        limit = request.args.get('limit', type=int)
+        headers_only = request.args.get('view') == 'headers'
+        if from_height < 1 or (limit is not None and limit < 0):
+            return jsonify({'message': 'Invalid from_height or limit'}), 400
+
+        length = len(blockchain.chain)
+        start = from_height - 1
+
+        if request.args.get('format') == 'ndjson':
+            end = length if limit is None else min(length, start + limit)
+
+            def generate():
+                # El generador corre después de que la ruta suelta el lock: cada
+                # bloque se lee con el lock de lectura tomado de nuevo
+                for height in range(start, end):
+                    with blockchain.state_lock.read():
+                        if height >= len(blockchain.chain):
+                            return
+                        line = json.dumps(block_view(blockchain.chain[height], headers_only))
+                    yield line + '\n'
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        paginated = 'from_height' in request.args or 'limit' in request.args
+        if paginated:
+            limit = min(CHAIN_PAGE_SIZE if limit is None else limit, MAX_CHAIN_PAGE_SIZE)
+            end = min(length, start + limit)
+        else:
+            end = length
+
         response = {
-            'chain': blockchain.chain,
-            'length': len(blockchain.chain),
+            'chain': [block_view(block, headers_only) for block in blockchain.chain[start:end]],
+            'length': length,
         }
+        if paginated:
+            response['from_height'] = from_height
+            response['next_height'] = end + 1 if end < length else None
         return jsonify(response), 200
         
     except Exception as e:
-        print(f"Error al obtener la cadena: {str(e)}")
+        logger.error("Error al obtener la cadena: %s", e)
         return jsonify({'message': str(e)}), 500
 
+@app.route('/transactions/<txid>', methods=['GET'])
+@reads_state
+def get_transaction(txid):
+    """Transacción confirmada por txid, con el bloque y la posición en que se incluyó"""
+    result = blockchain.get_transaction(txid)
+    if result is None:
+        return jsonify({'error': 'Transacción no encontrada'}), 404
+    result['transaction'] = transaction_view(result['transaction'])
+    return jsonify(result), 200
+
+@app.route('/address/<address>/history', methods=['GET'])
+@reads_state
+def get_address_history(address):
+    """
+    Historial confirmado de una dirección, paginado.
+
+    Parámetros opcionales:
+        offset: entradas a saltar (por defecto 0)
+        limit: entradas por página (por defecto CHAIN_PAGE_SIZE)
+        order=asc: de la más antigua a la más reciente (por defecto, al revés)
+    """
+    offset = request.args.get('offset', default=0, type=int)
+    limit = request.args.get('limit', default=CHAIN_PAGE_SIZE, type=int)
+    if offset < 0 or limit < 0:
+        return jsonify({'message': 'Invalid offset or limit'}), 400
+    limit = min(limit, MAX_CHAIN_PAGE_SIZE)
+
+    total, entries = blockchain.get_address_history(address, offset, limit,
+                                                    newest_first=request.args.get('order') != 'asc')
+    next_offset = offset + len(entries)
+    return jsonify({
+        'address': address,
+        'total': total,
+        'offset': offset,
+        'history': [dict(entry, transaction=transaction_view(entry['transaction'])) for entry in entries],
+        'next_offset': next_offset if next_offset < total else None
+    }), 200
+
 @app.route('/generate_address', methods=['POST'])
+@writes_state
 def generate_address():
    """Genera una nueva dirección a partir de una clave pública existente"""
    try:
@@ -205,11 +425,8 @@ def generate_address():
            
        for wallet_addr in blockchain.public_keys:
            if blockchain.public_keys[wallet_addr] == public_key:
-               if wallet_addr not in blockchain.wallet_addresses:
-                   blockchain.wallet_addresses[wallet_addr] = []
-               blockchain.wallet_addresses[wallet_addr].append(address)
-               # Inicializa balance para la nueva dirección
-               blockchain.balances[address] = 0
+               # Asocia la dirección e inicializa su balance
+               blockchain.register_address(wallet_addr, address)
                break
 
        return jsonify({'address': address}), 200
@@ -229,36 +446,37 @@ def generate_address_from_public_key(public_key):
         
         return ripemd160_hash
     except Exception as e:
-        print(f"Error en generate_address_from_public_key: {str(e)}")
+        logger.error("Error en generate_address_from_public_key: %s", e)
         raise
 
 def encrypt_private_key(private_key, password):
-    print("\n--- INICIO DE CIFRADO DE LLAVE PRIVADA ---")
+    logger.debug("--- INICIO DE CIFRADO DE LLAVE PRIVADA ---")
     # 1. Generar salt aleatorio
     salt = get_random_bytes(16)
-    print(f"Salt generado (hex): {salt.hex()}")
+    logger.debug("Salt generado (hex): %s", salt.hex())
 
     # 2. Derivar llave de 32 bytes usando PBKDF2
-    print("Derivando llave de 32 bytes usando PBKDF2")
+    logger.debug("Derivando llave de 32 bytes usando PBKDF2")
     key = PBKDF2(password, salt, dkLen=32)
-    print(f"Llave derivada (hex): {key.hex()}")
+    logger.debug("Llave derivada (hex): %s", key.hex())
 
     # 3. Crear objeto AES en modo CBC
     cipher = AES.new(key, AES.MODE_CBC)
-    print(f"IV generado (hex): {cipher.iv.hex()}")
+    logger.debug("IV generado (hex): %s", cipher.iv.hex())
 
     # 4. Padding y cifrado
-    print("Aplicando padding PKCS7 y cifrando con AES-CBC")
+    logger.debug("Aplicando padding PKCS7 y cifrando con AES-CBC")
     padded_data = pad(private_key.encode(), AES.block_size)
     encrypted_data = cipher.encrypt(padded_data)
 
     # 5. Combinar salt, IV y datos cifrados
     encrypted_private_key = salt + cipher.iv + encrypted_data
     result = base64.b64encode(encrypted_private_key).decode()
-    print("--- FIN DE CIFRADO DE LLAVE PRIVADA ---\n")
+    logger.debug("--- FIN DE CIFRADO DE LLAVE PRIVADA ---")
     return result
 
 @app.route('/decrypt_private_key', methods=['POST'])
+@writes_state
 def decrypt_private_key_route():
     try:
         data = request.get_json()
@@ -279,46 +497,44 @@ def decrypt_private_key_route():
             
             # Cargar en memoria si no existe
             if address not in blockchain.public_keys:
-                blockchain.public_keys[address] = public_key
-                # Si no existe el balance, inicializarlo
-                if address not in blockchain.balances:
-                    blockchain.balances[address] = 10
+                # Si no existe el balance, se inicializa
+                blockchain.register_wallet(address, public_key)
 
             return jsonify({
                 'decrypted_private_key': decrypted_private_key,
                 'address': address,
                 'public_key': public_key,
-                'balance': blockchain.balances[address]
+                'balance': to_bbc(blockchain.balances[address])
             }), 200
             
         except Exception as e:
-            print(f"Error específico en el descifrado: {str(e)}")
+            logger.error("Error específico en el descifrado: %s", e)
             return jsonify({'error': f'Decryption failed: {str(e)}'}), 400
 
     except Exception as e:
-        print(f"Error general en la ruta: {str(e)}")
+        logger.error("Error general en la ruta: %s", e)
         return jsonify({'error': str(e)}), 500
 
 def decrypt_private_key(encrypted_private_key, password):
     try:
-        print(f"Intentando descifrar con password: {password}")
-        print(f"Encrypted key recibida: {encrypted_private_key}")
+        logger.debug("Intentando descifrar con password: %s", password)
+        logger.debug("Encrypted key recibida: %s", encrypted_private_key)
         
         # Decode the base64 encrypted data
         encrypted_data = base64.b64decode(encrypted_private_key)
-        print(f"Longitud de datos cifrados: {len(encrypted_data)}")
+        logger.debug("Longitud de datos cifrados: %s", len(encrypted_data))
 
         # Extract salt, IV, and ciphertext
         salt = encrypted_data[:16]
         iv = encrypted_data[16:32]
         ciphertext = encrypted_data[32:]
         
-        print(f"Salt (hex): {salt.hex()}")
-        print(f"IV (hex): {iv.hex()}")
+        logger.debug("Salt (hex): %s", salt.hex())
+        logger.debug("IV (hex): %s", iv.hex())
 
         # Derive the key from the password and salt
         key = PBKDF2(password, salt, dkLen=32)
-        print(f"Derived key (hex): {key.hex()}")
+        logger.debug("Derived key (hex): %s", key.hex())
 
         # Create an AES cipher object
         cipher = AES.new(key, AES.MODE_CBC, iv)
@@ -330,124 +546,206 @@ def decrypt_private_key(encrypted_private_key, password):
         decrypted_data = unpad(decrypted_padded_data, AES.block_size)
         result = decrypted_data.decode()
         
-        print(f"Descifrado exitoso, resultado: {result}")
+        logger.debug("Descifrado exitoso, resultado: %s", result)
         return result
         
     except Exception as e:
-        print(f"Error durante el descifrado: {str(e)}")
+        logger.error("Error durante el descifrado: %s", e)
         raise
 
 @app.route('/verify_block', methods=['POST'])
+@reads_state
 def verify_block():
-    print("\n====== INICIO DE VERIFICACIÓN DE BLOQUE ======")
+    logger.debug("====== INICIO DE VERIFICACIÓN DE BLOQUE ======")
     try:
         data = request.get_json()
         block_index = data.get('block_index')
+        position = data.get('position')
         transaction_data = data.get('transaction')
+
+        # Con el txid no hace falta conocer el bloque: se ubica con el índice de la cadena
+        if data.get('txid'):
+            confirmed = blockchain.get_transaction(data['txid'])
+            if confirmed is None:
+                return jsonify({'message': 'Error'}), 400
+            block_index, position = confirmed['block_index'], confirmed['position']
         signature = data.get('signature')
         public_key = data.get('public_key')
 
-        print(f"1. Datos recibidos:")
-        print(f"   Índice del bloque: {block_index}")
-        print(f"   Transacción a verificar: {json.dumps(transaction_data, indent=2)}")
-        print(f"   Firma: {signature[:32]}..." if signature else "VALID")
-        print(f"   Llave pública: {public_key[:32]}..." if public_key else "N/A")
+        logger.debug("1. Datos recibidos:")
+        logger.debug("Índice del bloque: %s", block_index)
+        logger.debug("Transacción a verificar: %s", transaction_data)
+        logger.debug("Firma: %s", signature[:32] + "..." if signature else "VALID")
+        logger.debug("Llave pública: %s", public_key[:32] + "..." if public_key else "N/A")
 
-        # Convertir valores numéricos
-        transaction_data['amount'] = float(transaction_data['amount'])
-        transaction_data['fee'] = float(transaction_data['fee'])
+        # Los montos llegan en BBC; en unidades se comparan exactamente con los guardados
+        amount = to_units(transaction_data['amount'])
+        fee = to_units(transaction_data['fee'])
+
+        def same_amounts(tx):
+            return amount_units(tx['amount']) == amount and amount_units(tx.get('fee', 0)) == fee
 
         # Obtener el bloque
         block = blockchain.chain[block_index]
-        print(f"\n2. Bloque obtenido: #{block['index']}")
-        print(f"   Total de transacciones en el bloque: {len(block['transactions'])}")
+        logger.debug("2. Bloque obtenido: #%s", block['index'])
+        logger.debug("Total de transacciones en el bloque: %s", len(block['transactions']))
+
+        # Con la posición de la transacción no se recorre el bloque: la hoja se
+        # calcula con la transacción que envió el cliente y se comprueba su
+        # prueba de inclusión contra el Merkle root de la cabecera del bloque
+        if position is not None:
+            position = int(position)
+            stored = block['transactions'][position]
+            claimed = dict(stored)
+            for field in ('sender', 'recipient', 'timestamp', 'type'):
+                if field in transaction_data:
+                    claimed[field] = transaction_data[field]
+            # Los montos con la forma de la transacción guardada: unidades, o BBC en las antiguas
+            legacy = isinstance(stored['amount'], float)
+            claimed['amount'] = float(transaction_data['amount']) if legacy else amount
+            if 'fee' in stored or fee:
+                claimed['fee'] = float(transaction_data['fee']) if legacy else fee
+            if signature:
+                claimed['signature'] = signature
+
+            proof = blockchain.merkle_proof(block_index, position)
+            leaf = hashlib.sha256(serialize_transaction(claimed)).hexdigest()
+            if not verify_proof(leaf, proof['proof'], block['merkle_root'], proof['raw']):
+                logger.warning("La transacción no está incluida en el bloque en la posición %s", position)
+                return jsonify({'message': 'Error'}), 400
+            candidates = [stored]
+        else:
+            # Solo las transacciones del bloque en las que participa el remitente
+            positions = blockchain.chain_index.positions_in_block(transaction_data.get('sender'), block_index)
+            candidates = [block['transactions'][p] for p in positions]
 
         # Determinar el tipo de transacción
         is_escrow_contract = transaction_data.get('sender') == 'escrow_contract'
         is_escrow_deposit = transaction_data.get('recipient') == 'escrow_contract'
         
-        print("\n3. Buscando transacción coincidente...")
+        logger.debug("3. Buscando transacción coincidente...")
         # Lógica especial para verificar transacciones relacionadas con escrow
         if is_escrow_contract:
             # Para transacciones desde el contrato
             matching_transaction = next(
-                (tx for tx in block['transactions'] if 
+                (tx for tx in candidates if 
                  tx.get('type') == 'contract_transfer' and
                  tx['sender'] == 'escrow_contract' and 
                  tx['recipient'] == transaction_data['recipient'] and
-                 abs(float(tx['amount']) - transaction_data['amount']) < 0.00001 and
-                 (not tx.get('fee') or abs(float(tx.get('fee', 0)) - transaction_data['fee']) < 0.00001) and
+                 amount_units(tx['amount']) == amount and
+                 (not tx.get('fee') or amount_units(tx['fee']) == fee) and
                  tx.get('signature') == 'VALID'),
                 None
             )
             
             if matching_transaction:
-                print("\n4. Transacción del contrato encontrada y válida")
+                logger.debug("4. Transacción del contrato encontrada y válida")
                 return jsonify({'message': 'Válido'}), 200
             else:
-                print("\n4. Transacción del contrato no encontrada o inválida")
+                logger.debug("4. Transacción del contrato no encontrada o inválida")
                 return jsonify({'message': 'Error'}), 400
 
         elif is_escrow_deposit:
             # Para transacciones hacia el contrato
-            print("   Verificando depósito al escrow...")
+            logger.debug("Verificando depósito al escrow...")
             matching_transaction = next(
-                (tx for tx in block['transactions'] if 
+                (tx for tx in candidates if 
                  tx['sender'] == transaction_data['sender'] and 
                  tx['recipient'] == 'escrow_contract' and 
-                 abs(float(tx['amount']) - transaction_data['amount']) < 0.00001 and
-                 abs(float(tx.get('fee', 0)) - transaction_data['fee']) < 0.00001),
+                 same_amounts(tx)),
                 None
             )
         else:
             # Para transacciones normales
-            print("   Verificando transacción normal...")
+            logger.debug("Verificando transacción normal...")
             matching_transaction = next(
-                (tx for tx in block['transactions'] if 
+                (tx for tx in candidates if 
                  tx['sender'] == transaction_data['sender'] and 
                  tx['recipient'] == transaction_data['recipient'] and 
-                 abs(float(tx['amount']) - transaction_data['amount']) < 0.00001 and
-                 abs(float(tx.get('fee', 0)) - transaction_data['fee']) < 0.00001),
+                 same_amounts(tx)),
                 None
             )
 
         if not matching_transaction:
-            print("\nERROR: No se encontró una transacción coincidente")
+            logger.error("ERROR: No se encontró una transacción coincidente")
             return jsonify({'message': 'Error'}), 400
 
-        print("\n4. Transacción encontrada:", json.dumps(matching_transaction, indent=2))
+        logger.debug("4. Transacción encontrada: %s", matching_transaction)
 
-        # Verificación de firma para transacciones normales y depósitos al escrow
-        transaction_data['timestamp'] = matching_transaction['timestamp']
-        transaction_data['type'] = matching_transaction.get('type', 'normal')
+        # Verificación de firma para transacciones normales y depósitos al escrow:
+        # la transacción guardada sin firma (montos tal como se firmaron, timestamp,
+        # tipo y codificación) con el remitente y el destinatario del cliente
+        signed_data = matching_transaction.unsigned().to_dict()
+        signed_data['sender'] = transaction_data['sender']
+        signed_data['recipient'] = transaction_data['recipient']
 
-        print("\n5. Verificando firma...")
-        print(f"   Datos a verificar: {json.dumps(transaction_data, indent=2)}")
+        logger.debug("5. Verificando firma...")
+        logger.debug("Datos a verificar: %s", signed_data)
         
-        is_valid = verify_signature(public_key, transaction_data, signature)
-        print(f"   Resultado de verificación: {'Válido' if is_valid else 'Inválido'}")
+        is_valid = verify_signature(public_key, signed_data, signature)
+        logger.debug("Resultado de verificación: %s", 'Válido' if is_valid else 'Inválido')
 
         if is_valid:
-            print("\n====== FIN DE VERIFICACIÓN - ÉXITO ======")
+            logger.debug("====== FIN DE VERIFICACIÓN - ÉXITO ======")
             return jsonify({'message': 'Válido'}), 200
         else:
-            print("\n====== FIN DE VERIFICACIÓN - FALLO ======")
+            logger.debug("====== FIN DE VERIFICACIÓN - FALLO ======")
             return jsonify({'message': 'Error'}), 400
 
     except Exception as e:
-        print(f"\nERROR en verify_block: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("ERROR en verify_block: %s", e)
         return jsonify({'message': 'Error'}), 400
 
+@app.route('/blocks/<int:block_index>/merkle_proof/<int:position>', methods=['GET'])
+@reads_state
+def get_merkle_proof(block_index, position):
+    """
+    Prueba de inclusión de una transacción en un bloque (índice 0-based, como
+    en /verify_block). Se comprueba con /merkle/verify sin pedir el bloque completo.
+    """
+    if not 0 <= block_index < len(blockchain.chain):
+        return jsonify({'error': 'Bloque no encontrado'}), 404
+    try:
+        return jsonify(blockchain.merkle_proof(block_index, position)), 200
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/merkle/verify', methods=['POST'])
+def verify_merkle_proof():
+    """
+    Comprueba una prueba de inclusión. Acepta el hash de la hoja ('leaf') o la
+    transacción completa ('transaction'), la prueba y el Merkle root.
+    """
+    data = request.get_json() or {}
+    required = ['proof', 'merkle_root']
+    if not all(k in data for k in required) or not ('leaf' in data or 'transaction' in data):
+        return jsonify({'error': 'Missing values'}), 400
+
+    raw = bool(data.get('raw', False))
+    leaf = data.get('leaf')
+    if leaf is None:
+        # La transacción puede venir como la guardó el bloque o con los montos
+        # en BBC, como la devuelve la API; se prueban ambas formas
+        valid = False
+        for transaction in (data['transaction'], transaction_from_view(data['transaction'])):
+            leaf = hashlib.sha256(serialize_transaction(transaction)).hexdigest()
+            valid = verify_proof(leaf, data['proof'], data['merkle_root'], raw)
+            if valid:
+                break
+        return jsonify({'valid': valid, 'leaf': leaf}), 200
+    valid = verify_proof(leaf, data['proof'], data['merkle_root'], raw)
+    return jsonify({'valid': valid, 'leaf': leaf}), 200
+
 @app.route('/balance', methods=['GET'])
+@reads_state
 def get_balance():
     address = request.args.get('address')
     if not address:
         return jsonify({'message': 'Missing address parameter'}), 400
     
-    print(f"Retrieving balance for {address}")
+    logger.debug("Retrieving balance for %s", address)
     balance = blockchain.get_balance(clean_public_key(address))
-    return jsonify({'balance': balance}), 200
+    return jsonify({'balance': to_bbc(balance)}), 200
 
 # def get_balance(self, address):
 #    """Obtiene el balance total de una dirección incluyendo todas sus direcciones asociadas"""
@@ -461,6 +759,7 @@ def get_balance():
 #    return total_balance
     
 @app.route('/escrow/create', methods=['POST'])
+@writes_state
 def create_escrow():
     try:
         values = request.get_json()
@@ -478,7 +777,7 @@ def create_escrow():
             agreement_id=agreement_id,
             buyer=values['buyer'],
             seller=values['seller'],
-            amount=float(values['amount']),
+            amount=to_units(values['amount']),
             description=values['description'],
             buyer_private_key=values['privateKey']
         )
@@ -492,6 +791,7 @@ def create_escrow():
         return jsonify({'error': str(e)}), 400
 
 @app.route('/escrow/confirm-shipment', methods=['POST'])
+@writes_state
 def confirm_shipment():
     try:
         values = request.get_json()
@@ -515,6 +815,7 @@ def confirm_shipment():
         return jsonify({'error': str(e)}), 400
     
 @app.route('/escrow/confirm-seller', methods=['POST'])
+@writes_state
 def confirm_seller():
     try:
         values = request.get_json()
@@ -533,6 +834,7 @@ def confirm_seller():
         return jsonify({'error': str(e)}), 400
 
 @app.route('/escrow/confirm-delivery', methods=['POST'])
+@writes_state
 def confirm_delivery():
     try:
         values = request.get_json()
@@ -552,6 +854,7 @@ def confirm_delivery():
         return jsonify({'error': str(e)}), 400
 
 @app.route('/escrow/open-dispute', methods=['POST'])
+@writes_state
 def open_dispute():
     try:
         values = request.get_json()
@@ -570,57 +873,195 @@ def open_dispute():
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/escrow/expire', methods=['POST'])
+@writes_state
+def expire_escrow():
+    """Procesa ahora los acuerdos vencidos en lugar de esperar al hilo de vencimientos"""
+    expired = blockchain.escrow_contract.expire_agreements()
+    return jsonify({
+        'expired': expired,
+        'next_deadline': blockchain.escrow_contract.scheduler.next_deadline()
+    }), 200
+
+MAX_ESCROW_BATCH = 5000  # Operaciones por petición a /escrow/batch
+
+# Campos requeridos por operación, los mismos que en la ruta individual
+ESCROW_BATCH_REQUIRED = {
+    'create': ['buyer', 'seller', 'amount', 'description', 'privateKey'],
+    'confirm-seller': ['agreement_id', 'seller'],
+    'confirm-shipment': ['agreement_id', 'seller', 'tracking_info'],
+    'confirm-delivery': ['agreement_id', 'buyer'],
+    'open-dispute': ['agreement_id', 'buyer', 'reason']
+}
+
+def apply_escrow_operation(operation):
+    """Aplica una operación de cambio de estado de /escrow/batch (todas menos create)"""
+    contract = blockchain.escrow_contract
+    action = operation['action']
+    if action == 'confirm-seller':
+        contract.confirm_seller_participation(operation['agreement_id'], operation['seller'])
+    elif action == 'confirm-shipment':
+        contract.confirm_shipment(operation['agreement_id'], operation['seller'], operation['tracking_info'])
+    elif action == 'confirm-delivery':
+        contract.confirm_delivery(operation['agreement_id'], operation['buyer'])
+    elif action == 'open-dispute':
+        contract.open_dispute(operation['agreement_id'], operation['buyer'], operation['reason'])
+    return contract.state['agreements'][operation['agreement_id']]['status']
+
+@app.route('/escrow/batch', methods=['POST'])
+def escrow_batch():
+    """
+    Aplica una lista de operaciones de escrow con un solo lock de escritura:
+
+        {"operations": [{"action": "create" | "confirm-seller" | "confirm-shipment"
+                                   | "confirm-delivery" | "open-dispute", ...campos}]}
+
+    Las operaciones se aplican en orden y cada una responde por separado
+    (un fallo no deshace las demás). Los depósitos de todos los create se
+    firman antes de tomar el lock; los create consecutivos se aplican juntos
+    con un balance por comprador.
+    """
+    values = request.get_json() or {}
+    operations = values.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'Missing operations'}), 400
+    if len(operations) > MAX_ESCROW_BATCH:
+        return jsonify({'error': f'At most {MAX_ESCROW_BATCH} operations per batch'}), 400
+
+    contract = blockchain.escrow_contract
+    results = [None] * len(operations)
+    create_items = {}  # posición en el lote -> solicitud de create
+
+    batch_time = time()
+    for i, operation in enumerate(operations):
+        action = operation.get('action') if isinstance(operation, dict) else None
+        required = ESCROW_BATCH_REQUIRED.get(action)
+        if required is None or not all(k in operation for k in required):
+            results[i] = {'index': i, 'action': action, 'ok': False, 'error': 'Missing values'}
+            continue
+        if action != 'create':
+            continue
+        try:
+            amount = to_units(operation['amount'])
+        except (TypeError, ValueError):
+            results[i] = {'index': i, 'action': action, 'ok': False, 'error': 'Invalid amount'}
+            continue
+        # La posición en el lote evita IDs repetidos entre acuerdos creados en el mismo instante
+        agreement_id = hashlib.sha256(
+            f"{operation['buyer']}{operation['seller']}{batch_time}{i}".encode()
+        ).hexdigest()
+        create_items[i] = {
+            'agreement_id': agreement_id,
+            'buyer': operation['buyer'],
+            'seller': operation['seller'],
+            'amount': amount,
+            'description': operation['description'],
+            'buyer_private_key': operation['privateKey']
+        }
+
+    # Las firmas ECDSA (hasta MAX_ESCROW_BATCH) se calculan sin bloquear a los demás
+    deposits = dict(zip(create_items, contract.sign_deposits(list(create_items.values()))))
+
+    creates = []
+
+    def flush_creates():
+        errors = contract.create_agreements([create_items[i] for i in creates], [deposits[i] for i in creates])
+        for i, error in zip(creates, errors):
+            results[i] = ({'index': i, 'action': 'create', 'ok': True, 'agreement_id': create_items[i]['agreement_id']}
+                          if error is None else {'index': i, 'action': 'create', 'ok': False, 'error': error})
+        creates.clear()
+
+    with blockchain.state_lock.write():
+        for i, operation in enumerate(operations):
+            if results[i] is not None:
+                continue
+            if i in create_items:
+                creates.append(i)
+                continue
+
+            # Los create pendientes se aplican antes para respetar el orden del lote
+            if creates:
+                flush_creates()
+            action = operation['action']
+            try:
+                status = apply_escrow_operation(operation)
+                results[i] = {'index': i, 'action': action, 'ok': True, 'status': status}
+            except Exception as e:
+                results[i] = {'index': i, 'action': action, 'ok': False, 'error': str(e)}
+        if creates:
+            flush_creates()
+
+    succeeded = sum(1 for result in results if result['ok'])
+    return jsonify({
+        'results': results,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded
+    }), 200
+
 @app.route('/escrow/agreements/<wallet_address>', methods=['GET'])
+@reads_state
 def get_agreements(wallet_address):
     """Obtiene todos los acuerdos relacionados con una dirección"""
     try:
-        active_agreements = []
-        completed_agreements = []
-        cancelled_agreements = []
-        
-        for agreement_id, agreement in blockchain.escrow_contract.state['agreements'].items():
-            if agreement['buyer'] == wallet_address or agreement['seller'] == wallet_address:
-                agreement_copy = agreement.copy()
-                agreement_copy['id'] = agreement_id
-                
-                # Clasificar acuerdos según su estado
-                if agreement['status'] == 'COMPLETED':
-                    completed_agreements.append(agreement_copy)
-                elif agreement['status'] == 'CANCELLED':
-                    cancelled_agreements.append(agreement_copy)
-                else:
-                    active_agreements.append(agreement_copy)
-                    
-        # Ordenar cada lista por timestamp (más recientes primero)
-        active_agreements.sort(key=lambda x: x['timestamp'], reverse=True)
-        completed_agreements.sort(key=lambda x: x['timestamp'], reverse=True)
-        cancelled_agreements.sort(key=lambda x: x['timestamp'], reverse=True)
-        
-        # Combinar las listas en el orden deseado
-        all_agreements = active_agreements + completed_agreements + cancelled_agreements
-        
-        return jsonify({'agreements': all_agreements}), 200
+        # Activos, completados y cancelados, cada grupo del más reciente al más viejo,
+        # tal como los mantiene el índice del contrato
+        agreements = blockchain.escrow_contract.agreements_for(wallet_address)
+        return jsonify({'agreements': [agreement_view(agreement) for agreement in agreements]}), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/escrow/agreement/<agreement_id>', methods=['GET'])
+@reads_state
 def get_agreement(agreement_id):
     try:
         agreement = blockchain.escrow_contract.get_agreement(agreement_id)
         if not agreement:
             return jsonify({'error': 'Agreement not found'}), 404
 
-        return jsonify(agreement), 200
+        return jsonify(agreement_view(agreement)), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 400
     
+@app.route('/snapshot', methods=['POST'])
+def create_snapshot():
+    """Fuerza un snapshot del estado del nodo (requiere BLOCKCHAIN_DATA_DIR)"""
+    if not blockchain.save_snapshot():
+        return jsonify({'error': 'Los snapshots requieren BLOCKCHAIN_DATA_DIR'}), 400
+    return jsonify({'message': 'Snapshot guardado', 'height': len(blockchain.chain)}), 200
+
+@app.route('/audit/replay', methods=['GET', 'POST'])
+def audit_replay():
+    """
+    Recalcula los balances recorriendo la cadena y los compara con los
+    actuales. Con POST, además reemplaza los balances por los recalculados
+    (para recuperar un estado dañado). ?workers=N reparte el replay por shards.
+    """
+    workers = request.args.get('workers', 1, type=int)
+    rebuild = request.method == 'POST'
+    with blockchain.state_lock.write() if rebuild else blockchain.state_lock.read():
+        result, mismatches = blockchain.audit_state(workers)
+        if rebuild:
+            blockchain.rebuild_state(result)
+    response = result.summary()
+    response['mismatches'] = {address: balances_view(values) for address, values in mismatches.items()}
+    response['locked_funds'] = balances_view(result.locked_funds)
+    if rebuild:
+        response['rebuilt'] = True
+    return jsonify(response), 200
+
+@app.route('/stats/crypto-cache', methods=['GET'])
+def crypto_cache_stats():
+    """Aciertos, fallos y desalojos de las cachés de verificación de firmas"""
+    return jsonify(get_cache_stats()), 200
+
 @app.route('/settings/difficulty', methods=['GET'])
 def get_difficulty():
     return jsonify({'difficulty': blockchain.mining_difficulty}), 200
 
 @app.route('/settings/difficulty', methods=['POST'])
+@writes_state
 def set_difficulty():
     try:
         data = request.get_json()
@@ -629,11 +1070,12 @@ def set_difficulty():
         if difficulty is None or not isinstance(difficulty, int) or difficulty < 0 or difficulty > 4:
             return jsonify({'error': 'Invalid difficulty value'}), 400
             
-        print(f"Actualizando dificultad de minado a {difficulty} ceros")
+        logger.info("Actualizando dificultad de minado a %s ceros", difficulty)
         blockchain.mining_difficulty = difficulty
         return jsonify({'message': 'Difficulty updated successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # Servidor de desarrollo (recarga y depurador); para producción usar serve.py
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
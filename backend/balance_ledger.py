@@ -0,0 +1,89 @@
+# balance_ledger.py
+
+
+class BalanceLedger(dict):
+    """
+    Diccionario de balances que mantiene índices para consultas O(1):
+
+    - parent_of: dirección asociada -> wallet principal
+    - wallet_totals: wallet principal -> balance propio + balances de sus direcciones
+
+    Toda escritura (balances[x] = ..., balances[x] += ...) pasa por __setitem__,
+    así que el código que ya modifica balances directamente sigue siendo válido.
+    Si se asigna listener, se le llama con cada dirección cuyo balance cambió.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.parent_of = {}
+        self.children = {}
+        self.wallet_totals = {}
+        self.listener = None
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, address, value):
+        previous = self.get(address, 0)
+        super().__setitem__(address, value)
+        self._refresh_total(address, value - previous)
+
+    def __delitem__(self, address):
+        previous = self[address]
+        super().__delitem__(address)
+        self._refresh_total(address, -previous)
+
+    def update(self, *args, **kwargs):
+        for address, value in dict(*args, **kwargs).items():
+            self[address] = value
+
+    def setdefault(self, address, default=0):
+        if address not in self:
+            self[address] = default
+        return self[address]
+
+    def pop(self, address, *default):
+        present = address in self
+        value = super().pop(address, *default)
+        if present:
+            self._refresh_total(address, -value)
+        return value
+
+    def clear(self):
+        super().clear()
+        for wallet in self.wallet_totals:
+            self.wallet_totals[wallet] = 0
+
+    def link(self, wallet, address):
+        """Registra una dirección asociada a una wallet principal"""
+        if self.parent_of.get(address) == wallet:
+            return
+        self.parent_of[address] = wallet
+        self.children.setdefault(wallet, []).append(address)
+        self._recompute(wallet)
+
+    def total(self, address):
+        """
+        Balance de una dirección con la misma semántica que el recorrido original:
+        una wallet principal suma sus direcciones asociadas, una dirección
+        asociada solo devuelve su propio balance.
+        """
+        if address in self.wallet_totals:
+            return self.wallet_totals[address]
+        return self.get(address, 0)
+
+    def _refresh_total(self, address, delta):
+        # Los montos son enteros, así que ajustar por la diferencia es exacto
+        if address in self.wallet_totals:
+            self.wallet_totals[address] += delta
+        parent = self.parent_of.get(address)
+        if parent is not None:
+            self.wallet_totals[parent] += delta
+        if self.listener is not None:
+            self.listener(address)
+            if parent is not None:
+                self.listener(parent)
+
+    def _recompute(self, wallet):
+        total = self.get(wallet, 0)
+        for address in self.children.get(wallet, ()):
+            total += self.get(address, 0)
+        self.wallet_totals[wallet] = total
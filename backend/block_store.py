@@ -0,0 +1,401 @@
+# block_store.py
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from encoding import json_default
+from records import Block
+
+RECORD_HEADER = struct.Struct('>II')      # longitud del bloque serializado, crc32
+INDEX_ENTRY = struct.Struct('>QI32s')     # offset en el segmento, longitud, hash del bloque
+HASH_HEADER = struct.Struct('>QQ')        # capacidad de la tabla, entradas ocupadas
+HASH_SLOT = struct.Struct('>32sQ')        # hash del bloque, altura + 1 (0 = libre)
+INITIAL_HASH_CAPACITY = 1024
+SEGMENT_CHUNK = 1 << 20                   # capacidad inicial del segmento (bytes)
+INDEX_CHUNK = 4096 * INDEX_ENTRY.size     # capacidad inicial del índice (bytes)
+
+logger = logging.getLogger(__name__)
+
+
+class BlockStore:
+    """
+    Almacén de bloques en disco, de solo anexado.
+
+    - blocks.dat: registros [longitud][crc32][bloque en JSON]
+    - blocks.idx: una entrada de tamaño fijo por altura (offset, longitud, hash)
+    - hashes.idx: tabla hash de direccionamiento abierto hash -> altura
+
+    Los tres archivos se leen con mmap, así que acceder a un bloque por altura
+    o por hash es O(1) y solo los bloques recientes se mantienen en memoria.
+    Segmento e índice se amplían con ceros duplicando su capacidad, de modo
+    que solo se vuelven a mapear cuando esta se agota; al cerrar se recortan
+    a los datos reales. Los mapas reemplazados no se cierran hasta close():
+    un lector que todavía tenga el anterior sigue leyendo datos válidos.
+    Se comporta como una lista (len, índices, slices, append, pop) para poder
+    usarse directamente como Blockchain.chain.
+    """
+
+    def __init__(self, directory, sync=True, cache_size=64):
+        os.makedirs(directory, exist_ok=True)
+        self.segment_path = os.path.join(directory, 'blocks.dat')
+        self.index_path = os.path.join(directory, 'blocks.idx')
+        self.hash_index_path = os.path.join(directory, 'hashes.idx')
+        self.sync = sync
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()  # varios lectores comparten la caché LRU
+
+        self.segment = self.open_file(self.segment_path)
+        self.index = self.open_file(self.index_path)
+        self.segment_map = None
+        self.index_map = None
+        self.retired_maps = []  # mapas reemplazados al ampliar; se cierran en close()
+        self.hash_file = None
+        self.hash_map = None
+
+        self.recover()
+        self.reserve(self.segment_size, self.count * INDEX_ENTRY.size)
+        self.open_hash_index()
+
+    # --- Interfaz de lista ---
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for height in range(self.count):
+            yield self.read(height)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.read(height) for height in range(*key.indices(self.count))]
+        if key < 0:
+            key += self.count
+        if not 0 <= key < self.count:
+            raise IndexError("Altura de bloque fuera de rango")
+        return self.read(key)
+
+    def append(self, block):
+        """Añade un bloque al final del segmento y lo indexa"""
+        payload = json.dumps(block, sort_keys=True, separators=(',', ':'), default=json_default).encode()
+        offset = self.segment_size
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        self.reserve(offset + len(record), (self.count + 1) * INDEX_ENTRY.size)
+
+        # Primero los datos y después el índice: si el proceso muere entre
+        # ambas escrituras, recover() vuelve a indexar el registro completo
+        self.write(self.segment, offset, record)
+        self.write(self.index, self.count * INDEX_ENTRY.size,
+                   INDEX_ENTRY.pack(offset, len(payload), bytes.fromhex(block['hash'])))
+
+        self.segment_size += len(record)
+        self.count += 1
+        self.hash_insert(bytes.fromhex(block['hash']), self.count - 1)
+
+    def pop(self):
+        """Elimina el último bloque (borrando su registro y su entrada) y lo devuelve"""
+        if not self.count:
+            raise IndexError("pop de un almacén vacío")
+        height = self.count - 1
+        block = self.read(height)
+        offset, _, block_hash = self.entry(height)
+
+        # Primero la cabecera del registro y después la entrada del índice: si
+        # el proceso muere entre ambas, recover() descarta la entrada porque ya
+        # no apunta a un registro válido
+        self.write(self.segment, offset, bytes(RECORD_HEADER.size))
+        self.write(self.index, height * INDEX_ENTRY.size, bytes(INDEX_ENTRY.size))
+
+        self.count = height
+        self.segment_size = offset
+        with self.cache_lock:
+            self.cache.pop(height, None)
+        self.hash_delete(block_hash)
+        return block
+
+    # --- Consultas ---
+
+    def get_by_hash(self, block_hash):
+        """Devuelve el bloque con el hash dado, o None"""
+        height = self.height_of(block_hash)
+        return None if height is None else self.read(height)
+
+    def height_of(self, block_hash):
+        """Altura (0-based) del bloque con el hash dado, o None"""
+        try:
+            key = bytes.fromhex(block_hash)
+        except (TypeError, ValueError):
+            return None
+        capacity = self.hash_capacity()
+        slot = self.hash_slot(key, capacity)
+        for _ in range(capacity):
+            stored, height = HASH_SLOT.unpack_from(self.hash_map, self.slot_offset(slot))
+            if height == 0:
+                return None
+            if stored == key and height - 1 < self.count:
+                return height - 1
+            slot = (slot + 1) % capacity
+        return None
+
+    def fingerprint(self, height):
+        """Huella de un bloque sin deserializarlo: entrada del índice y crc del registro"""
+        offset, length, block_hash = self.entry(height)
+        _, crc = RECORD_HEADER.unpack_from(self.segment_map, offset)
+        return offset, length, crc, block_hash
+
+    def read(self, height):
+        with self.cache_lock:
+            block = self.cache.get(height)
+            if block is not None:
+                self.cache.move_to_end(height)
+                return block
+
+        # La deserialización queda fuera del lock; si dos lectores leen el
+        # mismo bloque a la vez, el segundo solo reemplaza una copia idéntica
+        offset, length, _ = self.entry(height)
+        start = offset + RECORD_HEADER.size
+        block = Block(json.loads(self.segment_map[start:start + length]))
+
+        with self.cache_lock:
+            self.cache[height] = block
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return block
+
+    def entry(self, height):
+        return INDEX_ENTRY.unpack_from(self.index_map, height * INDEX_ENTRY.size)
+
+    def close(self):
+        self.close_maps()
+        self.truncate(self.segment, self.segment_size)
+        self.truncate(self.index, self.count * INDEX_ENTRY.size)
+        if self.hash_map is not None:
+            self.hash_map.flush()
+            self.hash_map.close()
+            self.hash_map = None
+        if self.hash_file is not None:
+            self.hash_file.close()
+            self.hash_file = None
+        self.segment.close()
+        self.index.close()
+
+    # --- Recuperación tras una caída ---
+
+    def recover(self):
+        """
+        Deja segmento e índice consistentes: descarta entradas del índice que
+        apuntan a datos incompletos o corruptos, vuelve a indexar registros
+        completos que quedaron sin índice y trunca cualquier registro a medias.
+        """
+        segment_size = os.fstat(self.segment.fileno()).st_size
+        index_size = os.fstat(self.index.fileno()).st_size
+
+        # Tras una caída los archivos pueden conservar el relleno con ceros de
+        # la última ampliación; las entradas vacías (longitud 0) van siempre al final
+        low, high = 0, index_size // INDEX_ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.read_index_entry(middle)[1]:
+                low = middle + 1
+            else:
+                high = middle
+        count = low
+
+        end = 0
+        while count:
+            offset, length, _ = self.read_index_entry(count - 1)
+            if self.read_record(offset, length, segment_size) is not None:
+                end = offset + RECORD_HEADER.size + length
+                break
+            count -= 1
+
+        recovered = []
+        position = end
+        while position + RECORD_HEADER.size <= segment_size:
+            self.segment.seek(position)
+            length, _ = RECORD_HEADER.unpack(self.segment.read(RECORD_HEADER.size))
+            if not length:
+                break
+            payload = self.read_record(position, length, segment_size)
+            if payload is None:
+                break
+            block_hash = json.loads(payload)['hash']
+            recovered.append(INDEX_ENTRY.pack(position, length, bytes.fromhex(block_hash)))
+            position += RECORD_HEADER.size + length
+
+        if position < segment_size:
+            self.segment.seek(position)
+            if self.segment.read(RECORD_HEADER.size).strip(b'\0'):
+                logger.warning("Almacén de bloques: descartando %s bytes incompletos", segment_size - position)
+            self.truncate(self.segment, position)
+        if count * INDEX_ENTRY.size != index_size:
+            self.truncate(self.index, count * INDEX_ENTRY.size)
+        if recovered:
+            logger.info("Almacén de bloques: reindexando %s bloques", len(recovered))
+            self.write(self.index, count * INDEX_ENTRY.size, b''.join(recovered))
+
+        self.segment_size = position
+        self.count = count + len(recovered)
+
+    def read_index_entry(self, height):
+        self.index.seek(height * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(self.index.read(INDEX_ENTRY.size))
+
+    def read_record(self, offset, length, segment_size):
+        """Lee un registro y verifica su crc; None si está incompleto o corrupto"""
+        if offset + RECORD_HEADER.size + length > segment_size:
+            return None
+        self.segment.seek(offset)
+        stored_length, crc = RECORD_HEADER.unpack(self.segment.read(RECORD_HEADER.size))
+        payload = self.segment.read(length)
+        if stored_length != length or zlib.crc32(payload) != crc:
+            return None
+        return payload
+
+    # --- Índice por hash ---
+
+    def open_hash_index(self):
+        """Abre la tabla hash; si no coincide con el índice por altura se reconstruye"""
+        if os.path.exists(self.hash_index_path) and os.path.getsize(self.hash_index_path) > HASH_HEADER.size:
+            self.hash_file = open(self.hash_index_path, 'r+b')
+            self.hash_map = mmap.mmap(self.hash_file.fileno(), 0)
+            capacity, used = HASH_HEADER.unpack_from(self.hash_map, 0)
+            expected_size = HASH_HEADER.size + capacity * HASH_SLOT.size
+            consistent = (len(self.hash_map) == expected_size and used == self.count and
+                          (not self.count or self.height_of(self.entry(self.count - 1)[2].hex()) == self.count - 1))
+            if consistent:
+                return
+        self.rebuild_hash_index()
+
+    def rebuild_hash_index(self, capacity=None):
+        capacity = capacity or INITIAL_HASH_CAPACITY
+        while capacity < self.count * 2:
+            capacity *= 2
+
+        if self.hash_map is not None:
+            self.hash_map.close()
+        if self.hash_file is not None:
+            self.hash_file.close()
+
+        with open(self.hash_index_path, 'wb') as f:
+            f.write(HASH_HEADER.pack(capacity, 0))
+            f.truncate(HASH_HEADER.size + capacity * HASH_SLOT.size)
+        self.hash_file = open(self.hash_index_path, 'r+b')
+        self.hash_map = mmap.mmap(self.hash_file.fileno(), 0)
+
+        for height in range(self.count):
+            self.hash_insert(self.entry(height)[2], height, resize=False)
+
+    def hash_insert(self, key, height, resize=True):
+        capacity, used = HASH_HEADER.unpack_from(self.hash_map, 0)
+        if resize and (used + 1) * 2 > capacity:
+            self.rebuild_hash_index(capacity * 2)
+            capacity, used = HASH_HEADER.unpack_from(self.hash_map, 0)
+            if used == self.count:
+                return
+
+        slot = self.hash_slot(key, capacity)
+        while HASH_SLOT.unpack_from(self.hash_map, self.slot_offset(slot))[1] != 0:
+            slot = (slot + 1) % capacity
+        HASH_SLOT.pack_into(self.hash_map, self.slot_offset(slot), key, height + 1)
+        HASH_HEADER.pack_into(self.hash_map, 0, capacity, used + 1)
+
+    def hash_delete(self, key):
+        """
+        Borra una clave de la tabla sin reconstruirla. Con sondeo lineal no
+        basta con liberar la posición: las entradas siguientes del mismo grupo
+        que la habían saltado se desplazan hacia atrás para seguir encontrándose.
+        """
+        capacity, used = HASH_HEADER.unpack_from(self.hash_map, 0)
+        hole = self.hash_slot(key, capacity)
+        for _ in range(capacity):
+            stored, height = HASH_SLOT.unpack_from(self.hash_map, self.slot_offset(hole))
+            if height == 0:
+                return
+            if stored == key:
+                break
+            hole = (hole + 1) % capacity
+        else:
+            return
+
+        slot = (hole + 1) % capacity
+        while True:
+            stored, height = HASH_SLOT.unpack_from(self.hash_map, self.slot_offset(slot))
+            if height == 0:
+                break
+            # La entrada puede ocupar el hueco si su posición ideal no está entre el hueco y ella
+            ideal = self.hash_slot(stored, capacity)
+            if (slot - ideal) % capacity >= (slot - hole) % capacity:
+                HASH_SLOT.pack_into(self.hash_map, self.slot_offset(hole), stored, height)
+                hole = slot
+            slot = (slot + 1) % capacity
+        HASH_SLOT.pack_into(self.hash_map, self.slot_offset(hole), bytes(32), 0)
+        HASH_HEADER.pack_into(self.hash_map, 0, capacity, used - 1)
+
+    def hash_capacity(self):
+        return HASH_HEADER.unpack_from(self.hash_map, 0)[0]
+
+    @staticmethod
+    def hash_slot(key, capacity):
+        return int.from_bytes(key[:8], 'big') % capacity
+
+    @staticmethod
+    def slot_offset(slot):
+        return HASH_HEADER.size + slot * HASH_SLOT.size
+
+    # --- Archivos ---
+
+    @staticmethod
+    def open_file(path):
+        """Abre (o crea) un archivo para escribir en posiciones arbitrarias"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        return os.fdopen(fd, 'r+b')
+
+    def write(self, f, offset, data):
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+
+    def truncate(self, f, size):
+        f.truncate(size)
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+
+    def reserve(self, segment_size, index_size):
+        """Garantiza capacidad para los tamaños dados; solo amplía y remapea al agotarse"""
+        self.segment_map = self.grow(self.segment, self.segment_map, segment_size, SEGMENT_CHUNK)
+        self.index_map = self.grow(self.index, self.index_map, index_size, INDEX_CHUNK)
+
+    def grow(self, f, current, size, chunk):
+        capacity = len(current) if current is not None else 0
+        if current is not None and size <= capacity:
+            return current
+        capacity = max(capacity, chunk)
+        while capacity < size:
+            capacity *= 2
+        # El archivo se extiende con ceros (disperso); los datos ya escritos no se tocan
+        self.truncate(f, capacity)
+        if current is not None:
+            self.retired_maps.append(current)
+        return mmap.mmap(f.fileno(), capacity, access=mmap.ACCESS_READ)
+
+    def close_maps(self):
+        if self.segment_map is not None:
+            self.segment_map.close()
+            self.segment_map = None
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        for retired in self.retired_maps:
+            retired.close()
+        self.retired_maps = []
@@ -1,39 +1,90 @@
 import hashlib
 import json
+import logging
+import os
 from time import time
 import threading
+from collections import OrderedDict
 from secure_escrow_contract import SecureEscrowContract
-from crypto_utils import verify_signature, sign_transaction
+from crypto_utils import verify_signature, verify_signatures_batch, sign_transaction
+from balance_ledger import BalanceLedger
+from block_store import BlockStore
+from mempool import Mempool, transaction_id
+from events import EventBus
+from proof_of_work import ParallelMiner, make_nonce_hasher, MAX_NONCE
+from mining_progress import MiningProgressReporter
+from encoding import ENCODING_JSON, ENCODING_BINARY, ENCODING_FIELD, hash_block, json_default
+from records import Block, Transaction, fingerprint
+from merkle import MerkleTree
+from chain_index import ChainIndex
+from concurrency import ReadWriteLock
+from snapshot import (SNAPSHOT_FILE, SNAPSHOT_VERSION, DEFAULT_SNAPSHOT_INTERVAL, WALLET_JOURNAL_FILE,
+                      append_journal, encode_state, read_journal, read_snapshot, write_snapshot)
+from replay import ChainReplayer, initial_balances
+from amounts import UNITS_PER_BBC, INITIAL_ESCROW_BALANCE, INITIAL_WALLET_BALANCE, amount_units, to_bbc
+
+PARALLEL_MIN_DIFFICULTY = 3  # Por debajo de esta dificultad se mina en un solo proceso
+SIGNATURE_BATCH_BLOCKS = 256  # Bloques cuyas firmas se verifican en un mismo lote
+MERKLE_CACHE_SIZE = 256  # Árboles de Merkle de bloques verificados que se conservan
+
+logger = logging.getLogger(__name__)
 
 class Blockchain:
-    def __init__(self):
-        self.chain = []
-        self.mempool = []
+    def __init__(self, data_dir=None, encoding=ENCODING_JSON, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL):
+        # Con data_dir la cadena vive en disco (BlockStore); sin él, en memoria
+        self.chain = BlockStore(data_dir) if data_dir else []
+        # El estado (balances, claves, escrow, mempool) se guarda cada snapshot_interval
+        # bloques junto a la cadena; 0 desactiva los snapshots automáticos
+        self.snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE) if data_dir else None
+        self.journal_path = os.path.join(data_dir, WALLET_JOURNAL_FILE) if data_dir else None
+        self.snapshot_interval = snapshot_interval
+        self.mempool = Mempool()  # Transacciones pendientes indexadas por txid y comisión
         self.nodes = set()
-        self.balances = {}  # Initialize empty balances
+        self.events = EventBus()  # Eventos para los clientes suscritos a /events
+        self.balances = BalanceLedger()  # Balances con índice por wallet principal
+        self.balances.listener = self.publish_balance
         self.public_keys = {}  # Initialize empty public keys
         self.last_block_hash = '1'
-        self.block_reward = 10
+        self.block_reward = 10 * UNITS_PER_BBC  # En unidades (ver amounts.py)
         self.halving_blocks = 2
         self.wallet_addresses = {}  # Almacena direcciones adicionales por wallet
+        self.pending_spend = {}  # remitente -> (transacciones en mempool, monto + comisión comprometidos)
+        self.in_flight = {}  # txid -> transacción retirada de la mempool por un minado en curso
         self.mining_difficulty = 4  # Dificultad inicial
+        self.mining_workers = os.cpu_count() or 1  # Procesos para la prueba de trabajo
+        # Codificación de los bloques y transacciones nuevos (ver encoding.py);
+        # los bloques existentes se validan con la codificación que indican
+        self.encoding = encoding
+        self.use_header_template = True  # Serializar el bloque una vez y solo parchear el nonce
+
+        # Punto de control de validate_chain: bloques ya verificados y su huella
+        self.validated_height = 0
+        self.validated_hash = None
+        self.block_fingerprints = []
+        self.merkle_trees = OrderedDict()  # hash del bloque -> MerkleTree con todos sus niveles
+        # El punto de control y la caché de árboles también cambian desde rutas de lectura
+        self.cache_lock = threading.RLock()
+        self.chain_index = ChainIndex()    # txid y dirección -> ubicación en la cadena
+        self.last_commit = None  # (hash, direcciones, balances previos) del último bloque minado
         
         self.mining_stopped = False
         self.mining_lock = threading.Lock()  # Agregar un lock para sincronización
-        self.current_mining_progress = {
-            'status': 'not_started',
-            'nonce': 0,
-            'hash': '',
-            'found': False,
-            'final_nonce': None,
-            'final_hash': None
-        }
+        # Lectores/escritor sobre balances, mempool, claves, escrow y la cadena: las
+        # rutas de consulta leen en paralelo; las que modifican estado y mine() (al
+        # armar y al aplicar el bloque, nunca durante la prueba de trabajo) escriben
+        self.state_lock = ReadWriteLock()
+        self.closed = False
+        self.mining_progress = MiningProgressReporter(listener=self.publish_mining_progress)
         
         # Inicializar smart contract
         self.escrow_contract = SecureEscrowContract(self)
-        self.balances[self.escrow_contract.address] = 1000 # Inicializar balance del contrato
+        self.balances[self.escrow_contract.address] = INITIAL_ESCROW_BALANCE # Inicializar balance del contrato
         self.balances['mediator'] = 0 # Inicializar cuenta del mediador
 
+        if len(self.chain):
+            self.load_stored_chain()
+            return
+
         # Crear bloque génesis
         genesis_block = {
             'index': 1,
@@ -49,7 +100,204 @@ class Blockchain:
         genesis_block['nonce'], genesis_block['hash'] = self.calculate_hash(genesis_block)
         self.last_block_hash = genesis_block['hash']
         # Añadir bloque génesis
-        self.chain.append(genesis_block)
+        self.chain.append(Block(genesis_block))
+        self.chain_index.sync(self.chain)
+
+    def load_stored_chain(self):
+        """
+        Continúa una cadena recuperada del almacén en disco. Sus bloques ya se
+        validaron antes de escribirse y el almacén verifica el crc de cada
+        registro, así que se toman como punto de control de la validación.
+        """
+        self.last_block_hash = self.chain[-1]['hash']
+        self.block_fingerprints = [self.chain_fingerprint(i) for i in range(len(self.chain))]
+        self.validated_height = len(self.chain)
+        self.validated_hash = self.last_block_hash
+        logger.info("Cadena recuperada del disco: %s bloques", len(self.chain))
+        if not self.restore_snapshot():
+            logger.warning("Sin snapshot de estado: balances, claves y acuerdos empiezan vacíos")
+        self.chain_index.sync(self.chain)
+
+    def capture_state(self):
+        """
+        Estado del nodo que no se puede deducir de la cadena. Comparte dicts con
+        el nodo: se serializa (snapshot.encode_state) sin soltar el lock de lectura.
+        """
+        height = len(self.chain)
+        return {
+            'version': SNAPSHOT_VERSION,
+            'created_at': time(),
+            'height': height,
+            'tip_hash': self.chain[height - 1]['hash'],
+            'checkpoint': {
+                'validated_height': self.validated_height,
+                'validated_hash': self.validated_hash
+            },
+            'mining_difficulty': self.mining_difficulty,
+            'balances': dict(self.balances),
+            'public_keys': dict(self.public_keys),
+            'wallet_addresses': {wallet: list(addresses) for wallet, addresses in self.wallet_addresses.items()},
+            'escrow': {
+                'agreements': dict(self.escrow_contract.state['agreements']),
+                'locked_funds': dict(self.escrow_contract.state['locked_funds'])
+            },
+            # Las transacciones de un minado en curso siguen pendientes hasta confirmarse
+            'mempool': [dict(tx) for tx in self.mempool] + [dict(tx) for tx in self.in_flight.values()],
+            'chain_index': self.chain_index.dump()
+        }
+
+    def save_snapshot(self):
+        """Guarda un snapshot del estado junto a la cadena; devuelve False si no hay data_dir"""
+        if not self.snapshot_path:
+            return False
+        self.write_encoded_snapshot(*self.encode_snapshot())
+        return True
+
+    def encode_snapshot(self):
+        """(altura, estado serializado) tomados con el lock de lectura"""
+        with self.state_lock.read():
+            return len(self.chain), encode_state(self.capture_state())
+
+    def write_encoded_snapshot(self, height, data):
+        """Comprime y escribe a disco un estado ya serializado; no toma el lock"""
+        size = write_snapshot(self.snapshot_path, data, sync=getattr(self.chain, 'sync', True))
+        logger.info("Snapshot de estado guardado a la altura %s (%s bytes)", height, size)
+
+    def shutdown(self):
+        """
+        Cierre ordenado: detiene el minado en curso, espera a que termine de
+        aplicar su bloque, guarda el snapshot y cierra el almacén de bloques.
+        """
+        if self.closed:
+            return
+        self.stop_mining()
+        with self.mining_lock:
+            self.closed = True
+            self.save_snapshot()
+            logger.info("Nodo detenido a la altura %s", len(self.chain))
+            if hasattr(self.chain, 'close'):
+                self.chain.close()
+
+    def restore_snapshot(self):
+        """
+        Restaura el último snapshot si corresponde a esta cadena. Los bloques
+        añadidos después del snapshot se aplican encima, así que el costo es
+        proporcional al estado y no a la longitud de la cadena.
+        """
+        state = read_snapshot(self.snapshot_path) if self.snapshot_path else None
+        if state is None:
+            return False
+        height = state['height']
+        if height > len(self.chain) or self.chain[height - 1]['hash'] != state['tip_hash']:
+            logger.warning("El snapshot (altura %s) no corresponde a la cadena almacenada; se ignora", height)
+            return False
+
+        try:
+            self.load_snapshot_state(state)
+        except Exception as e:
+            # Sin esto una cadena que no se puede reaplicar impediría arrancar el nodo
+            logger.error("No se pudo restaurar el snapshot (altura %s): %s; se empieza con el estado vacío",
+                         height, e)
+            self.reset_state()
+            return False
+        logger.info("Estado restaurado del snapshot a la altura %s (%s bloques aplicados después)",
+                    height, len(self.chain) - height)
+        return True
+
+    def load_snapshot_state(self, state):
+        height = state['height']
+        self.mining_difficulty = state['mining_difficulty']
+        self.public_keys = state['public_keys']
+        self.wallet_addresses = state['wallet_addresses']
+        self.balances.clear()
+        self.balances.update(state['balances'])
+        for wallet, addresses in self.wallet_addresses.items():
+            for address in addresses:
+                self.balances.link(wallet, address)
+        self.escrow_contract.load_agreements(state['escrow']['agreements'])
+        self.escrow_contract.state['locked_funds'] = state['escrow']['locked_funds']
+        self.chain_index.load(state['chain_index'])
+
+        for transaction in state['mempool']:
+            self.enqueue_transaction(transaction)
+
+        # Wallets y direcciones registradas después del snapshot: antes que los
+        # bloques, que pueden gastar su balance inicial
+        replayed = 0
+        for entry in read_journal(self.journal_path):
+            wallet = entry['wallet']
+            if 'public_key' in entry and wallet not in self.public_keys:
+                self.public_keys[wallet] = entry['public_key']
+                if entry['credit']:
+                    self.balances[wallet] = self.balances.get(wallet, 0) + entry['credit']
+                replayed += 1
+            elif 'address' in entry and entry['address'] not in self.wallet_addresses.get(wallet, ()):
+                self.wallet_addresses.setdefault(wallet, []).append(entry['address'])
+                self.balances[entry['address']] = 0
+                self.balances.link(wallet, entry['address'])
+                replayed += 1
+        if replayed:
+            logger.info("Diario de wallets: %s registros posteriores al snapshot", replayed)
+
+        # Bloques minados después del snapshot: se aplican y se retiran de la mempool
+        for block_height in range(height, len(self.chain)):
+            block = self.chain[block_height]
+            for transaction in block['transactions']:
+                txid = transaction_id(transaction)
+                if txid in self.mempool:
+                    self.remove_from_mempool(txid)
+            self.apply_block(block)
+
+    def reset_state(self):
+        """Deja balances, claves, acuerdos, mempool e índice como en un nodo nuevo"""
+        self.public_keys = {}
+        self.wallet_addresses = {}
+        self.balances.clear()
+        self.balances.parent_of.clear()
+        self.balances.children.clear()
+        self.balances.wallet_totals.clear()
+        self.balances[self.escrow_contract.address] = INITIAL_ESCROW_BALANCE
+        self.balances['mediator'] = 0
+        self.escrow_contract.load_agreements({})
+        self.escrow_contract.state['locked_funds'] = {}
+        self.mempool = Mempool()
+        self.pending_spend = {}
+        self.in_flight = {}
+        self.chain_index.clear()
+
+    def replay_state(self, workers=1):
+        """
+        Recalcula balances y fondos bloqueados recorriendo toda la cadena desde
+        los balances iniciales de las wallets conocidas (ver replay.py).
+        """
+        replayer = ChainReplayer(
+            initial_balances(self.public_keys, self.wallet_addresses, self.escrow_contract.address),
+            self.wallet_addresses,
+            self.escrow_contract.state['agreements'],
+            self.escrow_contract.address,
+            workers
+        )
+        return replayer.replay(self.chain)
+
+    def audit_state(self, workers=1):
+        """Compara los balances actuales con los de un replay; devuelve (resultado, diferencias)"""
+        result = self.replay_state(workers)
+        mismatches = {}
+        for address in set(self.balances) | set(result.balances):
+            current = self.balances.get(address, 0)
+            expected = result.balances.get(address, 0)
+            if current != expected:
+                mismatches[address] = {'current': current, 'expected': expected}
+        if mismatches:
+            logger.warning("Auditoría: %s direcciones con balance distinto al de la cadena", len(mismatches))
+        return result, mismatches
+
+    def rebuild_state(self, result):
+        """Reemplaza los balances y fondos bloqueados por los de un replay"""
+        self.balances.clear()
+        self.balances.update(result.balances)
+        self.escrow_contract.state['locked_funds'] = dict(result.locked_funds)
+        logger.info("Estado reconstruido desde la cadena (%s bloques)", result.blocks)
 
     def stop_mining(self):
         """Detiene el proceso de minado actual"""
@@ -58,97 +306,11 @@ class Blockchain:
     def reset_mining_state(self):
         """Reinicia el estado de minado"""
         self.mining_stopped = False
-        self.current_mining_progress = {
-            'status': 'not_started',
-            'nonce': 0,
-            'hash': '',
-            'found': False,
-            'final_nonce': None,
-            'final_hash': None
-        }
-
-    def calculate_hash(self, block):
-        """Calcula el hash del bloque con prueba de trabajo y emite el progreso"""
-        try:
-            nonce = 0
-            block_copy = block.copy()
-            block_copy.pop('hash', None)  # Eliminar el hash si existe
-            
-            is_genesis = block.get('index') == 1
-            target = '0' * self.mining_difficulty  # Dificultad dinámica
-            
-            if not is_genesis:
-                print(f"\nBuscando nonce para bloque #{block['index']}")
-                self.current_mining_progress = {
-                    'status': 'mining',
-                    'nonce': 0,
-                    'hash': '',
-                    'found': False,
-                    'final_nonce': None,
-                    'final_hash': None
-                }
-            
-            while not self.mining_stopped:
-                block_copy['nonce'] = nonce
-                block_string = json.dumps(block_copy, sort_keys=True).encode()
-                hash_result = hashlib.sha256(block_string).hexdigest()
-                
-                if not is_genesis:
-                    self.current_mining_progress.update({
-                        'status': 'mining',
-                        'nonce': nonce,
-                        'hash': hash_result,
-                        'found': hash_result.startswith(target)
-                    })
-                    
-                    if nonce % 100 == 0:
-                        print(f"\rNonce actual: {nonce}, Hash actual: {hash_result}", end="")
-                
-                if hash_result.startswith(target):
-                    if not is_genesis:
-                        print(f"\n¡Hash válido encontrado!")
-                        print(f"Nonce final: {nonce}")
-                        print(f"Hash final: {hash_result}")
-                        
-                        self.current_mining_progress.update({
-                            'status': 'completed',
-                            'nonce': nonce,
-                            'hash': hash_result,
-                            'found': True,
-                            'final_nonce': nonce,
-                            'final_hash': hash_result
-                        })
-                    return nonce, hash_result
-                
-                nonce += 1
-                
-                if nonce > 1000000:  # Añadir un límite máximo para evitar bucles infinitos
-                    raise ValueError("No se encontró un hash válido después de 1,000,000 intentos")
-            
-            if self.mining_stopped:
-                print("\nMinado detenido manualmente")
-                raise ValueError("Minado detenido manualmente")
-                
-        except Exception as e:
-            print(f"\nError durante el cálculo del hash: {str(e)}")
-            self.current_mining_progress.update({
-                'status': 'error',
-                'error': str(e)
-            })
-            raise
+        self.mining_progress.reset()
 
     def get_mining_progress(self):
-        """Retorna el progreso actual del minado"""
-        if hasattr(self, 'current_mining_progress'):
-            return self.current_mining_progress
-        return {
-            'status': 'not_started',
-            'nonce': 0,
-            'hash': '',
-            'found': False,
-            'final_nonce': None,
-            'final_hash': None
-        }
+        """Retorna el progreso actual del minado (instantánea consistente, sin locks)"""
+        return self.mining_progress.as_dict()
             
     def sign_transaction(self, private_key, transaction):
         """
@@ -163,157 +325,241 @@ class Blockchain:
         """
         return sign_transaction(private_key, transaction)
 
-    def validate_chain(self):
-        """Valida la cadena completa"""
-        if len(self.chain) == 1:
-            return True
+    def tag_encoding(self, record):
+        """Marca una transacción o bloque nuevo con la codificación del nodo (JSON no se marca)"""
+        if self.encoding != ENCODING_JSON:
+            record[ENCODING_FIELD] = self.encoding
+        return record
 
-        for i, block in enumerate(self.chain):
-            if block['index'] > 1 and not self.verify_block(block):
-                print(f"Bloque {block['index']} falló en verify_block")
-                return False
+    def validate_chain(self, full=False):
+        """
+        Valida la cadena a partir del último punto de control verificado.
+
+        Solo se revisan los bloques añadidos desde la última validación. Si la
+        huella de algún bloque ya verificado cambió (o se pide full=True), se
+        descarta el punto de control y se valida la cadena completa.
+        """
+        with self.cache_lock:
+            if len(self.chain) == 1:
+                return True
+
+            start = 0 if full else self.checkpoint_start()
+            if start == 0:
+                self.reset_validation_checkpoint()
+
+            signature_results = {}
+            for i in range(start, len(self.chain)):
+                # Las firmas se verifican en lotes de varios bloques repartidos entre procesos
+                if (i - start) % SIGNATURE_BATCH_BLOCKS == 0:
+                    signature_results = self.verify_block_signatures(self.chain[i:i + SIGNATURE_BATCH_BLOCKS])
+
+                block = self.chain[i]
+                if block['index'] > 1 and not self.verify_block(block, signature_results):
+                    logger.warning("Bloque %s falló en verify_block", block['index'])
+                    return False
             
-            # Verificar el hash del bloque sin usar calculate_hash
-            block_copy = block.copy()
-            block_copy.pop('hash', None)
-            block_string = json.dumps(block_copy, sort_keys=True).encode()
-            calculated_hash = hashlib.sha256(block_string).hexdigest()
+                # Verificar el hash del bloque sin usar calculate_hash
+                calculated_hash = self.verify_block_hash(block)
             
-            if block['hash'] != calculated_hash:
-                print(f"Hash incorrecto en bloque {block['index']}")
-                print(f"Hash esperado: {calculated_hash}")
-                print(f"Hash actual: {block['hash']}")
-                return False
-
-            if i > 0:
-                previous_block = self.chain[i - 1]
-                if block['previous_hash'] != previous_block['hash']:
-                    print(f"Previous hash incorrecto en bloque {block['index']}")
-                    print(f"Hash esperado: {previous_block['hash']}")
-                    print(f"Hash actual: {block['previous_hash']}")
+                if block['hash'] != calculated_hash:
+                    logger.warning("Hash incorrecto en bloque %s (esperado: %s, actual: %s)",
+                                   block['index'], calculated_hash, block['hash'])
                     return False
+
+                if i > 0:
+                    previous_block = self.chain[i - 1]
+                    if block['previous_hash'] != previous_block['hash']:
+                        logger.warning("Previous hash incorrecto en bloque %s (esperado: %s, actual: %s)",
+                                       block['index'], previous_block['hash'], block['previous_hash'])
+                        return False
+
+                self.block_fingerprints.append(self.chain_fingerprint(i))
+                self.validated_height = i + 1
+                self.validated_hash = block['hash']
         
-        return True
+            return True
+
+    @staticmethod
+    def block_fingerprint(block):
+        """Huella de un bloque (ver records.fingerprint); un Block la calcula una sola vez"""
+        return block.fingerprint if isinstance(block, Block) else fingerprint(block)
+
+    def chain_fingerprint(self, height):
+        """Huella del bloque a la altura dada; el almacén en disco la lee sin deserializar"""
+        if hasattr(self.chain, 'fingerprint'):
+            return self.chain.fingerprint(height)
+        return self.block_fingerprint(self.chain[height])
+
+    def checkpoint_start(self):
+        """
+        Devuelve la altura desde la que hay que validar. Es 0 si algún bloque
+        anterior al punto de control ya no coincide con su huella.
+        """
+        height = min(self.validated_height, len(self.chain))
+        for i in range(height):
+            if self.chain_fingerprint(i) != self.block_fingerprints[i]:
+                logger.warning("El bloque %s cambió desde la última validación", i + 1)
+                return 0
+
+        # Si la cadena se acortó, el prefijo restante sigue siendo válido
+        del self.block_fingerprints[height:]
+        self.validated_height = height
+        self.validated_hash = self.chain[height - 1]['hash'] if height else None
+        return height
+
+    def reset_validation_checkpoint(self):
+        """Descarta el punto de control de validación"""
+        self.validated_height = 0
+        self.validated_hash = None
+        self.block_fingerprints = []
 
     def verify_block_hash(self, block):
         """Verifica el hash de un bloque sin prueba de trabajo"""
-        block_copy = block.copy()
-        block_copy.pop('hash', None)
-        block_string = json.dumps(block_copy, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        return hash_block(block)
     
     def is_valid_hash(self, hash_result):
         """Valida si un hash cumple con la dificultad actual"""
         return hash_result.startswith('0' * self.mining_difficulty)
     
-    def verify_block(self, block):
-        """Verifica todas las transacciones en un bloque"""
+    def verify_block(self, block, signature_results=None):
+        """
+        Verifica todas las transacciones en un bloque.
+
+        signature_results permite pasar las firmas ya verificadas en lote
+        (ver verify_block_signatures); si no se pasa, se verifican las del bloque.
+        """
         try:
             if block['index'] == 1:
-                print("Bloque génesis - válido")
+                logger.debug("Bloque génesis - válido")
                 return True
 
-            print(f"\nVerificando bloque {block['index']}:")
+            logger.debug("Verificando bloque %s:", block['index'])
             
             required_fields = ['index', 'timestamp', 'transactions', 'previous_hash', 'merkle_root', 'nonce', 'hash']
             for field in required_fields:
                 if field not in block:
-                    print(f"Error: Falta el campo {field} en el bloque")
+                    logger.warning("Falta el campo %s en el bloque", field)
                     return False
 
             # Verificar el hash del bloque
-            block_copy = block.copy()
-            block_copy.pop('hash', None)
-            block_string = json.dumps(block_copy, sort_keys=True).encode()
-            calculated_hash = hashlib.sha256(block_string).hexdigest()
+            calculated_hash = hash_block(block)
             
             if calculated_hash != block['hash']:
-                print(f"Error: Hash del bloque inválido")
-                print(f"Hash calculado: {calculated_hash}")
-                print(f"Hash almacenado: {block['hash']}")
+                logger.warning("Hash del bloque inválido (calculado: %s, almacenado: %s)",
+                               calculated_hash, block['hash'])
                 return False
                 
             # Verificar que el hash tenga al menos un cero inicial
             # (requisito mínimo de prueba de trabajo)
             if not block['hash'].startswith('0'):
-                print(f"Error: El hash no cumple con el requisito mínimo de prueba de trabajo")
+                logger.warning("El hash no cumple con el requisito mínimo de prueba de trabajo")
                 return False
 
             if not block['transactions']:
-                print("Error: No hay transacciones en el bloque")
+                logger.warning("No hay transacciones en el bloque")
                 return False
                 
             if block['transactions'][0].get('type') != 'coinbase':
-                print("Error: Primera transacción no es coinbase")
+                logger.warning("Primera transacción no es coinbase")
                 return False
 
             # Verificar transacciones
             for i, transaction in enumerate(block['transactions'][1:], 1):
                 if transaction.get('type') == 'contract_transfer':
                     if transaction['sender'] != self.escrow_contract.address:
-                        print(f"Error: Remitente inválido para transacción del contrato")
+                        logger.warning("Remitente inválido para transacción del contrato")
                         return False
                     
                     recipient = transaction['recipient']
                     if recipient != 'mediator' and recipient not in self.balances:
-                        print(f"Error: Destinatario inválido para transacción del contrato")
+                        logger.warning("Destinatario inválido para transacción del contrato")
                         return False
                     
                     if transaction['signature'] != 'VALID':
-                        print(f"Error: Firma inválida para transacción del contrato")
+                        logger.warning("Firma inválida para transacción del contrato")
                         return False
                         
                     continue
                 
                 if 'signature' not in transaction:
-                    print(f"Error: Transacción {i} no tiene firma")
+                    logger.warning("Transacción %s no tiene firma", i)
                     return False
 
                 sender = transaction['sender']
                 if sender not in self.public_keys:
-                    print(f"Error: Clave pública no encontrada para {sender}")
+                    logger.warning("Clave pública no encontrada para %s", sender)
                     return False
 
-                transaction_copy = transaction.copy()
-                signature = transaction_copy.pop('signature')
+                if signature_results is None:
+                    signature_results = self.verify_block_signatures([block])
                 
-                if not verify_signature(self.public_keys[sender], transaction_copy, signature):
-                    print(f"Error: Firma inválida en transacción {i}")
+                if not signature_results.get((block['index'], i), False):
+                    logger.warning("Firma inválida en transacción %s", i)
                     return False
             
-            calculated_merkle = self.calculate_merkle_root(block['transactions'])
-            if calculated_merkle != block['merkle_root']:
-                print("Error: Merkle root no coincide")
+            # El árbol se reconstruye siempre al verificar; solo se cachea si coincide
+            tree = MerkleTree.for_block(block)
+            if tree.root != block['merkle_root']:
+                logger.warning("Merkle root no coincide")
                 return False
+            self.cache_merkle_tree(block['hash'], tree)
                     
-            print("Verificación exitosa!")
+            logger.debug("Verificación exitosa!")
             return True
                 
         except Exception as e:
-            print(f"Error durante la verificación del bloque: {str(e)}")
+            logger.error("Error durante la verificación del bloque: %s", e)
             return False
 
+    def signature_checks(self, block):
+        """Firmas a verificar de un bloque: lista de (posición, (public_key, transacción sin firma, firma))"""
+        checks = []
+        for i, transaction in enumerate(block['transactions'][1:], 1):
+            if transaction.get('type') == 'contract_transfer' or 'signature' not in transaction:
+                continue
+            public_key = self.public_keys.get(transaction['sender'])
+            if public_key is None:
+                continue
+            unsigned = Transaction.from_dict(transaction).unsigned()
+            checks.append((i, (public_key, unsigned, transaction['signature'])))
+        return checks
+
+    def verify_block_signatures(self, blocks):
+        """
+        Verifica en un solo lote las firmas de todas las transacciones de los bloques.
+
+        Returns:
+            dict: (índice del bloque, posición de la transacción) -> bool
+        """
+        keys = []
+        items = []
+        for block in blocks:
+            if block['index'] == 1:
+                continue
+            for position, item in self.signature_checks(block):
+                keys.append((block['index'], position))
+                items.append(item)
+        return dict(zip(keys, verify_signatures_batch(items)))
+
     def process_transaction(self, transaction):
         """Procesa una transacción actualizando los balances"""
         
-        print(f"\nProcesando transacción:")
-        print(f"De: {transaction['sender']}")
-        print(f"Para: {transaction['recipient']}")
-        print(f"Cantidad: {transaction['amount']} BBC")
-        print(f"Comisión: {transaction.get('fee', 0)} BBC")
-        print(f"Tipo: {transaction.get('type', 'normal')}")
-        
+        logger.debug("Procesando transacción de %s a %s: %s BBC (comisión: %s BBC, tipo: %s)",
+                     transaction['sender'], transaction['recipient'], to_bbc(transaction['amount']),
+                     to_bbc(transaction.get('fee', 0)), transaction.get('type', 'normal'))
+
         if transaction.get('type') != 'coinbase':
             sender = transaction['sender']
             recipient = transaction['recipient']
-            amount = transaction['amount']
-            fee = transaction.get('fee', 0)
+            amount = amount_units(transaction['amount'])
+            fee = amount_units(transaction.get('fee', 0))
             tx_type = transaction.get('type', 'normal')
 
             
-            print(f"Balance del remitente antes: {self.get_balance(sender)} BBC")
-            print(f"Balance del destinatario antes: {self.get_balance(recipient)} BBC")
-            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Balances antes: remitente %s BBC, destinatario %s BBC",
+                             to_bbc(self.get_balance(sender)), to_bbc(self.get_balance(recipient)))
+
             # Verificar balance suficiente
             if self.get_balance(sender) < amount + fee:
                 raise ValueError(f"Balance insuficiente para {sender}")
@@ -321,24 +567,25 @@ class Blockchain:
             # Actualizar balances
             # Para transacciones de depósito al escrow, asegurarse de restar del balance del comprador
             if tx_type == 'escrow_deposit':
-                print("Procesando depósito al escrow...")
+                logger.debug("Procesando depósito al escrow...")
                 # Restar fondos al comprador (incluyendo todas las comisiones)
                 self.balances[sender] = self.get_balance(sender) - (amount + fee)
                 # Añadir fondos al contrato
                 self.balances[recipient] = self.get_balance(recipient) + amount
-                print(f"Fondos restados del comprador: {amount + fee} BBC")
+                logger.debug("Fondos restados del comprador: %s BBC", to_bbc(amount + fee))
             else:
                 # Procesamiento normal para otras transacciones
                 self.balances[sender] = self.get_balance(sender) - (amount + fee)
                 self.balances[recipient] = self.get_balance(recipient) + amount
 
             
-            print(f"Balance del remitente después: {self.get_balance(sender)} BBC")
-            print(f"Balance del destinatario después: {self.get_balance(recipient)} BBC")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Balances después: remitente %s BBC, destinatario %s BBC",
+                             to_bbc(self.get_balance(sender)), to_bbc(self.get_balance(recipient)))
 
             # Si es una transacción al contrato de custodia, actualizar los fondos bloqueados
             if recipient == self.escrow_contract.address:
-                print(f"Fondos recibidos en contrato: {amount} BBC")
+                logger.debug("Fondos recibidos en contrato: %s BBC", to_bbc(amount))
                 # Asegurarse de que el contrato tenga una entrada en balances
                 if self.escrow_contract.address not in self.balances:
                     self.balances[self.escrow_contract.address] = 0
@@ -350,124 +597,303 @@ class Blockchain:
                 if self.escrow_contract.address not in self.balances:
                     raise ValueError("El contrato no tiene balance inicializado")
                 if self.get_balance(self.escrow_contract.address) < amount:
-                    raise ValueError(f"Balance insuficiente en el contrato: {self.get_balance(self.escrow_contract.address)} BBC")
+                    raise ValueError(f"Balance insuficiente en el contrato: {to_bbc(self.get_balance(self.escrow_contract.address))} BBC")
 
-    def calculate_hash(self, block):
-        """Calcula el hash del bloque con prueba de trabajo y emite el progreso"""
+    def calculate_hash(self, block, should_stop=None):
+        """
+        Calcula el hash del bloque con prueba de trabajo y emite el progreso.
+        should_stop indica si se canceló el minado (por defecto, stop_mining()).
+        """
+        should_stop = should_stop or (lambda: self.mining_stopped)
         try:
             nonce = 0
-            block_copy = block.copy()
-            block_copy.pop('hash', None)
             
             is_genesis = block.get('index') == 1
             target = '0' * self.mining_difficulty
             
             if not is_genesis:
-                print(f"\nBuscando nonce para bloque #{block['index']} (Dificultad: {self.mining_difficulty} ceros)")
-                self.current_mining_progress = {
-                    'status': 'mining',
-                    'nonce': 0,
-                    'hash': '',
-                    'found': False,
-                    'final_nonce': None,
-                    'final_hash': None
-                }
+                logger.debug("Buscando nonce para bloque #%s (Dificultad: %s ceros)", block['index'], self.mining_difficulty)
+                self.mining_progress.start()
             
-            while not self.mining_stopped:
-                block_copy['nonce'] = nonce
-                block_string = json.dumps(block_copy, sort_keys=True).encode()
-                hash_result = hashlib.sha256(block_string).hexdigest()
-                
-                if not is_genesis:
-                    self.current_mining_progress.update({
-                        'status': 'mining',
-                        'nonce': nonce,
-                        'hash': hash_result,
-                        'found': self.is_valid_hash(hash_result)
-                    })
-                    
-                    if nonce % 100 == 0:
-                        print(f"\rNonce actual: {nonce}, Hash actual: {hash_result}", end="")
+            if self.use_parallel_mining(is_genesis):
+                return self.calculate_hash_parallel(block, target, should_stop)
+
+            # Las plantillas ignoran el campo 'hash', así que no hace falta copiar el bloque
+            hash_nonce = make_nonce_hasher(block, self.use_header_template)
+            # El progreso se muestrea cada sample_every intentos, no en cada nonce
+            sample_every = self.mining_progress.sample_every
+            next_sample = sample_every if not is_genesis else MAX_NONCE + 1
+            while not should_stop():
+                hash_result = hash_nonce(nonce)
                 
-                if self.is_valid_hash(hash_result):
+                if hash_result.startswith(target):
                     if not is_genesis:
-                        print(f"\n¡Hash válido encontrado!")
-                        print(f"Nonce final: {nonce}")
-                        print(f"Hash final: {hash_result}")
-                        
-                        self.current_mining_progress.update({
-                            'status': 'completed',
-                            'nonce': nonce,
-                            'hash': hash_result,
-                            'found': True,
-                            'final_nonce': nonce,
-                            'final_hash': hash_result
-                        })
+                        self.complete_mining_progress(nonce, hash_result, nonce + 1)
                     return nonce, hash_result
+
+                if nonce >= next_sample:
+                    logger.debug("Nonce actual: %s, Hash actual: %s", nonce, hash_result)
+                    self.mining_progress.sample(nonce, nonce + 1, hash_result)
+                    next_sample = nonce + sample_every
                 
                 nonce += 1
                 
-                if nonce > 1000000:
+                if nonce > MAX_NONCE:
                     raise ValueError("No se encontró un hash válido después de 1,000,000 intentos")
             
-            if self.mining_stopped:
-                print("\nMinado detenido manualmente")
-                raise ValueError("Minado detenido manualmente")
+            logger.info("Minado detenido manualmente")
+            raise ValueError("Minado detenido manualmente")
                 
         except Exception as e:
-            print(f"\nError durante el cálculo del hash: {str(e)}")
-            self.current_mining_progress.update({
-                'status': 'error',
-                'error': str(e)
-            })
+            logger.error("Error durante el cálculo del hash: %s", e)
+            self.mining_progress.fail(e)
             raise
 
+    def apply_block(self, block):
+        """
+        Aplica a los balances las transacciones de un bloque, igual que al
+        minarlo: cada transacción con process_transaction y la coinbase como
+        recompensa del minero.
+        """
+        if not block['transactions']:
+            return
+        for tx in block['transactions'][1:]:
+            logger.debug("Procesando transacción: %s", tx)
+            self.process_transaction(tx)
+        coinbase = block['transactions'][0]
+        miner_address = coinbase['recipient']
+        self.balances[miner_address] = self.get_balance(miner_address) + amount_units(coinbase['amount'])
+
+    def commit_block(self, block):
+        """
+        Aplica un bloque y lo añade a la cadena, todo o nada: se guardan los
+        balances que el bloque puede tocar (el contrato incluido) y, si falla
+        alguna transacción o la escritura en el almacén, se restauran antes de
+        propagar el error. Los eventos de balance se publican solo al confirmar.
+        Lo guardado queda en last_commit para revert_last_block.
+        """
+        touched = {self.escrow_contract.address}
+        for transaction in block['transactions']:
+            touched.add(transaction['sender'])
+            touched.add(transaction['recipient'])
+        saved = {address: self.balances[address] for address in touched if address in self.balances}
+
+        listener, self.balances.listener = self.balances.listener, None
+        try:
+            self.apply_block(block)
+            self.chain.append(block)
+        except Exception:
+            self.restore_balances(touched, saved)
+            raise
+        finally:
+            self.balances.listener = listener
+        self.chain_index.sync(self.chain)
+        self.last_commit = (block['hash'], touched, saved)
+        self.publish_balances(touched, saved)
+
+    def revert_last_block(self):
+        """
+        Deshace el último bloque confirmado con commit_block: lo quita de la
+        cadena y del índice, restaura los balances que cambió y devuelve sus
+        transacciones a la mempool. Falla si la punta ya no es ese bloque.
+        """
+        if self.last_commit is None or self.last_commit[0] != self.last_block['hash']:
+            raise ValueError("El último bloque no se puede deshacer")
+        _, touched, saved = self.last_commit
+        self.last_commit = None
+
+        # El punto de control de validación se recorta solo (checkpoint_start)
+        block = self.chain.pop()
+        self.chain_index.remove_block(len(self.chain), block)
+        listener, self.balances.listener = self.balances.listener, None
+        try:
+            after = {address: self.balances[address] for address in touched if address in self.balances}
+            self.restore_balances(touched, saved)
+        finally:
+            self.balances.listener = listener
+        self.publish_balances(touched, after)
+        for transaction in block['transactions'][1:]:
+            if transaction_id(transaction) in self.mempool:
+                continue
+            try:
+                self.enqueue_transaction(transaction)
+            except ValueError as e:
+                logger.warning("No se pudo devolver la transacción a la mempool: %s", e)
+        logger.warning("Bloque #%s deshecho", block['index'])
+        return block
+
+    def restore_balances(self, touched, saved):
+        for address in touched:
+            if address in saved:
+                self.balances[address] = saved[address]
+            elif address in self.balances:
+                del self.balances[address]
+
+    def publish_balances(self, touched, before):
+        """Publica balance-changed para las direcciones cuyo balance difiere de before"""
+        listener = self.balances.listener
+        if listener is None:
+            return
+        for address in touched:
+            if self.balances.get(address) != before.get(address):
+                listener(address)
+                parent = self.balances.parent_of.get(address)
+                if parent is not None:
+                    listener(parent)
+
+    def use_parallel_mining(self, is_genesis):
+        """
+        Decide si el bloque se mina con varios procesos. El génesis se mina de
+        forma secuencial porque se crea al importar la aplicación, y con poca
+        dificultad arrancar los workers cuesta más que la búsqueda misma.
+        """
+        return (not is_genesis
+                and self.mining_workers > 1
+                and self.mining_difficulty >= PARALLEL_MIN_DIFFICULTY)
+
+    def calculate_hash_parallel(self, block, target, should_stop):
+        """Busca el nonce repartiendo el espacio de búsqueda entre procesos"""
+        logger.debug("Minando con %s procesos", self.mining_workers)
+        hash_nonce = make_nonce_hasher(block, self.use_header_template)
+
+        def report(attempts):
+            self.mining_progress.sample(attempts, attempts, hash_nonce(attempts))
+
+        miner = ParallelMiner(self.mining_workers, self.use_header_template)
+        nonce = miner.search(block, target, should_stop, report)
+        if nonce is None:
+            logger.info("Minado detenido manualmente")
+            raise ValueError("Minado detenido manualmente")
+
+        hash_result = hash_nonce(nonce)
+        self.complete_mining_progress(nonce, hash_result, miner.attempts)
+        return nonce, hash_result
+
+    def complete_mining_progress(self, nonce, hash_result, hashes_tried):
+        """Registra el nonce y hash encontrados para /mine/progress"""
+        self.mining_progress.complete(nonce, hash_result, hashes_tried)
+        logger.info("¡Hash válido encontrado! Nonce: %s, hash: %s (%.0f hashes/s)",
+                    nonce, hash_result, self.mining_progress.last_hash_rate)
+
+    def publish_mining_progress(self, snapshot):
+        """Publica el progreso de minado; los eventos pendientes se reemplazan por el último"""
+        self.events.publish('mining-progress', snapshot._asdict(), key='mining-progress')
+
+    def publish_balance(self, address):
+        """Publica el nuevo balance de una dirección a los clientes suscritos"""
+        if self.events.has_subscribers():
+            self.events.publish('balance-changed',
+                                {'address': address, 'balance': to_bbc(self.get_balance(address))},
+                                key=('balance-changed', address))
+
+    def publish_mempool_changed(self):
+        self.events.publish('mempool-changed', {'mempool_size': len(self.mempool)}, key='mempool-changed')
+
     def get_balance(self, address):
         """Obtiene el balance total de una dirección incluyendo todas sus direcciones asociadas"""
-        # Primero verificar si la dirección es una dirección principal
-        total_balance = self.balances.get(address, 0)
-        
-        # Luego buscar en todas las wallets y sus direcciones asociadas
-        for wallet_addr, addresses in self.wallet_addresses.items():
-            if wallet_addr == address:  # Si es la dirección principal
-                # Sumar los balances de todas sus direcciones asociadas
-                for addr in addresses:
-                    total_balance += self.balances.get(addr, 0)
-            elif address in addresses:  # Si es una dirección asociada
-                # Devolver el balance específico de esa dirección
-                return self.balances.get(address, 0)
-                    
-        return total_balance                                         
+        return self.balances.total(address)
+
+    def register_wallet(self, address, public_key):
+        """
+        Registra la clave pública de una wallet. Si la dirección no tenía
+        balance recibe el balance inicial; si ya lo tenía, lo conserva.
+        """
+        credit = 0 if address in self.balances else INITIAL_WALLET_BALANCE
+        self.public_keys[address] = public_key
+        if credit:
+            self.balances[address] = credit
+        self.journal({'wallet': address, 'public_key': public_key, 'credit': credit})
+
+    def register_address(self, wallet_address, address):
+        """Asocia una dirección adicional a una wallet e inicializa su balance"""
+        self.wallet_addresses.setdefault(wallet_address, []).append(address)
+        self.balances[address] = 0
+        self.balances.link(wallet_address, address)
+        self.journal({'wallet': wallet_address, 'address': address})
+
+    def journal(self, entry):
+        """Anota un registro fuera de la cadena en el diario de wallets (ver restore_snapshot)"""
+        if self.journal_path:
+            append_journal(self.journal_path, entry, sync=getattr(self.chain, 'sync', True))
 
     def calculate_block_reward(self):
         """Calcula la recompensa actual por bloque basada en halvings"""
         halvings = (len(self.chain) - 1) // self.halving_blocks
-        return self.block_reward / (2 ** halvings)
+        return self.block_reward >> halvings
 
     def get_mempool(self):
-        """Retorna las transacciones pendientes en la mempool"""
-        return sorted(self.mempool, key=lambda x: x.get('fee', 0), reverse=True)
+        """Retorna las transacciones pendientes en la mempool, ordenadas por comisión e identificadas por txid"""
+        return [dict(tx, txid=txid) for txid, tx in self.mempool.sorted()]
+
+    def select_transactions(self, max_transactions):
+        """Selecciona los txid de las transacciones con mayor comisión para una plantilla de bloque"""
+        return [txid for txid, _ in self.mempool.top(max_transactions)]
 
-    def calculate_merkle_root(self, transactions):
+    def calculate_merkle_root(self, transactions, raw=False):
         """Calcula el Merkle Root de las transacciones"""
-        if not transactions:
-            return hashlib.sha256(''.encode()).hexdigest()
-        
-        tx_hashes = [hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).hexdigest() 
-                    for tx in transactions]
-        
-        if len(tx_hashes) % 2 == 1:
-            tx_hashes.append(tx_hashes[-1])
-        
-        while len(tx_hashes) > 1:
-            new_hashes = []
-            for i in range(0, len(tx_hashes), 2):
-                combined = tx_hashes[i] + tx_hashes[i+1]
-                new_hash = hashlib.sha256(combined.encode()).hexdigest()
-                new_hashes.append(new_hash)
-            tx_hashes = new_hashes
-        
-        return tx_hashes[0]
+        return MerkleTree.from_transactions(transactions, raw).root
+
+    def get_transaction(self, txid):
+        """Transacción confirmada por txid junto con su ubicación, o None"""
+        self.chain_index.sync(self.chain)
+        location = self.chain_index.locate(txid)
+        if location is None:
+            return None
+        height, position = location
+        block = self.chain[height]
+        return {
+            'txid': txid,
+            'block_index': height,
+            'block_hash': block['hash'],
+            'position': position,
+            'transaction': block['transactions'][position]
+        }
+
+    def get_address_history(self, address, offset=0, limit=None, newest_first=True):
+        """Página del historial confirmado de una dirección: (total, entradas)"""
+        self.chain_index.sync(self.chain)
+        total, page = self.chain_index.address_history(address, offset, limit, newest_first)
+        entries = []
+        for height, position, direction in page:
+            block = self.chain[height]
+            entries.append({
+                'block_index': height,
+                'position': position,
+                'direction': direction,
+                'timestamp': block['timestamp'],
+                'transaction': block['transactions'][position]
+            })
+        return total, entries
+
+    def cache_merkle_tree(self, block_hash, tree):
+        with self.cache_lock:
+            self.merkle_trees[block_hash] = tree
+            self.merkle_trees.move_to_end(block_hash)
+            if len(self.merkle_trees) > MERKLE_CACHE_SIZE:
+                self.merkle_trees.popitem(last=False)
+
+    def merkle_tree(self, height):
+        """Árbol de Merkle del bloque a la altura dada (0-based), con sus niveles cacheados"""
+        block = self.chain[height]
+        with self.cache_lock:
+            tree = self.merkle_trees.get(block['hash'])
+        if tree is None:
+            tree = MerkleTree.for_block(block)
+            self.cache_merkle_tree(block['hash'], tree)
+        return tree
+
+    def merkle_proof(self, height, position):
+        """Prueba de inclusión de la transacción en la posición dada del bloque"""
+        block = self.chain[height]
+        tree = self.merkle_tree(height)
+        return {
+            'block_index': height,
+            'position': position,
+            'leaf': tree.leaf(position),
+            'proof': tree.proof(position),
+            'merkle_root': block['merkle_root'],
+            'raw': tree.raw
+        }
 
     @property
     def last_block(self):
@@ -477,7 +903,7 @@ class Blockchain:
     @staticmethod
     def hash(block):
         """Crea un hash SHA-256 de un bloque"""
-        block_string = json.dumps(block, sort_keys=True).encode()
+        block_string = json.dumps(block, sort_keys=True, default=json_default).encode()
         return hashlib.sha256(block_string).hexdigest()
     
     def add_to_mempool(self, transaction):
@@ -488,20 +914,66 @@ class Blockchain:
             raise ValueError("Invalid transaction")
         
         sender = transaction['sender']
-        total_amount = transaction['amount'] + transaction['fee']
+        total_amount = amount_units(transaction['amount']) + amount_units(transaction['fee'])
         
         # Verificar balance disponible considerando transacciones pendientes
         available_balance = self.get_available_balance(sender)
-        print(f"\nVerificando balance para nueva transacción:")
-        print(f"Remitente: {sender}")
-        print(f"Balance disponible: {available_balance} BBC")
-        print(f"Cantidad total requerida: {total_amount} BBC")        
+        logger.debug("Verificando balance de %s: disponible %s BBC, requerido %s BBC",
+                     sender, to_bbc(available_balance), to_bbc(total_amount))
         
         if available_balance < total_amount:
-            raise ValueError(f"Insufficient funds. Available: {available_balance}, Required: {total_amount}")
+            raise ValueError(f"Insufficient funds. Available: {to_bbc(available_balance)}, Required: {to_bbc(total_amount)}")
 
-        self.mempool.append(transaction)
-        return True
+        return self.enqueue_transaction(transaction)
+
+    def enqueue_transaction(self, transaction):
+        """
+        Añade a la mempool una transacción ya validada (o generada por el contrato)
+        y registra el monto comprometido por su remitente. Devuelve su txid.
+        """
+        if transaction_id(transaction) in self.in_flight:
+            raise ValueError("La transacción ya se está minando")
+        txid = self.mempool.add(transaction)
+        self.track_pending_spend(transaction, 1)
+        self.publish_mempool_changed()
+        return txid
+
+    def remove_from_mempool(self, txid):
+        """Retira una transacción de la mempool liberando el monto comprometido"""
+        transaction = self.mempool.remove(txid)
+        self.track_pending_spend(transaction, -1)
+        self.publish_mempool_changed()
+        return transaction
+
+    def take_for_mining(self, txid):
+        """
+        Retira una transacción de la mempool para incluirla en un bloque. Su
+        gasto sigue comprometido mientras dura la prueba de trabajo, que corre
+        sin el lock: si se liberara, otra transacción podría gastar los mismos
+        fondos. Se libera al confirmar el bloque (release_mined) o se devuelve
+        a la mempool (restore_transactions).
+        """
+        transaction = self.mempool.remove(txid)
+        self.in_flight[txid] = transaction
+        self.publish_mempool_changed()
+        return transaction
+
+    def release_mined(self, transactions):
+        """Libera el gasto comprometido de las transacciones de un bloque ya confirmado"""
+        for transaction in transactions:
+            self.in_flight.pop(transaction_id(transaction), None)
+            self.track_pending_spend(transaction, -1)
+
+    def track_pending_spend(self, transaction, direction):
+        """Suma (direction=1) o resta (direction=-1) el gasto pendiente del remitente"""
+        sender = transaction['sender']
+        count, amount = self.pending_spend.get(sender, (0, 0))
+        count += direction
+        if count <= 0:
+            # Sin transacciones pendientes el total vuelve a cero exacto
+            self.pending_spend.pop(sender, None)
+        else:
+            self.pending_spend[sender] = (count, amount + direction * (amount_units(transaction['amount']) + amount_units(transaction['fee'])))
 
     def get_available_balance(self, address):
         """
@@ -511,18 +983,13 @@ class Blockchain:
         # Obtener balance actual
         current_balance = self.get_balance(address)
         
-        # Calcular cantidad comprometida en mempool
-        pending_amount = 0
-        for tx in self.mempool:
-            if tx['sender'] == address:
-                pending_amount += tx['amount'] + tx['fee']
+        # Cantidad comprometida en mempool (mantenida al admitir y retirar transacciones)
+        pending_amount = self.pending_spend.get(address, (0, 0))[1]
         
         # Balance disponible = balance actual - cantidad comprometida
         available_balance = current_balance - pending_amount
-        print(f"\nCalculando balance disponible para {address}:")
-        print(f"Balance actual: {current_balance}")
-        print(f"Cantidad comprometida en mempool: {pending_amount}")
-        print(f"Balance disponible: {available_balance}")
+        logger.debug("Balance disponible para %s: %s (actual: %s, comprometido en mempool: %s)",
+                     address, available_balance, current_balance, pending_amount)
         
         return available_balance
 
@@ -540,104 +1007,140 @@ class Blockchain:
         if not public_key:
             return False
 
-        # Hacer una copia de la transacción y eliminar el campo 'signature'
-        transaction_copy = transaction.copy()
-        signature = transaction_copy.pop('signature')
-
         # Verificar la firma utilizando los datos de la transacción (sin la firma)
-        return verify_signature(public_key, transaction_copy, signature)
+        unsigned = Transaction.from_dict(transaction).unsigned()
+        return verify_signature(public_key, unsigned, transaction['signature'])
     
-    def mine(self, miner_address: str, selected_transactions=None):
-        print("\nIniciando proceso de minado...")
+    def mine(self, miner_address: str, selected_transactions=None, cancel=None):
+        """
+        Mina un bloque con las transacciones seleccionadas. cancel (threading.Event)
+        cancela este minado en particular; stop_mining() detiene cualquiera.
+        Si el bloque no llega a la cadena, sus transacciones vuelven a la mempool.
+        """
+        logger.debug("Iniciando proceso de minado...")
         self.mining_stopped = False  # Reset mining flag
+
+        def should_stop():
+            return self.mining_stopped or (cancel is not None and cancel.is_set())
         
         transactions = []
+        selected_txs = []
+        committed = False
+        snapshot = None
         total_fees = 0
         
         try:
-            if selected_transactions and self.mempool:
-                print(f"Procesando {len(selected_transactions)} transacciones seleccionadas...")
-                print(f"Estado actual de la mempool: {self.mempool}")
-                
-                temp_mempool = self.mempool.copy()
-                selected_txs = []
+            with self.state_lock.write():
+                if should_stop():
+                    return None
+                if selected_transactions and len(self.mempool):
+                    logger.debug("Procesando %s transacciones seleccionadas...", len(selected_transactions))
                 
-                for tx_index in selected_transactions:
-                    if 0 <= tx_index < len(temp_mempool):
-                        tx = temp_mempool[tx_index]
-                        print(f"Procesando transacción {tx_index}: {tx}")
-                        selected_txs.append(tx)
-                        if 'fee' in tx:
-                            total_fees += tx['fee']
-                    else:
-                        print(f"Error: índice {tx_index} fuera de rango")
+                    # Se seleccionan por txid, no por posición: la mempool puede
+                    # cambiar entre que el cliente la consulta y pide minar
+                    for txid in dict.fromkeys(selected_transactions):
+                        if txid in self.mempool:
+                            tx = self.take_for_mining(txid)
+                            logger.debug("Procesando transacción %s: %s", txid, tx)
+                            selected_txs.append(tx)
+                            if 'fee' in tx:
+                                total_fees += amount_units(tx['fee'])
+                        else:
+                            logger.warning("La transacción %s no está en la mempool", txid)
                 
-                # Remover transacciones seleccionadas de mempool
-                for tx in selected_txs:
-                    if tx in self.mempool:
-                        self.mempool.remove(tx)
-                        print(f"Transacción removida de mempool: {tx}")
-                
-                transactions.extend(selected_txs)
+                    transactions.extend(selected_txs)
 
-            print(f"Total de comisiones: {total_fees}")
-            print("Creando nuevo bloque...")
+            logger.debug("Creando nuevo bloque (comisiones: %s)", total_fees)
             
             block_reward = self.calculate_block_reward()
             total_reward = block_reward + total_fees
-            print(f"Recompensa total: {total_reward} (base: {block_reward}, comisiones: {total_fees})")
+            logger.debug("Recompensa total: %s BBC (base: %s, comisiones: %s)", to_bbc(total_reward), to_bbc(block_reward), to_bbc(total_fees))
 
-            # Crear transacción coinbase
+            # Crear transacción coinbase. Lleva el índice del bloque para que su
+            # txid sea único: dos coinbases con el mismo minero y la misma
+            # recompensa serían idénticas y chocarían en ChainIndex
             coinbase_transaction = {
                 'sender': "0",
                 'recipient': miner_address,
                 'amount': total_reward,
-                'type': 'coinbase'
+                'type': 'coinbase',
+                'block_index': len(self.chain) + 1
             }
-            transactions.insert(0, coinbase_transaction)
+            transactions.insert(0, Transaction(self.tag_encoding(coinbase_transaction)))
+            merkle_tree = MerkleTree.from_transactions(transactions, raw=self.encoding == ENCODING_BINARY)
             
             block = {
                 'index': len(self.chain) + 1,
                 'timestamp': time(),
                 'transactions': transactions,
                 'previous_hash': self.last_block['hash'],
-                'merkle_root': self.calculate_merkle_root(transactions),
+                'merkle_root': merkle_tree.root,
                 'nonce': None,
                 'hash': None
             }
+            self.tag_encoding(block)
             
-            print("Calculando proof of work...")
+            logger.debug("Calculando proof of work...")
             with self.mining_lock:
                 try:
-                    block['nonce'], block['hash'] = self.calculate_hash(block)
-                    print(f"\nHash encontrado: {block['hash']}")
+                    block['nonce'], block['hash'] = self.calculate_hash(block, should_stop)
+                    logger.debug("Hash encontrado: %s", block['hash'])
+                    # Desde aquí el bloque ya no cambia
+                    block = Block(block)
                     
-                    if not self.mining_stopped:
-                        print("\nProcesando transacciones...")
-                        for tx in transactions[1:]:
-                            print(f"Procesando transacción: {tx}")
-                            self.process_transaction(tx)
-                        
-                        print(f"\nActualizando balance del minero {miner_address}")
-                        print(f"Balance anterior: {self.get_balance(miner_address)}")
-                        self.balances[miner_address] = self.get_balance(miner_address) + total_reward
-                        print(f"Balance actualizado: {self.get_balance(miner_address)}")
-                        
-                        print("\nVerificando bloque antes de añadirlo...")
-                        if not self.verify_block(block):
-                            raise ValueError("Bloque inválido")
-                        
-                        print("Añadiendo bloque a la cadena...")
-                        self.chain.append(block)
-                        print("Minado completado exitosamente!")
+                    if not should_stop():
+                        with self.state_lock.write():
+                            # Un trabajo de la cola puede terminar después de shutdown()
+                            if self.closed:
+                                raise ValueError("El nodo está detenido")
+                            logger.debug("Verificando bloque antes de aplicarlo...")
+                            if not self.verify_block(block):
+                                raise ValueError("Bloque inválido")
+
+                            logger.debug("Procesando transacciones y añadiendo el bloque a la cadena...")
+                            self.commit_block(block)
+                            logger.debug("Balance del minero %s actualizado: %s", miner_address, self.balances[miner_address])
+                            self.release_mined(selected_txs)
+                            # El estado se serializa con el lock; comprimirlo y escribirlo no lo necesita
+                            if self.snapshot_path and self.snapshot_interval and len(self.chain) % self.snapshot_interval == 0:
+                                snapshot = self.encode_snapshot()
+                            self.events.publish('block-appended', {
+                                'index': block['index'],
+                                'hash': block['hash'],
+                                'previous_hash': block['previous_hash'],
+                                'timestamp': block['timestamp'],
+                                'transaction_count': len(block['transactions'])
+                            })
+                            logger.info("Bloque #%s minado con %s transacciones", block['index'], len(block['transactions']))
+                            committed = True
+                        if snapshot is not None:
+                            self.write_encoded_snapshot(*snapshot)
                         return block
                     
                 except Exception as e:
-                    print(f"Error durante el minado: {str(e)}")
+                    logger.debug("Error durante el minado: %s", e)
                     raise
                 
         except Exception as e:
-            print(f"Error durante el minado: {str(e)}")
+            logger.error("Error durante el minado: %s", e)
             raise
         finally:
+            if not committed and selected_txs:
+                self.restore_transactions(selected_txs)
             self.mining_stopped = True
+
+    def restore_transactions(self, transactions):
+        """
+        Devuelve a la mempool las transacciones de un bloque que no llegó a la
+        cadena; su gasto nunca dejó de estar comprometido (ver take_for_mining).
+        """
+        with self.state_lock.write():
+            restored = 0
+            for transaction in transactions:
+                txid = transaction_id(transaction)
+                if self.in_flight.pop(txid, None) is None:
+                    continue
+                self.mempool.add(transaction)
+                restored += 1
+            self.publish_mempool_changed()
+        logger.info("%s transacciones devueltas a la mempool", restored)
@@ -0,0 +1,94 @@
+# chain_index.py
+
+from bisect import bisect_left
+
+from mempool import transaction_id
+
+SENT = 'sent'
+RECEIVED = 'received'
+
+
+class ChainIndex:
+    """
+    Índices secundarios de la cadena para consultas de explorador:
+
+    - locations: txid -> (altura, posición en el bloque)
+    - history: dirección -> [(altura, posición, 'sent' | 'received')] en orden de cadena
+
+    El txid es el mismo que devuelve /transactions/new (ver mempool.transaction_id).
+    Los bloques se indexan a medida que se añaden; sync() pone el índice al día
+    con la cadena y lo reconstruye si la cadena se acortó.
+    """
+
+    def __init__(self):
+        self.locations = {}
+        self.history = {}
+        self.height = 0  # Bloques indexados
+
+    def sync(self, chain):
+        if self.height > len(chain):
+            self.clear()
+        for height in range(self.height, len(chain)):
+            self.add_block(height, chain[height])
+
+    def clear(self):
+        self.locations.clear()
+        self.history.clear()
+        self.height = 0
+
+    def add_block(self, height, block):
+        for position, tx in enumerate(block['transactions']):
+            self.locations[transaction_id(tx)] = (height, position)
+            if tx.get('type') != 'coinbase':
+                self.history.setdefault(tx['sender'], []).append((height, position, SENT))
+            if tx['recipient'] != tx['sender']:
+                self.history.setdefault(tx['recipient'], []).append((height, position, RECEIVED))
+        self.height = height + 1
+
+    def remove_block(self, height, block):
+        """Quita del índice el último bloque indexado (al deshacerlo)"""
+        if height != self.height - 1:
+            self.clear()  # sync() lo reconstruye
+            return
+        for tx in block['transactions']:
+            self.locations.pop(transaction_id(tx), None)
+            for address in (tx['sender'], tx['recipient']):
+                entries = self.history.get(address)
+                while entries and entries[-1][0] == height:
+                    entries.pop()
+                if entries == []:
+                    del self.history[address]
+        self.height = height
+
+    def dump(self):
+        """Estado serializable del índice (para snapshot.py)"""
+        return {'height': self.height, 'locations': self.locations, 'history': self.history}
+
+    def load(self, state):
+        self.height = state['height']
+        self.locations = {txid: tuple(location) for txid, location in state['locations'].items()}
+        self.history = {address: [tuple(entry) for entry in entries]
+                        for address, entries in state['history'].items()}
+
+    def locate(self, txid):
+        """(altura, posición) de una transacción confirmada, o None"""
+        return self.locations.get(txid)
+
+    def address_history(self, address, offset=0, limit=None, newest_first=True):
+        """Devuelve (total, página de entradas) del historial de una dirección"""
+        entries = self.history.get(address, [])
+        total = len(entries)
+        if newest_first:
+            start = max(0, total - offset - (limit if limit is not None else total))
+            page = entries[start:max(0, total - offset)][::-1]
+        else:
+            page = entries[offset:offset + limit if limit is not None else None]
+        return total, page
+
+    def positions_in_block(self, address, height):
+        """Posiciones de las transacciones de una dirección dentro de un bloque"""
+        entries = self.history.get(address, [])
+        # El historial está ordenado por altura: basta con una búsqueda binaria
+        start = bisect_left(entries, (height,))
+        end = bisect_left(entries, (height + 1,), start)
+        return sorted({position for _, position, _ in entries[start:end]})
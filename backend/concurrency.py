@@ -0,0 +1,88 @@
+# concurrency.py
+
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """
+    Lock de lectores y escritor para el estado del nodo.
+
+    Varios hilos pueden leer a la vez; un escritor espera a que salgan los
+    lectores y tiene preferencia sobre los lectores nuevos, así que un flujo
+    constante de lecturas no lo deja esperando indefinidamente.
+
+    Es reentrante: el escritor puede volver a tomar el lock (para leer o
+    escribir) y un lector puede volver a leer. Pasar de lectura a escritura
+    no está permitido porque dos lectores que lo intentaran se bloquearían
+    mutuamente.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # hilo -> lecturas anidadas
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            # Lecturas anidadas (o dentro de una escritura) no esperan: ya se tiene el lock
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("No se puede pasar de un lock de lectura a uno de escritura")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("El lock de escritura no pertenece a este hilo")
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -1,40 +1,216 @@
 from ecdsa import SigningKey, VerifyingKey, SECP256k1
-import json
-import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+import logging
+import multiprocessing
+import os
+import threading
 
-def verify_signature(public_key, transaction, signature):
-    print("\n===== INICIO DE VERIFICACIÓN DE FIRMA =====")
-    try:
-        # Crear la clave de verificación
-        print("1. Creando clave de verificación...")
+from encoding import serialize_transaction, transaction_digest
+
+PARALLEL_BATCH_MIN = 16  # Con menos firmas no compensa repartirlas entre procesos
+VERIFYING_KEY_CACHE_SIZE = 4096  # Claves públicas decodificadas que se conservan
+SIGNATURE_CACHE_SIZE = 100000    # Firmas verificadas que se recuerdan
+
+logger = logging.getLogger(__name__)
+
+_verification_pool = None
+_verification_pool_lock = threading.Lock()
+
+class LRUCache:
+    """Caché LRU acotada y segura entre hilos, con contadores de aciertos y fallos"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# Claves de verificación ya decodificadas, por clave pública en hex
+verifying_keys = LRUCache(VERIFYING_KEY_CACHE_SIZE)
+# Firmas ya verificadas: (sha256 de la transacción, firma, clave pública) -> bool
+verified_signatures = LRUCache(SIGNATURE_CACHE_SIZE)
+
+def get_verifying_key(public_key):
+    """Devuelve el VerifyingKey de una clave pública, decodificándolo solo la primera vez"""
+    vk = verifying_keys.get(public_key)
+    if vk is None:
         vk = VerifyingKey.from_string(bytes.fromhex(public_key), curve=SECP256k1)
-        
-        # Preparar los datos para verificar
-        print("2. Preparando datos para verificar...")
-        transaction_string = json.dumps(transaction, sort_keys=True)
-        print(f"   Datos serializados: {transaction_string}")
-        
-        # Verificar la firma
-        print("3. Verificando firma...")
-        result = vk.verify(bytes.fromhex(signature), transaction_string.encode())
-        print(f"   Resultado: {'Válido' if result else 'Inválido'}")
-        
-        print("===== FIN DE VERIFICACIÓN DE FIRMA =====")
-        return True
-    except Exception as e:
-        print(f"ERROR en verify_signature: {str(e)}")
-        print(traceback.format_exc())
-        return False
+        verifying_keys.put(public_key, vk)
+    return vk
+
+def signature_cache_key(transaction, signature, public_key):
+    # Una Transaction trae su digest cacheado: la consulta no vuelve a serializar
+    return transaction_digest(transaction), signature, public_key
+
+def get_cache_stats():
+    """Estadísticas de las cachés de verificación"""
+    return {
+        'verifying_keys': verifying_keys.stats(),
+        'verified_signatures': verified_signatures.stats()
+    }
+
+def verify_signature(public_key, transaction, signature):
+    """Como check_signature, pero deja constancia en el log de las firmas rechazadas"""
+    result = check_signature(public_key, transaction, signature)
+    if not result:
+        logger.warning("Firma no válida para la clave pública %s", public_key)
+    return result
 
 def sign_transaction(private_key, transaction):
     try:
         # Crear la clave de firma a partir de la clave privada
         sk = SigningKey.from_string(bytes.fromhex(private_key), curve=SECP256k1)
-        transaction_string = json.dumps(transaction, sort_keys=True)
+        transaction_bytes = serialize_transaction(transaction)
         
         # Generar la firma
-        signature = sk.sign(transaction_string.encode())
+        signature = sk.sign(transaction_bytes)
         return signature
     except Exception as e:
-        print(f"Error al firmar la transacción: {str(e)}")
-        raise
\ No newline at end of file
+        logger.error("Error al firmar la transacción: %s", e)
+        raise
+
+def sign_transactions_batch(items):
+    """
+    Firma un lote de transacciones decodificando cada clave privada una sola vez.
+
+    Args:
+        items (list): Tuplas (private_key en hex, transacción)
+
+    Returns:
+        list: La firma (bytes) de cada transacción, o la excepción si no se pudo firmar
+    """
+    signing_keys = {}
+    signatures = []
+    for private_key, transaction in items:
+        try:
+            sk = signing_keys.get(private_key)
+            if sk is None:
+                sk = signing_keys[private_key] = SigningKey.from_string(bytes.fromhex(private_key), curve=SECP256k1)
+            signatures.append(sk.sign(serialize_transaction(transaction)))
+        except Exception as e:
+            logger.warning("Error al firmar la transacción: %s", e)
+            signatures.append(e)
+    return signatures
+
+def check_signature(public_key, transaction, signature):
+    """
+    Verifica una firma con las cachés de claves y de firmas ya verificadas.
+    Nunca lanza excepciones: una transacción no serializable, una clave o una
+    firma mal formadas cuentan como firma inválida y devuelven False.
+    """
+    try:
+        cache_key = signature_cache_key(transaction, signature, public_key)
+    except (TypeError, ValueError):
+        return False
+
+    cached = verified_signatures.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        transaction_bytes = serialize_transaction(transaction)
+        result = bool(get_verifying_key(public_key).verify(bytes.fromhex(signature), transaction_bytes))
+    except Exception:
+        result = False
+    verified_signatures.put(cache_key, result)
+    return result
+
+def _check_item(item):
+    return check_signature(*item)
+
+def _init_worker():
+    """
+    Inicializa un proceso del pool. El fork ocurre desde un hilo de una
+    petición mientras otros hilos pueden tener tomado el lock de una caché;
+    el hijo hereda ese lock tomado y se bloquearía al usarlo. Se reemplazan
+    las cachés por unas nuevas: el proceso principal guarda los resultados.
+    """
+    global verifying_keys, verified_signatures
+    verifying_keys = LRUCache(VERIFYING_KEY_CACHE_SIZE)
+    verified_signatures = LRUCache(SIGNATURE_CACHE_SIZE)
+
+def get_verification_pool():
+    """Pool de procesos para verificar firmas, creado la primera vez que se necesita"""
+    global _verification_pool
+    with _verification_pool_lock:
+        if _verification_pool is None:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context()
+            _verification_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context,
+                                                     initializer=_init_worker)
+        return _verification_pool
+
+def verify_signatures_batch(items, parallel=True):
+    """
+    Verifica un lote de firmas repartiéndolas entre varios procesos.
+
+    Args:
+        items (list): Tuplas (public_key, transacción sin firma, firma en hex)
+        parallel (bool): Si es False se verifica todo en el proceso actual
+
+    Returns:
+        list: Un bool por firma, en el mismo orden que items
+    """
+    global _verification_pool
+    workers = os.cpu_count() or 1
+    if not parallel or workers < 2 or len(items) < PARALLEL_BATCH_MIN:
+        return [check_signature(*item) for item in items]
+
+    # Solo se envían a los procesos las firmas que no están en la caché
+    keys = []
+    results = []
+    for public_key, transaction, signature in items:
+        key = signature_cache_key(transaction, signature, public_key)
+        keys.append(key)
+        results.append(verified_signatures.get(key))
+    missing = [i for i, result in enumerate(results) if result is None]
+    if len(missing) < PARALLEL_BATCH_MIN:
+        return [check_signature(*item) if result is None else result for item, result in zip(items, results)]
+
+    pending = [items[i] for i in missing]
+    chunksize = max(1, len(pending) // (workers * 4))
+    try:
+        computed = list(get_verification_pool().map(_check_item, pending, chunksize=chunksize))
+    except BrokenProcessPool:
+        logger.warning("Pool de verificación caído, verificando en el proceso actual")
+        with _verification_pool_lock:
+            _verification_pool = None
+        computed = [check_signature(*item) for item in pending]
+
+    for i, result in zip(missing, computed):
+        results[i] = result
+        verified_signatures.put(keys[i], result)
+    return results
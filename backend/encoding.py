@@ -0,0 +1,231 @@
+# encoding.py
+
+import hashlib
+import json
+import re
+import struct
+from collections.abc import Mapping
+
+ENCODING_JSON = 0    # json.dumps(..., sort_keys=True), el formato original
+ENCODING_BINARY = 1  # Codificación binaria canónica de este módulo
+ENCODING_FIELD = 'encoding'
+
+FLOAT = struct.Struct('>d')
+NONCE = struct.Struct('>Q')  # El nonce va al final de la cabecera con ancho fijo
+
+# Etiquetas de tipo de la codificación binaria
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_HEX = 6      # Cadena hexadecimal guardada como bytes crudos (direcciones, claves, firmas, hashes)
+TAG_LIST = 7
+TAG_DICT = 8
+
+# Campos habituales que se codifican con un solo byte en lugar de su nombre
+KNOWN_FIELDS = (
+    'sender', 'recipient', 'amount', 'fee', 'timestamp', 'type', 'signature',
+    'encoding', 'agreement_id', 'public_key', 'index', 'transactions',
+    'previous_hash', 'merkle_root', 'nonce', 'hash'
+)
+FIELD_IDS = {name: i for i, name in enumerate(KNOWN_FIELDS)}
+CUSTOM_FIELD = len(KNOWN_FIELDS)
+
+HEX_PATTERN = re.compile(r'(?:[0-9a-f]{2}){20,}')
+
+
+def encode_varint(value, out):
+    """Entero sin signo en base 128 (LEB128)"""
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_value(value, out):
+    """Añade a out la codificación binaria de un valor JSON"""
+    if value is None:
+        out.append(TAG_NONE)
+    elif value is True:
+        out.append(TAG_TRUE)
+    elif value is False:
+        out.append(TAG_FALSE)
+    elif isinstance(value, int):
+        out.append(TAG_INT)
+        # Zigzag: los negativos pequeños también ocupan pocos bytes
+        encode_varint(value * 2 if value >= 0 else -value * 2 - 1, out)
+    elif isinstance(value, float):
+        out.append(TAG_FLOAT)
+        out += FLOAT.pack(value)
+    elif isinstance(value, str):
+        if HEX_PATTERN.fullmatch(value):
+            raw = bytes.fromhex(value)
+            out.append(TAG_HEX)
+            encode_varint(len(raw), out)
+            out += raw
+        else:
+            raw = value.encode()
+            out.append(TAG_STR)
+            encode_varint(len(raw), out)
+            out += raw
+    elif isinstance(value, (list, tuple)):
+        out.append(TAG_LIST)
+        encode_varint(len(value), out)
+        for item in value:
+            encode_value(item, out)
+    elif isinstance(value, Mapping):
+        out.append(TAG_DICT)
+        encode_varint(len(value), out)
+        for key in sorted(value):
+            field_id = FIELD_IDS.get(key)
+            if field_id is None:
+                out.append(CUSTOM_FIELD)
+                raw = key.encode()
+                encode_varint(len(raw), out)
+                out += raw
+            else:
+                out.append(field_id)
+            encode_value(value[key], out)
+    else:
+        raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def decode_value(data, offset=0):
+    """Decodifica un valor; devuelve (valor, offset siguiente)"""
+    tag = data[offset]
+    offset += 1
+    if tag == TAG_NONE:
+        return None, offset
+    if tag == TAG_TRUE:
+        return True, offset
+    if tag == TAG_FALSE:
+        return False, offset
+    if tag == TAG_INT:
+        raw, offset = decode_varint(data, offset)
+        return (raw >> 1) ^ -(raw & 1), offset
+    if tag == TAG_FLOAT:
+        return FLOAT.unpack_from(data, offset)[0], offset + FLOAT.size
+    if tag in (TAG_STR, TAG_HEX):
+        length, offset = decode_varint(data, offset)
+        raw = bytes(data[offset:offset + length])
+        return (raw.hex() if tag == TAG_HEX else raw.decode()), offset + length
+    if tag == TAG_LIST:
+        length, offset = decode_varint(data, offset)
+        items = []
+        for _ in range(length):
+            item, offset = decode_value(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == TAG_DICT:
+        length, offset = decode_varint(data, offset)
+        result = {}
+        for _ in range(length):
+            field_id = data[offset]
+            offset += 1
+            if field_id == CUSTOM_FIELD:
+                key_length, offset = decode_varint(data, offset)
+                key = bytes(data[offset:offset + key_length]).decode()
+                offset += key_length
+            else:
+                key = KNOWN_FIELDS[field_id]
+            result[key], offset = decode_value(data, offset)
+        return result, offset
+    raise ValueError(f"Etiqueta desconocida en la codificación binaria: {tag}")
+
+
+def encode_transaction(transaction):
+    """Codificación binaria canónica de una transacción (incluye el byte de versión)"""
+    out = bytearray([ENCODING_BINARY])
+    encode_value(transaction, out)
+    return bytes(out)
+
+
+def decode_transaction(data):
+    if not data or data[0] != ENCODING_BINARY:
+        raise ValueError("Versión de codificación no soportada")
+    return decode_value(data, 1)[0]
+
+
+def json_default(value):
+    """Para json.dumps: los Block y Transaction de records.py se serializan como dicts"""
+    to_dict = getattr(value, 'to_dict', None)
+    if to_dict is not None:
+        return to_dict()
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, default=json_default).encode()
+
+
+def serialize_transaction(transaction):
+    """
+    Bytes que se firman y se hashean de una transacción. Las transacciones con
+    'encoding': 1 usan la codificación binaria; el resto, el JSON original, así
+    que ambas conviven en la misma mempool y en la misma cadena.
+    Una Transaction (records.py) los calcula una sola vez.
+    """
+    serialized = getattr(transaction, 'serialized', None)
+    if serialized is not None:
+        return serialized
+    return encode_canonical(transaction)
+
+
+def encode_canonical(transaction):
+    if transaction.get(ENCODING_FIELD) == ENCODING_BINARY:
+        return encode_transaction(transaction)
+    return canonical_json(transaction)
+
+
+def transaction_digest(transaction):
+    digest = getattr(transaction, 'digest', None)
+    if digest is not None:
+        return digest
+    return hashlib.sha256(serialize_transaction(transaction)).digest()
+
+
+def block_header_prefix(block):
+    """
+    Cabecera binaria de un bloque sin el nonce: versión, índice, timestamp,
+    hash anterior, Merkle root y número de transacciones. Las transacciones
+    quedan comprometidas a través del Merkle root.
+    """
+    out = bytearray([ENCODING_BINARY])
+    for field in ('index', 'timestamp', 'previous_hash', 'merkle_root'):
+        encode_value(block[field], out)
+    encode_varint(len(block['transactions']), out)
+    return bytes(out)
+
+
+def encode_block_header(block, nonce=None):
+    nonce = block['nonce'] if nonce is None else nonce
+    return block_header_prefix(block) + NONCE.pack(nonce)
+
+
+def hash_block(block):
+    """Hash de un bloque (sin tener en cuenta su campo 'hash'); un Block lo calcula una sola vez"""
+    computed = getattr(block, 'computed_hash', None)
+    if computed is not None:
+        return computed
+    return compute_block_hash(block)
+
+
+def compute_block_hash(block):
+    if block.get(ENCODING_FIELD) == ENCODING_BINARY:
+        return hashlib.sha256(encode_block_header(block)).hexdigest()
+    return hashlib.sha256(canonical_json({key: value for key, value in block.items() if key != 'hash'})).hexdigest()
@@ -0,0 +1,107 @@
+# escrow_index.py
+
+from bisect import bisect_left, insort
+
+ACTIVE = 'active'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+BUCKETS = (ACTIVE, COMPLETED, CANCELLED)  # Orden en que se listan los acuerdos de una dirección
+
+
+def status_bucket(status):
+    if status == 'COMPLETED':
+        return COMPLETED
+    if status == 'CANCELLED':
+        return CANCELLED
+    return ACTIVE
+
+
+class AgreementIndex:
+    """
+    Índices de los acuerdos del escrow, mantenidos en cada alta y cambio de
+    estado. Cada índice es una lista de (timestamp, id) ordenada, así que
+    las consultas devuelven los acuerdos ya ordenados sin recorrer ni
+    ordenar todos los acuerdos:
+
+    - by_buyer / by_seller: dirección -> acuerdos
+    - by_status: estado -> acuerdos
+    - by_time: todos los acuerdos
+    - by_participant: (dirección, grupo) -> acuerdos donde la dirección es
+      comprador o vendedor, agrupados en activos, completados y cancelados
+    """
+
+    def __init__(self):
+        self.by_buyer = {}
+        self.by_seller = {}
+        self.by_status = {}
+        self.by_time = []
+        self.by_participant = {}
+
+    def clear(self):
+        self.by_buyer.clear()
+        self.by_seller.clear()
+        self.by_status.clear()
+        self.by_time.clear()
+        self.by_participant.clear()
+
+    def rebuild(self, agreements):
+        self.clear()
+        for agreement_id, agreement in agreements.items():
+            self.add(agreement_id, agreement)
+
+    def add(self, agreement_id, agreement):
+        entry = (agreement['timestamp'], agreement_id)
+        insort(self.by_buyer.setdefault(agreement['buyer'], []), entry)
+        insort(self.by_seller.setdefault(agreement['seller'], []), entry)
+        insort(self.by_status.setdefault(agreement['status'], []), entry)
+        insort(self.by_time, entry)
+        bucket = status_bucket(agreement['status'])
+        for address in self.participants(agreement):
+            insort(self.by_participant.setdefault((address, bucket), []), entry)
+
+    def change_status(self, agreement_id, agreement, old_status, new_status):
+        """Mueve un acuerdo de old_status a new_status; agreement ya puede tener el estado nuevo"""
+        if old_status == new_status:
+            return
+        entry = (agreement['timestamp'], agreement_id)
+        self.discard(self.by_status, old_status, entry)
+        insort(self.by_status.setdefault(new_status, []), entry)
+
+        old_bucket, new_bucket = status_bucket(old_status), status_bucket(new_status)
+        if old_bucket != new_bucket:
+            for address in self.participants(agreement):
+                self.discard(self.by_participant, (address, old_bucket), entry)
+                insort(self.by_participant.setdefault((address, new_bucket), []), entry)
+
+    @staticmethod
+    def participants(agreement):
+        # Un acuerdo consigo mismo se indexa una sola vez por dirección
+        return dict.fromkeys((agreement['buyer'], agreement['seller']))
+
+    @staticmethod
+    def discard(index, key, entry):
+        entries = index.get(key)
+        if not entries:
+            return
+        position = bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+        if not entries:
+            del index[key]
+
+    def ids_for_seller(self, seller):
+        return [agreement_id for _, agreement_id in self.by_seller.get(seller, ())]
+
+    def ids_for_buyer(self, buyer):
+        return [agreement_id for _, agreement_id in self.by_buyer.get(buyer, ())]
+
+    def ids_with_status(self, status, newest_first=True):
+        entries = self.by_status.get(status, [])
+        return [agreement_id for _, agreement_id in (reversed(entries) if newest_first else entries)]
+
+    def ids_for_participant(self, address, buckets=BUCKETS):
+        """IDs de los acuerdos de una dirección: activos, completados y cancelados, cada grupo del más reciente al más viejo"""
+        ids = []
+        for bucket in buckets:
+            ids.extend(agreement_id for _, agreement_id in reversed(self.by_participant.get((address, bucket), ())))
+        return ids
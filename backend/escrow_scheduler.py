@@ -0,0 +1,114 @@
+# escrow_scheduler.py
+
+import heapq
+import itertools
+import logging
+import threading
+
+# Segundos que un acuerdo puede quedar en cada estado antes de vencer
+ESCROW_TIMEOUTS = {
+    'PENDING_SELLER_CONFIRMATION': 24 * 3600,  # El vendedor no aceptó: reembolso
+    'AWAITING_SHIPMENT': 3 * 24 * 3600,        # El vendedor no envió: reembolso
+    'SHIPPED': 14 * 24 * 3600                  # El comprador no confirmó ni disputó: se libera al vendedor
+}
+EXPIRY_BATCH = 500     # Acuerdos vencidos que se procesan por pasada
+EXPIRY_INTERVAL = 30   # Segundos entre revisiones del hilo de vencimientos
+EXPIRY_RETRY = 300     # Segundos antes de reintentar un vencimiento que falló
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    Min-heap de vencimientos por acuerdo: (deadline, secuencia, id, estado).
+
+    Cada cambio de estado agrega una entrada nueva en O(log n) y las viejas
+    no se buscan para borrarlas: al salir del heap se descartan si el
+    acuerdo ya no está en ese estado o tiene otro vencimiento (invalidación
+    perezosa). Revisar si hay algo vencido cuesta O(1).
+    """
+
+    def __init__(self, timeouts=None):
+        self.timeouts = dict(ESCROW_TIMEOUTS if timeouts is None else timeouts)
+        self.heap = []
+        self.deadlines = {}  # id -> (estado, deadline) vigente
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def clear(self):
+        self.heap.clear()
+        self.deadlines.clear()
+
+    def schedule(self, agreement_id, status, since):
+        """
+        Programa el vencimiento del acuerdo en su estado actual, contado desde
+        since. Devuelve el deadline, o None si el estado no vence (y entonces
+        se cancela cualquier vencimiento anterior).
+        """
+        timeout = self.timeouts.get(status)
+        if timeout is None:
+            self.deadlines.pop(agreement_id, None)
+            return None
+        deadline = since + timeout
+        self.deadlines[agreement_id] = (status, deadline)
+        heapq.heappush(self.heap, (deadline, next(self.sequence), agreement_id, status))
+        return deadline
+
+    def next_deadline(self):
+        """Próximo vencimiento vigente, o None si no hay ninguno"""
+        self.drop_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_expired(self, now):
+        """
+        Retira el vencimiento vigente más antiguo con deadline <= now y
+        devuelve (id, estado), o None si no hay nada vencido. Se retira de a
+        uno para que un fallo al aplicarlo no se lleve los demás.
+        """
+        self.drop_stale()
+        if not self.heap or self.heap[0][0] > now:
+            return None
+        _, _, agreement_id, status = heapq.heappop(self.heap)
+        del self.deadlines[agreement_id]
+        return agreement_id, status
+
+    def retry(self, agreement_id, status, deadline):
+        """Vuelve a programar un vencimiento que no se pudo aplicar"""
+        self.deadlines[agreement_id] = (status, deadline)
+        heapq.heappush(self.heap, (deadline, next(self.sequence), agreement_id, status))
+
+    def drop_stale(self):
+        heap = self.heap
+        while heap:
+            deadline, _, agreement_id, status = heap[0]
+            if self.deadlines.get(agreement_id) == (status, deadline):
+                return
+            heapq.heappop(heap)
+
+
+class EscrowExpiryWorker:
+    """
+    Hilo en segundo plano que aplica los vencimientos del contrato cada
+    interval segundos con el lock de escritura del nodo. Cuando no hay nada
+    vencido solo consulta la cima del heap.
+    """
+
+    def __init__(self, blockchain, interval=EXPIRY_INTERVAL):
+        self.blockchain = blockchain
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self.run, name='escrow-expiry', daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.blockchain.state_lock.write():
+                    self.blockchain.escrow_contract.expire_agreements()
+            except Exception as e:
+                logger.exception("Error al procesar vencimientos del escrow: %s", e)
@@ -0,0 +1,86 @@
+# events.py
+
+import itertools
+import threading
+from collections import OrderedDict
+
+MAX_QUEUED_EVENTS = 100  # Eventos pendientes por suscriptor antes de descartar los más viejos
+
+
+class Subscription:
+    """
+    Cola acotada de un suscriptor.
+
+    Los eventos con la misma clave de coalescencia se reemplazan entre sí (un
+    cliente lento solo recibe el último progreso de minado o el último balance
+    de cada dirección). Si aun así la cola se llena, se descartan los eventos
+    más viejos y se envía un evento 'overflow' para que el cliente se resincronice.
+    """
+
+    def __init__(self, max_events=MAX_QUEUED_EVENTS):
+        self.max_events = max_events
+        self.queue = OrderedDict()
+        self.condition = threading.Condition()
+        self.unique_keys = itertools.count()
+        self.dropped = 0
+
+    def push(self, event_type, data, key=None):
+        with self.condition:
+            if key is None:
+                key = ('unique', next(self.unique_keys))
+            elif key in self.queue:
+                del self.queue[key]
+            elif len(self.queue) >= self.max_events:
+                self.queue.popitem(last=False)
+                self.dropped += 1
+            self.queue[key] = (event_type, data)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Espera eventos y devuelve todos los pendientes como lista de (tipo, datos)"""
+        with self.condition:
+            if not self.queue and not self.dropped:
+                self.condition.wait(timeout)
+            events = list(self.queue.values())
+            self.queue.clear()
+            if self.dropped:
+                events.insert(0, ('overflow', {'dropped': self.dropped}))
+                self.dropped = 0
+            return events
+
+
+class EventBus:
+    """Publica eventos del nodo a todos los suscriptores conectados"""
+
+    def __init__(self, max_events=MAX_QUEUED_EVENTS):
+        self.max_events = max_events
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, limit=None):
+        """Registra un suscriptor; con limit, devuelve None si ya hay limit conectados"""
+        subscription = Subscription(self.max_events)
+        with self.lock:
+            if limit is not None and len(self.subscribers) >= limit:
+                return None
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    def publish(self, event_type, data, key=None):
+        """
+        Envía un evento a cada suscriptor. Con key, los eventos pendientes con
+        la misma clave se reemplazan por el más reciente.
+        """
+        if not self.subscribers:
+            return
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.push(event_type, data, key)
@@ -0,0 +1,34 @@
+# logging_config.py
+
+import logging
+import os
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+DEFAULT_LEVEL = 'INFO'
+
+
+def configure_logging(level=None, module_levels=None):
+    """
+    Configura el logging del nodo.
+
+    El nivel general se toma de LOG_LEVEL (INFO por defecto) y los niveles por
+    módulo de LOG_LEVELS, p. ej. "blockchain=DEBUG,crypto_utils=WARNING". Las
+    trazas detalladas (cada transacción procesada, cada verificación de firma,
+    el progreso del nonce) solo se emiten en DEBUG.
+
+    Args:
+        level (str): Nivel general; sustituye a LOG_LEVEL
+        module_levels (str | dict): Niveles por módulo; sustituye a LOG_LEVELS
+    """
+    level = (level or os.environ.get('LOG_LEVEL') or DEFAULT_LEVEL).upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    logging.getLogger().setLevel(level)
+
+    if module_levels is None:
+        module_levels = os.environ.get('LOG_LEVELS', '')
+    if isinstance(module_levels, str):
+        module_levels = dict(
+            item.split('=', 1) for item in module_levels.split(',') if '=' in item
+        )
+    for name, module_level in module_levels.items():
+        logging.getLogger(name.strip()).setLevel(module_level.strip().upper())
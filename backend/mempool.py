@@ -0,0 +1,126 @@
+# mempool.py
+
+import hashlib
+import heapq
+import json
+
+from amounts import amount_units
+from records import Transaction
+
+
+def transaction_id(transaction):
+    """ID estable de una transacción: SHA-256 de su serialización canónica"""
+    txid = getattr(transaction, 'txid', None)
+    if txid is not None:
+        return txid
+    return hashlib.sha256(json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+
+
+class Mempool:
+    """
+    Transacciones pendientes ordenadas por comisión.
+
+    Se mantiene un heap binario indexado (mayor comisión primero, y a igual
+    comisión la más antigua) junto con un diccionario txid -> transacción, lo
+    que permite admitir y retirar en O(log n) y obtener las k mejores sin
+    recorrer toda la mempool.
+    """
+
+    def __init__(self):
+        self.transactions = {}   # txid -> transacción, en orden de llegada
+        self.heap = []           # [(-comisión, secuencia, txid)]
+        self.positions = {}      # txid -> posición en el heap
+        self.sequence = 0
+        self.sorted_cache = None
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        return iter(list(self.transactions.values()))
+
+    def __contains__(self, txid):
+        return txid in self.transactions
+
+    def get(self, txid):
+        return self.transactions.get(txid)
+
+    def add(self, transaction):
+        """Admite una transacción y devuelve su txid"""
+        transaction = Transaction.from_dict(transaction)
+        txid = transaction.txid
+        if txid in self.transactions:
+            raise ValueError("La transacción ya está en la mempool")
+
+        self.transactions[txid] = transaction
+        self.heap.append((-amount_units(transaction.get('fee', 0)), self.sequence, txid))
+        self.sequence += 1
+        self.positions[txid] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+        self.sorted_cache = None
+        return txid
+
+    def remove(self, txid):
+        """Retira una transacción por txid y la devuelve"""
+        transaction = self.transactions.pop(txid)
+        index = self.positions.pop(txid)
+        last = self.heap.pop()
+        if index < len(self.heap):
+            self.heap[index] = last
+            self.positions[last[2]] = index
+            self._sift_up(index)
+            self._sift_down(self.positions[last[2]])
+        self.sorted_cache = None
+        return transaction
+
+    def top(self, k):
+        """
+        Devuelve los k pares (txid, transacción) de mayor comisión.
+        Recorre el heap como árbol con una frontera auxiliar: O(k log k).
+        """
+        result = []
+        frontier = [(self.heap[0], 0)] if self.heap else []
+        while frontier and len(result) < k:
+            entry, index = heapq.heappop(frontier)
+            result.append((entry[2], self.transactions[entry[2]]))
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[child], child))
+        return result
+
+    def sorted(self):
+        """Todas las transacciones ordenadas por comisión; se cachea hasta el próximo cambio"""
+        if self.sorted_cache is None:
+            self.sorted_cache = self.top(len(self.heap))
+        return self.sorted_cache
+
+    def _sift_up(self, index):
+        heap = self.heap
+        entry = heap[index]
+        while index > 0:
+            parent = (index - 1) // 2
+            if heap[parent] <= entry:
+                break
+            heap[index] = heap[parent]
+            self.positions[heap[index][2]] = index
+            index = parent
+        heap[index] = entry
+        self.positions[entry[2]] = index
+
+    def _sift_down(self, index):
+        heap = self.heap
+        size = len(heap)
+        entry = heap[index]
+        while True:
+            child = 2 * index + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[index] = heap[child]
+            self.positions[heap[index][2]] = index
+            index = child
+        heap[index] = entry
+        self.positions[entry[2]] = index
@@ -0,0 +1,116 @@
+# merkle.py
+
+import hashlib
+
+from encoding import ENCODING_BINARY, ENCODING_FIELD, transaction_digest
+
+EMPTY_ROOT = hashlib.sha256(b'').hexdigest()
+
+
+class MerkleTree:
+    """
+    Árbol de Merkle de las transacciones de un bloque, con todos sus niveles.
+
+    Hay dos modos de combinar los nodos:
+
+    - legacy (raw=False): cada nodo es el hash en hex y el padre es
+      sha256(hex_izquierdo + hex_derecho), igual que el cálculo original, de
+      modo que las raíces de los bloques existentes no cambian.
+    - raw (raw=True): el padre es sha256 de los 64 bytes de los dos digests
+      hijos. Lo usan los bloques con codificación binaria.
+
+    En ambos modos un nivel con un número impar de nodos duplica el último.
+    Guardar los niveles permite generar pruebas de inclusión en O(log n).
+    """
+
+    def __init__(self, leaves, raw=False):
+        """
+        Args:
+            leaves (list[bytes]): Digests SHA-256 de las transacciones, en orden
+            raw (bool): Combinar digests crudos en lugar de cadenas hex
+        """
+        self.raw = raw
+        self.size = len(leaves)
+        self.levels = []
+        if not leaves:
+            return
+
+        level = [leaf if raw else leaf.hex() for leaf in leaves]
+        # Como en el cálculo original, las hojas siempre se emparejan (aunque solo haya una)
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        self.levels.append(level)
+        while len(level) > 1:
+            if len(level) % 2 == 1:
+                level = level + [level[-1]]
+            level = [self.combine(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    @classmethod
+    def from_transactions(cls, transactions, raw=False):
+        return cls([transaction_digest(tx) for tx in transactions], raw)
+
+    @classmethod
+    def for_block(cls, block):
+        """Árbol de un bloque con el modo que corresponde a su codificación"""
+        return cls.from_transactions(block['transactions'], raw=block_uses_raw_merkle(block))
+
+    def combine(self, left, right):
+        if self.raw:
+            return hashlib.sha256(left + right).digest()
+        return hashlib.sha256((left + right).encode()).hexdigest()
+
+    @property
+    def root(self):
+        """Raíz en hex, como se guarda en block['merkle_root']"""
+        if not self.levels:
+            return EMPTY_ROOT
+        root = self.levels[-1][0]
+        return root.hex() if self.raw else root
+
+    def leaf(self, position):
+        leaf = self.levels[0][position]
+        return leaf.hex() if self.raw else leaf
+
+    def proof(self, position):
+        """
+        Prueba de inclusión de la hoja en la posición dada: lista de
+        (hash hermano en hex, 'left' | 'right') desde las hojas hasta la raíz.
+        """
+        if not 0 <= position < self.size:
+            raise IndexError("Posición de transacción fuera de rango")
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = position ^ 1
+            node = level[sibling] if sibling < len(level) else level[position]
+            proof.append((node.hex() if self.raw else node, 'left' if sibling < position else 'right'))
+            position //= 2
+        return proof
+
+
+def block_uses_raw_merkle(block):
+    return block.get(ENCODING_FIELD) == ENCODING_BINARY
+
+
+def verify_proof(leaf, proof, root, raw=False):
+    """
+    Comprueba una prueba de inclusión sin necesidad del bloque completo.
+
+    Args:
+        leaf (str): Hash en hex de la transacción
+        proof (list): Pares (hash hermano en hex, 'left' | 'right')
+        root (str): Merkle root en hex del bloque
+        raw (bool): Modo del árbol (ver MerkleTree)
+    """
+    try:
+        node = bytes.fromhex(leaf) if raw else leaf
+        for sibling, side in proof:
+            sibling = bytes.fromhex(sibling) if raw else sibling
+            pair = (sibling, node) if side == 'left' else (node, sibling)
+            if raw:
+                node = hashlib.sha256(pair[0] + pair[1]).digest()
+            else:
+                node = hashlib.sha256((pair[0] + pair[1]).encode()).hexdigest()
+    except (TypeError, ValueError):
+        return False
+    return (node.hex() if raw else node) == root
@@ -0,0 +1,129 @@
+# mining_jobs.py
+
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from time import time
+
+MAX_FINISHED_JOBS = 100  # Trabajos terminados que se conservan para consultar su estado
+
+
+class MiningJobQueue:
+    """
+    Cola de trabajos de minado atendida por un único hilo en segundo plano.
+
+    Las peticiones HTTP solo encolan el trabajo y devuelven su ID; los trabajos
+    se minan uno detrás de otro, así que una nueva petición ya no interrumpe
+    el minado en curso. Cancelar un trabajo en cola lo descarta y cancelar el
+    trabajo en curso activa su evento de cancelación, que mine() revisa antes,
+    durante y después de la prueba de trabajo.
+    """
+
+    def __init__(self, blockchain, execute):
+        """
+        Args:
+            blockchain (Blockchain): Cadena sobre la que se mina
+            execute (callable): Recibe los parámetros del trabajo y su evento de
+                cancelación, y devuelve su resultado
+        """
+        self.blockchain = blockchain
+        self.execute = execute
+        self.jobs = OrderedDict()
+        self.cancel_events = {}  # job_id -> threading.Event (no se publica con el trabajo)
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.current_job_id = None
+        self.worker = threading.Thread(target=self.run, name='mining-worker', daemon=True)
+        self.worker.start()
+
+    def submit(self, miner_address, selected_transactions=None, max_transactions=None):
+        """Encola un trabajo de minado y devuelve una copia de su estado"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'miner_address': miner_address,
+            'selected_transactions': selected_transactions or [],
+            'max_transactions': max_transactions,
+            'created_at': time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        with self.lock:
+            self.jobs[job['id']] = job
+            self.cancel_events[job['id']] = threading.Event()
+            job['position'] = self.pending.qsize()
+        self.pending.put(job['id'])
+        self.publish(job)
+        return dict(job)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def cancel(self, job_id):
+        """
+        Cancela un trabajo. Devuelve su estado, o None si no existe.
+        Un trabajo ya terminado no se modifica.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'queued':
+                self.finish(job, 'cancelled')
+            elif job['status'] == 'running':
+                job['status'] = 'cancelling'
+                self.cancel_events[job_id].set()
+            return dict(job)
+
+    def run(self):
+        while True:
+            job_id = self.pending.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] != 'queued':
+                    continue
+                job['status'] = 'running'
+                job['started_at'] = time()
+                self.current_job_id = job_id
+                cancel = self.cancel_events[job_id]
+            self.publish(job)
+
+            try:
+                result = self.execute(job['miner_address'], job['selected_transactions'], job['max_transactions'],
+                                      cancel)
+                status, error = 'completed', None
+            except Exception as e:
+                result = None
+                status = 'cancelled' if job['status'] == 'cancelling' else 'failed'
+                error = str(e)
+
+            with self.lock:
+                job['result'] = result
+                job['error'] = error
+                self.finish(job, status)
+                self.current_job_id = None
+
+    def finish(self, job, status):
+        """Marca un trabajo como terminado y descarta los más viejos si sobran"""
+        job['status'] = status
+        job['finished_at'] = time()
+        job.pop('position', None)
+        self.cancel_events.pop(job['id'], None)
+        self.publish(job)
+
+        finished = [job_id for job_id, j in self.jobs.items()
+                    if j['status'] in ('completed', 'failed', 'cancelled')]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def publish(self, job):
+        self.blockchain.events.publish('mining-job', dict(job), key=('mining-job', job['id']))
@@ -0,0 +1,79 @@
+# mining_progress.py
+
+from collections import namedtuple
+from time import monotonic, time
+
+PROGRESS_SAMPLE_ATTEMPTS = 1000  # Intentos entre muestras del progreso
+PROGRESS_INTERVAL = 0.25         # Segundos mínimos entre notificaciones a los clientes
+
+MiningProgress = namedtuple('MiningProgress', [
+    'status', 'nonce', 'hash', 'found', 'final_nonce', 'final_hash',
+    'hashes_tried', 'hash_rate', 'started_at', 'updated_at', 'error'
+])
+
+IDLE_PROGRESS = MiningProgress('not_started', 0, '', False, None, None, 0, 0.0, None, None, None)
+
+
+class MiningProgressReporter:
+    """
+    Progreso del minado publicado como instantáneas inmutables.
+
+    El minero solo toma una muestra cada sample_every intentos; cada muestra
+    crea una tupla nueva y la publica reemplazando la referencia en snapshot.
+    Los lectores (p. ej. /mine/progress) leen esa referencia sin tomar ningún
+    lock y siempre obtienen una instantánea completa y consistente. El listener
+    se llama como mucho una vez cada interval segundos, salvo en los cambios
+    de estado (inicio, fin, error), que siempre se notifican.
+    """
+
+    def __init__(self, sample_every=PROGRESS_SAMPLE_ATTEMPTS, interval=PROGRESS_INTERVAL, listener=None):
+        self.sample_every = sample_every
+        self.interval = interval
+        self.listener = listener
+        self.snapshot = IDLE_PROGRESS
+        self.started = monotonic()
+        self.last_notified = 0.0
+        self.last_hash_rate = 0.0  # Hash rate del último minado terminado
+
+    def reset(self):
+        self.snapshot = IDLE_PROGRESS
+
+    def start(self):
+        self.started = monotonic()
+        self.publish(MiningProgress('mining', 0, '', False, None, None, 0, 0.0, time(), time(), None), force=True)
+
+    def sample(self, nonce, hashes_tried, last_hash):
+        """Registra una muestra del minero en curso"""
+        self.publish(self.snapshot._replace(
+            status='mining', nonce=nonce, hash=last_hash, found=False,
+            hashes_tried=hashes_tried, hash_rate=self.rate(hashes_tried), updated_at=time()
+        ))
+
+    def complete(self, nonce, hash_result, hashes_tried):
+        self.last_hash_rate = self.rate(hashes_tried)
+        self.publish(self.snapshot._replace(
+            status='completed', nonce=nonce, hash=hash_result, found=True,
+            final_nonce=nonce, final_hash=hash_result, hashes_tried=hashes_tried,
+            hash_rate=self.last_hash_rate, updated_at=time()
+        ), force=True)
+
+    def fail(self, error):
+        self.publish(self.snapshot._replace(status='error', error=str(error), updated_at=time()), force=True)
+
+    def rate(self, hashes_tried):
+        """Hashes por segundo desde el inicio del minado en curso"""
+        elapsed = monotonic() - self.started
+        return hashes_tried / elapsed if elapsed > 0 else 0.0
+
+    def publish(self, snapshot, force=False):
+        # Reemplazar la referencia es atómico: no hace falta lock para leerla
+        self.snapshot = snapshot
+        if self.listener is None:
+            return
+        now = monotonic()
+        if force or now - self.last_notified >= self.interval:
+            self.last_notified = now
+            self.listener(snapshot)
+
+    def as_dict(self):
+        return self.snapshot._asdict()
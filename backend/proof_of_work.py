@@ -0,0 +1,180 @@
+# proof_of_work.py
+
+import hashlib
+import json
+import multiprocessing
+
+from encoding import ENCODING_BINARY, ENCODING_FIELD, NONCE, block_header_prefix, canonical_json, hash_block
+
+MAX_NONCE = 1000000           # Límite de intentos, igual que el minado secuencial
+CHECK_INTERVAL = 512          # Cada cuántos intentos un worker revisa la cancelación
+POLL_SECONDS = 0.1            # Frecuencia con la que el proceso principal reporta progreso
+NONCE_PLACEHOLDER = '__nonce_placeholder__'
+NONCE_WIDTH = 20              # Dígitos suficientes para cualquier nonce de 64 bits
+
+
+def hash_with_nonce(block_copy, nonce):
+    """Calcula el hash de un bloque (sin campo 'hash') para un nonce dado"""
+    block_copy['nonce'] = nonce
+    return hash_block(block_copy)
+
+
+class BlockHeaderTemplate:
+    """
+    Serializa el bloque una sola vez y solo reescribe el nonce en cada intento.
+
+    Con sort_keys=True el nonce queda entre 'merkle_root' y 'previous_hash', así
+    que el JSON se divide en un prefijo fijo (cuyo estado SHA-256 se reutiliza)
+    y un sufijo con el resto del bloque. Los dígitos del nonce se escriben
+    alineados a la derecha en un bytearray preasignado justo antes del sufijo,
+    de modo que el resultado es idéntico byte a byte a json.dumps del bloque.
+    """
+
+    def __init__(self, block_copy):
+        template = dict(block_copy)
+        template.pop('hash', None)
+        template['nonce'] = NONCE_PLACEHOLDER
+        serialized = canonical_json(template)
+
+        marker = b'"nonce": ' + json.dumps(NONCE_PLACEHOLDER).encode()
+        if serialized.count(marker) != 1:
+            raise ValueError("No se pudo ubicar el nonce en la plantilla del bloque")
+        prefix, _, suffix = serialized.partition(marker)
+
+        self.midstate = hashlib.sha256(prefix + b'"nonce": ')
+        self.buffer = bytearray(NONCE_WIDTH) + suffix
+        self.view = memoryview(self.buffer)
+
+    def hash(self, nonce):
+        """Calcula el hash del bloque para el nonce dado"""
+        digits = b'%d' % nonce
+        start = NONCE_WIDTH - len(digits)
+        self.buffer[start:NONCE_WIDTH] = digits
+        sha = self.midstate.copy()
+        sha.update(self.view[start:])
+        return sha.hexdigest()
+
+
+class BinaryHeaderTemplate:
+    """
+    Plantilla para bloques con codificación binaria: el nonce ocupa los últimos
+    8 bytes de la cabecera, así que basta con copiar el estado SHA-256 del
+    prefijo y añadirle el nonce.
+    """
+
+    def __init__(self, block_copy):
+        self.midstate = hashlib.sha256(block_header_prefix(block_copy))
+
+    def hash(self, nonce):
+        sha = self.midstate.copy()
+        sha.update(NONCE.pack(nonce))
+        return sha.hexdigest()
+
+
+def make_nonce_hasher(block_copy, use_template=True):
+    """Devuelve una función nonce -> hash, usando la plantilla si es posible"""
+    if block_copy.get(ENCODING_FIELD) == ENCODING_BINARY:
+        return BinaryHeaderTemplate(block_copy).hash
+    if use_template:
+        try:
+            return BlockHeaderTemplate(block_copy).hash
+        except ValueError:
+            pass
+    block_copy = dict(block_copy)
+    return lambda nonce: hash_with_nonce(block_copy, nonce)
+
+
+def _get_context():
+    """Usa fork cuando está disponible para no reimportar la aplicación en cada worker"""
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _search_stride(block_copy, target, start, stride, max_nonce, stop_event, found_nonce, attempts, slot,
+                   use_template):
+    """
+    Recorre los nonces start, start + stride, start + 2*stride, ...
+    El primer worker que encuentra un hash válido lo publica y cancela al resto.
+    """
+    hash_nonce = make_nonce_hasher(block_copy, use_template)
+    nonce = start
+    tried = 0
+    while nonce <= max_nonce:
+        if hash_nonce(nonce).startswith(target):
+            with found_nonce.get_lock():
+                if found_nonce.value < 0:
+                    found_nonce.value = nonce
+            stop_event.set()
+            break
+
+        nonce += stride
+        tried += 1
+        if tried % CHECK_INTERVAL == 0:
+            attempts[slot] = tried
+            if stop_event.is_set():
+                break
+
+    attempts[slot] = tried
+
+
+class ParallelMiner:
+    """Reparte el espacio de nonces entre varios procesos"""
+
+    def __init__(self, workers, use_template=True):
+        self.workers = max(1, int(workers))
+        self.use_template = use_template
+        self.attempts = 0  # Hashes calculados en la última búsqueda
+
+    def search(self, block_copy, target, should_stop, on_progress=None, max_nonce=MAX_NONCE):
+        """
+        Busca un nonce válido para el bloque.
+
+        Args:
+            block_copy (dict): Bloque a minar (su campo 'hash' se ignora)
+            target (str): Prefijo que debe tener el hash
+            should_stop (callable): Devuelve True si se solicitó detener el minado
+            on_progress (callable): Recibe el total de intentos periódicamente
+
+        Returns:
+            int | None: Nonce encontrado, o None si se detuvo el minado
+        """
+        ctx = _get_context()
+        stop_event = ctx.Event()
+        found_nonce = ctx.Value('q', -1)
+        attempts = ctx.Array('q', self.workers, lock=False)
+
+        processes = [
+            ctx.Process(
+                target=_search_stride,
+                args=(block_copy, target, start, self.workers, max_nonce,
+                      stop_event, found_nonce, attempts, start, self.use_template),
+                daemon=True
+            )
+            for start in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            while any(process.is_alive() for process in processes):
+                if stop_event.wait(POLL_SECONDS):
+                    break
+                if should_stop():
+                    stop_event.set()
+                    break
+                if on_progress:
+                    # Los workers avanzan intercalados: la frontera de nonces
+                    # explorados coincide aproximadamente con el total de intentos
+                    on_progress(sum(attempts))
+        finally:
+            stop_event.set()
+            for process in processes:
+                process.join()
+            self.attempts = sum(attempts)
+
+        if found_nonce.value >= 0:
+            return found_nonce.value
+        if should_stop():
+            return None
+        raise ValueError(f"No se encontró un hash válido después de {max_nonce:,} intentos")
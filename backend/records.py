@@ -0,0 +1,202 @@
+# records.py
+"""
+Bloques y transacciones compactos.
+
+Un dict por transacción repite en cada objeto su tabla de claves y la
+cadena completa se guardaba así. Transaction y Block guardan los campos
+conocidos en __slots__ (los campos poco comunes, en un dict aparte) y se
+comportan como un Mapping de solo lectura, de modo que el código que lee
+tx['amount'] o block.get('encoding') no cambia.
+
+Como no se modifican después de creados, cada transacción calcula una sola
+vez su digest (la hoja del árbol de Merkle, que en JSON también da el txid)
+y cada bloque su hash y su huella. La serialización no se conserva: solo
+se usa para obtener el digest y ocuparía más que el dict que reemplaza.
+Para JSON se convierten con to_dict() (ver encoding.json_default).
+"""
+
+import hashlib
+from collections.abc import Mapping
+
+from encoding import ENCODING_BINARY, ENCODING_FIELD, canonical_json, compute_block_hash, encode_canonical
+
+MISSING = object()
+
+TRANSACTION_FIELDS = ('sender', 'recipient', 'amount', 'fee', 'timestamp', 'type', 'signature', ENCODING_FIELD)
+BLOCK_FIELDS = ('index', 'timestamp', 'transactions', 'previous_hash', 'merkle_root', 'nonce', 'hash', ENCODING_FIELD)
+
+
+class Record(Mapping):
+    """Campos en __slots__ con la interfaz de lectura de un dict; los ausentes quedan sin asignar"""
+
+    __slots__ = ('extra',)
+    FIELDS = ()
+    FIELD_SET = frozenset()
+
+    def __init__(self, values):
+        extra = None
+        for key, value in values.items():
+            if key in self.FIELD_SET:
+                setattr(self, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, values):
+        return values if isinstance(values, cls) else cls(values)
+
+    def __getitem__(self, key):
+        if key in self.FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self.FIELD_SET:
+            return getattr(self, key, default)
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        if key in self.FIELD_SET:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        values = {key: value for key in self.FIELDS if (value := getattr(self, key, MISSING)) is not MISSING}
+        if self.extra:
+            values.update(self.extra)
+        return values
+
+    # dict() y la serialización recorren estas vistas; se arman en C a partir de to_dict()
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def values(self):
+        return self.to_dict().values()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def without(self, field):
+        """Copia sin uno de los campos conocidos (p. ej. la transacción sin su firma)"""
+        copy = type(self).__new__(type(self))
+        for key in self.FIELDS:
+            if key != field and hasattr(self, key):
+                setattr(copy, key, getattr(self, key))
+        copy.extra = self.extra
+        return copy
+
+
+class Transaction(Record):
+    """Transacción inmutable con su digest cacheado"""
+
+    __slots__ = TRANSACTION_FIELDS + ('_digest', '_txid', '_unsigned')
+    FIELDS = TRANSACTION_FIELDS
+    FIELD_SET = frozenset(TRANSACTION_FIELDS)
+
+    @property
+    def serialized(self):
+        """Bytes que se firman y se hashean (ver encoding.serialize_transaction)"""
+        return encode_canonical(self.to_dict())
+
+    @property
+    def digest(self):
+        """SHA-256 de la serialización: la hoja del árbol de Merkle"""
+        try:
+            return self._digest
+        except AttributeError:
+            self._digest = hashlib.sha256(self.serialized).digest()
+            return self._digest
+
+    @property
+    def txid(self):
+        """ID de la transacción (ver mempool.transaction_id)"""
+        if self.get(ENCODING_FIELD) != ENCODING_BINARY:
+            # En JSON el txid se calcula sobre los mismos bytes que el digest
+            return self.digest.hex()
+        try:
+            return self._txid
+        except AttributeError:
+            self._txid = hashlib.sha256(canonical_json(self.to_dict())).hexdigest()
+            return self._txid
+
+    def unsigned(self):
+        """
+        La transacción sin 'signature', tal como se firmó. Se arma una sola
+        vez: las verificaciones repetidas reusan la copia y su digest.
+        """
+        try:
+            return self._unsigned
+        except AttributeError:
+            self._unsigned = self.without('signature')
+            return self._unsigned
+
+
+class Block(Record):
+    """Bloque inmutable con sus transacciones como Transaction y su hash y huella cacheados"""
+
+    __slots__ = BLOCK_FIELDS + ('_computed_hash', '_fingerprint')
+    FIELDS = BLOCK_FIELDS
+    FIELD_SET = frozenset(BLOCK_FIELDS)
+
+    def __init__(self, values):
+        super().__init__(values)
+        if hasattr(self, 'transactions'):
+            self.transactions = tuple(Transaction.from_dict(tx) for tx in self.transactions)
+
+    @property
+    def computed_hash(self):
+        """Hash calculado del bloque (ver encoding.hash_block); puede no coincidir con block['hash']"""
+        try:
+            return self._computed_hash
+        except AttributeError:
+            self._computed_hash = compute_block_hash(self)
+            return self._computed_hash
+
+    @property
+    def fingerprint(self):
+        try:
+            return self._fingerprint
+        except AttributeError:
+            self._fingerprint = fingerprint(self)
+            return self._fingerprint
+
+
+def fingerprint(block):
+    """
+    Huella barata de un bloque: encabezado más los campos de cada transacción.
+    No sustituye al hash del bloque, solo detecta si un bloque ya validado
+    fue modificado o reemplazado.
+    """
+    return hash((
+        block['index'],
+        block['hash'],
+        block['previous_hash'],
+        block.get('merkle_root'),
+        block.get('nonce'),
+        block.get('timestamp'),
+        block.get(ENCODING_FIELD),
+        tuple(tuple(sorted(tx.items())) for tx in block['transactions'])
+    ))
@@ -0,0 +1,197 @@
+# replay.py
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from amounts import INITIAL_ESCROW_BALANCE, INITIAL_WALLET_BALANCE, amount_units, to_bbc
+PARALLEL_MIN_OPERATIONS = 20000  # Por debajo no compensa repartir los shards entre procesos
+
+# Operaciones sobre balances, en el orden exacto en que las aplica Blockchain
+DEBIT = 0   # balances[a] = total(a) - monto, tras comprobar total(a) >= monto
+CREDIT = 1  # balances[a] = total(a) + monto
+ADD = 2     # balances[a] = balances.get(a, 0) + monto (segundo abono al contrato)
+CHECK = 3   # total(a) >= monto, sin modificar nada (saldo del contrato al liberar fondos)
+
+logger = logging.getLogger(__name__)
+
+
+def initial_balances(public_keys, wallet_addresses, escrow_address='escrow_contract'):
+    """
+    Balances previos al primer bloque: los que el nodo asigna fuera de la
+    cadena (10 BBC por wallet, 0 por dirección asociada, 1000 al contrato).
+    """
+    balances = {escrow_address: INITIAL_ESCROW_BALANCE, 'mediator': 0}
+    for address in public_keys:
+        balances[address] = INITIAL_WALLET_BALANCE
+    for addresses in wallet_addresses.values():
+        for address in addresses:
+            balances[address] = 0
+    return balances
+
+
+class ReplayResult:
+    def __init__(self):
+        self.balances = {}
+        self.locked_funds = {}
+        self.violations = []   # (altura, posición, descripción) de reglas que no se cumplieron
+        self.blocks = 0
+        self.transactions = 0
+        self.elapsed = 0.0
+        self.shards = 0
+
+    @property
+    def blocks_per_second(self):
+        return self.blocks / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return {
+            'blocks': self.blocks,
+            'transactions': self.transactions,
+            'shards': self.shards,
+            'elapsed': self.elapsed,
+            'blocks_per_second': self.blocks_per_second,
+            'violations': [
+                {'block_index': height, 'position': position, 'error': error}
+                for height, position, error in self.violations
+            ]
+        }
+
+
+class ChainReplayer:
+    """
+    Reconstruye balances y fondos bloqueados del escrow recorriendo la cadena
+    una sola vez.
+
+    Reproduce exactamente Blockchain.apply_block y process_transaction, con
+    sus particularidades: el saldo de una wallet se calcula sumando sus
+    direcciones asociadas, el contrato recibe dos veces el monto de cada
+    depósito y el minero cobra la coinbase al final del bloque.
+
+    La pasada por la cadena solo traduce cada transacción a operaciones y las
+    agrupa por shard (una wallet principal con sus direcciones asociadas).
+    Cada operación solo lee y escribe balances de su propio shard, así que
+    los shards se pueden aplicar en paralelo sin alterar el resultado.
+    """
+
+    def __init__(self, initial, wallet_addresses=None, agreements=None,
+                 escrow_address='escrow_contract', workers=1):
+        """
+        Args:
+            initial (dict): Balances antes del primer bloque (ver initial_balances)
+            wallet_addresses (dict): wallet principal -> direcciones asociadas
+            agreements (dict): Acuerdos del escrow, para liberar fondos bloqueados
+            workers (int): Procesos para aplicar los shards
+        """
+        self.initial = dict(initial)
+        self.children = {wallet: list(addresses) for wallet, addresses in (wallet_addresses or {}).items()}
+        self.parent_of = {address: wallet for wallet, addresses in self.children.items() for address in addresses}
+        self.agreements = agreements or {}
+        self.escrow_address = escrow_address
+        self.workers = max(1, int(workers))
+
+    def shard_of(self, address):
+        return self.parent_of.get(address, address)
+
+    def replay(self, blocks):
+        """Aplica los bloques (cualquier iterable, p. ej. un BlockStore) y devuelve un ReplayResult"""
+        result = ReplayResult()
+        started = perf_counter()
+        shards = {}
+
+        def emit(op, address, amount, height, position):
+            shards.setdefault(self.shard_of(address), []).append((op, address, amount, height, position))
+
+        seller_buyers = {}
+        for agreement in self.agreements.values():
+            seller_buyers.setdefault(agreement['seller'], []).append(agreement['buyer'])
+
+        for height, block in enumerate(blocks):
+            result.blocks += 1
+            transactions = block['transactions']
+            if not transactions:
+                continue
+            result.transactions += len(transactions)
+
+            for position, tx in enumerate(transactions[1:], 1):
+                if tx.get('type') == 'coinbase':
+                    continue
+                sender, recipient = tx['sender'], tx['recipient']
+                amount, fee = amount_units(tx['amount']), amount_units(tx.get('fee', 0))
+
+                emit(DEBIT, sender, (amount + fee, amount + fee), height, position)
+                emit(CREDIT, recipient, amount, height, position)
+                if recipient == self.escrow_address:
+                    emit(ADD, recipient, amount, height, position)
+                    result.locked_funds[sender] = result.locked_funds.get(sender, 0) + amount
+                if sender == self.escrow_address:
+                    emit(CHECK, sender, amount, height, position)
+                    for buyer in seller_buyers.get(recipient, ()):
+                        if buyer in result.locked_funds:
+                            result.locked_funds[buyer] -= amount
+                            if result.locked_funds[buyer] <= 0:
+                                del result.locked_funds[buyer]
+
+            coinbase = transactions[0]
+            emit(CREDIT, coinbase['recipient'], amount_units(coinbase['amount']), height, 0)
+
+        # Los shards sin operaciones conservan su balance inicial
+        jobs = {}
+        for shard, operations in shards.items():
+            members = [shard] + self.children.get(shard, [])
+            jobs[shard] = (operations, {a: self.initial[a] for a in members if a in self.initial},
+                           self.children.get(shard, []))
+        result.shards = len(jobs)
+
+        result.balances = dict(self.initial)
+        for balances, violations in self.apply_shards(jobs):
+            result.balances.update(balances)
+            result.violations.extend(violations)
+        result.violations.sort()
+
+        result.elapsed = perf_counter() - started
+        logger.info("Replay de %s bloques en %.3f s (%.0f bloques/s, %s shards)",
+                    result.blocks, result.elapsed, result.blocks_per_second, result.shards)
+        return result
+
+    def apply_shards(self, jobs):
+        total_operations = sum(len(job[0]) for job in jobs.values())
+        if self.workers < 2 or len(jobs) < 2 or total_operations < PARALLEL_MIN_OPERATIONS:
+            return [apply_shard(shard, *job) for shard, job in jobs.items()]
+
+        ctx = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(self.workers, mp_context=ctx) as pool:
+            futures = [pool.submit(apply_shard, shard, *job) for shard, job in jobs.items()]
+            return [future.result() for future in futures]
+
+
+def apply_shard(wallet, operations, balances, children):
+    """
+    Aplica en orden las operaciones de un shard. total() reproduce
+    BalanceLedger.total: una wallet con direcciones asociadas suma las suyas.
+    """
+    balances = dict(balances)
+    violations = []
+
+    def total(address):
+        value = balances.get(address, 0)
+        if address == wallet and children:
+            for child in children:
+                value += balances.get(child, 0)
+        return value
+
+    for op, address, amount, height, position in operations:
+        if op == DEBIT:
+            required, debit = amount
+            current = total(address)
+            if current < required:
+                violations.append((height, position, f"Balance insuficiente para {address}"))
+            balances[address] = current - debit
+        elif op == CREDIT:
+            balances[address] = total(address) + amount
+        elif op == ADD:
+            balances[address] = balances.get(address, 0) + amount
+        elif op == CHECK and total(address) < amount:
+            violations.append((height, position, f"Balance insuficiente en el contrato: {to_bbc(total(address))} BBC"))
+    return balances, violations
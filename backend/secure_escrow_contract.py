@@ -1,7 +1,15 @@
 # secure_escrow_contract.py
 
+import logging
 from time import time
 
+from amounts import UNITS_PER_BBC, amount_units, mul_bps, to_bbc
+from crypto_utils import sign_transactions_batch
+from escrow_index import AgreementIndex
+from escrow_scheduler import DeadlineScheduler, EXPIRY_BATCH, EXPIRY_RETRY
+
+logger = logging.getLogger(__name__)
+
 class SecureEscrowContract:
     def __init__(self, blockchain):
         self.blockchain = blockchain
@@ -10,11 +18,50 @@ class SecureEscrowContract:
             'agreements': {},      # Detalles de acuerdos
             'locked_funds': {},    # Fondos bloqueados
         }
+        self.index = AgreementIndex()  # Acuerdos por comprador, vendedor, estado y fecha
+        self.scheduler = DeadlineScheduler()  # Vencimiento de cada acuerdo en su estado actual
         
-        # Comisiones del contrato
-        self.MEDIATOR_FEE = 0.01        # 1% para el mediador
-        self.INITIAL_MINING_FEE = 0.001  # 0.1% para el minero en la transacción inicial
-        self.RELEASE_MINING_FEE = 0.001  # 0.1% para el minero en cada liberación de fondos
+        # Comisiones del contrato (montos en unidades, ver amounts.py)
+        self.MEDIATOR_FEE_BPS = 100        # 1% para el mediador
+        self.INITIAL_MINING_FEE_BPS = 10   # 0.1% para el minero en la transacción inicial
+        self.RELEASE_MINING_FEE = UNITS_PER_BBC // 1000  # 0.001 BBC para el minero en cada liberación de fondos
+
+    def load_agreements(self, agreements):
+        """Reemplaza los acuerdos (p. ej. al restaurar un snapshot) y reconstruye los índices"""
+        self.state['agreements'] = agreements
+        self.index.rebuild(agreements)
+        self.scheduler.clear()
+        for agreement_id, agreement in agreements.items():
+            self.scheduler.schedule(agreement_id, agreement['status'],
+                                    agreement.get('status_timestamp', agreement['timestamp']))
+
+    def set_status(self, agreement_id, status):
+        """Cambia el estado de un acuerdo manteniendo los índices al día"""
+        agreement = self.state['agreements'][agreement_id]
+        old_status = agreement['status']
+        agreement['status'] = status
+        self.index.change_status(agreement_id, agreement, old_status, status)
+        self.schedule_expiry(agreement_id, agreement, time())
+
+    def schedule_expiry(self, agreement_id, agreement, since):
+        """Programa el vencimiento del acuerdo en su estado actual (ver escrow_scheduler.py)"""
+        agreement['status_timestamp'] = since
+        expires_at = self.scheduler.schedule(agreement_id, agreement['status'], since)
+        if expires_at is None:
+            agreement.pop('expires_at', None)
+        else:
+            agreement['expires_at'] = expires_at
+
+    def get_agreement(self, agreement_id):
+        """Copia de un acuerdo con su id, o None si no existe"""
+        agreement = self.state['agreements'].get(agreement_id)
+        if agreement is None:
+            return None
+        return dict(agreement, id=agreement_id)
+
+    def agreements_for(self, address):
+        """Acuerdos de una dirección (comprador o vendedor) en el orden del panel de escrow"""
+        return [self.get_agreement(agreement_id) for agreement_id in self.index.ids_for_participant(address)]
 
     def process_escrow_transaction(self, transaction):
         """Procesa una transacción del contrato cuando es minada"""
@@ -26,69 +73,138 @@ class SecureEscrowContract:
                 sender = transaction['sender']
                 if sender not in self.state['locked_funds']:
                     self.state['locked_funds'][sender] = 0
-                self.state['locked_funds'][sender] += transaction['amount']
+                self.state['locked_funds'][sender] += amount_units(transaction['amount'])
             
             elif transaction['sender'] == self.address:
                 # Fondos liberados por el contrato
-                for agreement in self.state['agreements'].values():
-                    if agreement['seller'] == transaction['recipient']:
-                        buyer = agreement['buyer']
-                        if buyer in self.state['locked_funds']:
-                            self.state['locked_funds'][buyer] -= transaction['amount']
-                            if self.state['locked_funds'][buyer] <= 0:
-                                del self.state['locked_funds'][buyer]
+                for agreement_id in self.index.ids_for_seller(transaction['recipient']):
+                    buyer = self.state['agreements'][agreement_id]['buyer']
+                    if buyer in self.state['locked_funds']:
+                        self.state['locked_funds'][buyer] -= amount_units(transaction['amount'])
+                        if self.state['locked_funds'][buyer] <= 0:
+                            del self.state['locked_funds'][buyer]
 
     def create_agreement(self, agreement_id: str, buyer: str, seller: str, amount: float, description: str, buyer_private_key: str):
         """Crea un nuevo acuerdo donde el comprador paga todas las comisiones"""
         
-        # Calcular comisiones
-        mediator_fee = amount * self.MEDIATOR_FEE
-        initial_mining_fee = amount * self.INITIAL_MINING_FEE
-        release_fees = self.RELEASE_MINING_FEE * 2
-        
-        total_amount = amount + mediator_fee + initial_mining_fee + release_fees
+        fees = self.agreement_fees(amount)
         
-        # Verificar fondos suficientes
-        if self.blockchain.get_balance(buyer) < total_amount:
-            raise ValueError(f"Fondos insuficientes. Se requiere {total_amount} BBC")
+        # Verificar fondos suficientes (sin contar lo comprometido en la mempool)
+        if self.blockchain.get_available_balance(buyer) < fees['total_amount']:
+            raise ValueError(f"Fondos insuficientes. Se requiere {to_bbc(fees['total_amount'])} BBC")
         
-        # Crear transacción de depósito
+        transfer_transaction = self.deposit_transaction(buyer, amount, fees)
+
+        # Firmar y enviar a mempool
+        signature = self.blockchain.sign_transaction(buyer_private_key, transfer_transaction)
+        transfer_transaction['signature'] = signature.hex()
+        self.blockchain.enqueue_transaction(transfer_transaction)
+
+        self.register_agreement(agreement_id, buyer, seller, amount, description, fees)
+        return agreement_id
+
+    def sign_deposits(self, requests):
+        """
+        Arma y firma juntos los depósitos de un lote de acuerdos (cada clave
+        privada se decodifica una vez). No lee ni modifica el estado, así que
+        se llama sin el lock de escritura; create_agreements los aplica después.
+
+        Args:
+            requests (list): Dicts con buyer, amount y buyer_private_key
+
+        Returns:
+            list: Por cada solicitud, (comisiones, depósito firmado o la excepción al firmar)
+        """
+        deposits = []
+        for item in requests:
+            fees = self.agreement_fees(item['amount'])
+            deposits.append((fees, self.deposit_transaction(item['buyer'], item['amount'], fees)))
+
+        signatures = sign_transactions_batch(
+            [(item['buyer_private_key'], transaction) for item, (_, transaction) in zip(requests, deposits)]
+        )
+        signed = []
+        for (fees, transaction), signature in zip(deposits, signatures):
+            if not isinstance(signature, Exception):
+                transaction['signature'] = signature.hex()
+                signature = transaction
+            signed.append((fees, signature))
+        return signed
+
+    def create_agreements(self, requests, deposits):
+        """
+        Crea varios acuerdos en una pasada: el balance disponible de cada
+        comprador (descontando la mempool) se consulta una sola vez y se
+        descuenta a medida que se aceptan sus acuerdos del lote.
+
+        Args:
+            requests (list): Dicts con agreement_id, buyer, seller, amount,
+                description y buyer_private_key
+            deposits (list): Lo que devolvió sign_deposits para esas solicitudes
+
+        Returns:
+            list: Por cada solicitud, None si se creó o el mensaje de error
+        """
+        errors = [None] * len(requests)
+        available = {}
+        for i, (item, (fees, transaction)) in enumerate(zip(requests, deposits)):
+            if isinstance(transaction, Exception):
+                errors[i] = str(transaction)
+                continue
+            buyer = item['buyer']
+            if buyer not in available:
+                available[buyer] = self.blockchain.get_available_balance(buyer)
+            if available[buyer] < fees['total_amount']:
+                errors[i] = f"Fondos insuficientes. Se requiere {to_bbc(fees['total_amount'])} BBC"
+                continue
+            available[buyer] -= fees['total_amount']
+            self.blockchain.enqueue_transaction(transaction)
+            self.register_agreement(item['agreement_id'], buyer, item['seller'],
+                                    item['amount'], item['description'], fees)
+        return errors
+
+    def agreement_fees(self, amount):
+        """Comisiones de un acuerdo; todas las paga el comprador"""
+        mediator_fee = mul_bps(amount, self.MEDIATOR_FEE_BPS)
+        initial_mining_fee = mul_bps(amount, self.INITIAL_MINING_FEE_BPS)
+        release_fees = self.RELEASE_MINING_FEE * 2
+        return {
+            'mediator_fee': mediator_fee,
+            'initial_mining_fee': initial_mining_fee,
+            'release_fees': release_fees,
+            'total_amount': amount + mediator_fee + initial_mining_fee + release_fees
+        }
+
+    def deposit_transaction(self, buyer, amount, fees):
+        """Transacción (sin firmar) que deposita los fondos del comprador en el contrato"""
         transfer_transaction = {
             'sender': buyer,
             'recipient': self.address,
-            'amount': amount + mediator_fee + release_fees,
-            'fee': initial_mining_fee,
+            'amount': amount + fees['mediator_fee'] + fees['release_fees'],
+            'fee': fees['initial_mining_fee'],
             'timestamp': time(),
             'type': 'escrow_deposit'
         }
+        return self.blockchain.tag_encoding(transfer_transaction)
 
-        # Firmar y enviar a mempool
-        signature = self.blockchain.sign_transaction(buyer_private_key, transfer_transaction)
-        transfer_transaction['signature'] = signature.hex()
-        self.blockchain.mempool.append(transfer_transaction)
-
-        # Registrar acuerdo
-        self.state['agreements'][agreement_id] = {
+    def register_agreement(self, agreement_id, buyer, seller, amount, description, fees):
+        agreement = self.state['agreements'][agreement_id] = {
             'buyer': buyer,
             'seller': seller,
             'amount': amount,
-            'mediator_fee': mediator_fee,
-            'reserved_mining_fees': release_fees,
+            'mediator_fee': fees['mediator_fee'],
+            'reserved_mining_fees': fees['release_fees'],
             'description': description,
             'status': 'PENDING_SELLER_CONFIRMATION',
             'shipped': False,
             'delivery_confirmed': False,
             'timestamp': time()
         }
+        self.index.add(agreement_id, agreement)
+        self.schedule_expiry(agreement_id, agreement, agreement['timestamp'])
         
-        print(f"\n=== NUEVO ACUERDO CREADO ===")
-        print(f"ID: {agreement_id}")
-        print(f"Comprador: {buyer}")
-        print(f"Vendedor: {seller}")
-        print(f"Monto: {amount} BBC")
-        print(f"Estado: PENDING_SELLER_CONFIRMATION")
-        
-        return agreement_id
+        logger.info("Nuevo acuerdo %s: comprador %s, vendedor %s, monto %s BBC, estado PENDING_SELLER_CONFIRMATION",
+                    agreement_id, buyer, seller, to_bbc(amount))
 
     def confirm_seller_participation(self, agreement_id: str, seller: str):
         """Confirmación del vendedor para participar"""
@@ -102,10 +218,8 @@ class SecureEscrowContract:
         if agreement['status'] != 'PENDING_SELLER_CONFIRMATION':
             raise ValueError("Estado inválido para confirmar participación")
             
-        agreement['status'] = 'AWAITING_SHIPMENT'
-        print(f"\n=== VENDEDOR CONFIRMÓ PARTICIPACIÓN ===")
-        print(f"Acuerdo: {agreement_id}")
-        print(f"Estado actualizado: AWAITING_SHIPMENT")
+        self.set_status(agreement_id, 'AWAITING_SHIPMENT')
+        logger.info("Vendedor confirmó participación en el acuerdo %s, estado AWAITING_SHIPMENT", agreement_id)
         return True
 
     def confirm_shipment(self, agreement_id: str, seller: str, tracking_info: str = None):
@@ -122,13 +236,10 @@ class SecureEscrowContract:
             
         agreement['shipped'] = True
         agreement['tracking_info'] = tracking_info
-        agreement['status'] = 'SHIPPED'
+        self.set_status(agreement_id, 'SHIPPED')
         agreement['shipping_timestamp'] = time()
         
-        print(f"\n=== ENVÍO CONFIRMADO ===")
-        print(f"Acuerdo: {agreement_id}")
-        print(f"Tracking: {tracking_info}")
-        print(f"Estado actualizado: SHIPPED")
+        logger.info("Envío confirmado en el acuerdo %s (tracking: %s), estado SHIPPED", agreement_id, tracking_info)
         return True
 
     def confirm_delivery(self, agreement_id: str, buyer: str):
@@ -139,10 +250,19 @@ class SecureEscrowContract:
         agreement = self.state['agreements'][agreement_id]
         if agreement['buyer'] != buyer:
             raise ValueError("Solo el comprador puede confirmar entrega")
+
+        # Un acuerdo ya completado, reembolsado o expirado no vuelve a pagarse
+        if agreement['status'] != 'SHIPPED':
+            raise ValueError("Estado inválido para confirmar entrega")
         
-        print(f"\n=== PROCESANDO CONFIRMACIÓN DE ENTREGA ===")
-        print(f"Acuerdo: {agreement_id}")
-        
+        logger.debug("Procesando confirmación de entrega del acuerdo %s", agreement_id)
+        self.release_funds(agreement_id)
+        return True
+
+    def release_funds(self, agreement_id):
+        """Paga al vendedor y al mediador y marca el acuerdo como completado"""
+        agreement = self.state['agreements'][agreement_id]
+
         # Crear transacciones de pago
         current_time = time()
         mining_fee = self.RELEASE_MINING_FEE
@@ -169,16 +289,14 @@ class SecureEscrowContract:
             'signature': 'VALID'
         }
 
-        self.blockchain.mempool.append(transfer_to_seller)
-        self.blockchain.mempool.append(mediator_fee_transaction)
+        self.blockchain.enqueue_transaction(transfer_to_seller)
+        self.blockchain.enqueue_transaction(mediator_fee_transaction)
         
-        agreement['status'] = 'COMPLETED'
+        self.set_status(agreement_id, 'COMPLETED')
         agreement['delivery_confirmed'] = True
         
-        print(f"Pago enviado al vendedor: {agreement['amount']} BBC")
-        print(f"Comisión al mediador: {agreement['mediator_fee']} BBC")
-        print(f"Estado actualizado: COMPLETED")
-        return True
+        logger.info("Acuerdo %s completado: %s BBC al vendedor, %s BBC de comisión al mediador",
+                    agreement_id, to_bbc(agreement['amount']), to_bbc(agreement['mediator_fee']))
 
     def open_dispute(self, agreement_id: str, buyer: str, reason: str = None):
         """Abre una disputa e inicia el reembolso inmediato"""
@@ -196,12 +314,16 @@ class SecureEscrowContract:
         if current_state not in valid_states:
             raise ValueError(f"No se puede abrir disputa en estado: {current_state}")
 
-        print(f"\n=== PROCESANDO DISPUTA Y REEMBOLSO ===")
-        print(f"Acuerdo: {agreement_id}")
-        print(f"Comprador: {agreement['buyer']}")
-        print(f"Estado actual: {current_state}")
-        print(f"Razón: {reason}")
-        print(f"Monto a reembolsar: {agreement['amount']} BBC")
+        logger.debug("Procesando disputa del acuerdo %s (comprador: %s, estado: %s, razón: %s, monto: %s BBC)",
+                     agreement_id, agreement['buyer'], current_state, reason, to_bbc(agreement['amount']))
+
+        self.refund(agreement_id, buyer, reason or 'No se proporcionó razón', 'DISPUTE')
+        return True
+
+    def refund(self, agreement_id, cancelled_by, reason, cancellation_type):
+        """Devuelve al comprador el monto y la comisión del mediador y cancela el acuerdo"""
+        agreement = self.state['agreements'][agreement_id]
+        current_state = agreement['status']
 
         # Crear transacción de reembolso
         refund_transaction = {
@@ -214,21 +336,52 @@ class SecureEscrowContract:
             'signature': 'VALID'
         }
 
-        self.blockchain.mempool.append(refund_transaction)
+        self.blockchain.enqueue_transaction(refund_transaction)
         
         # Guardar información de la cancelación ANTES de cambiar el estado
         agreement['cancellation_details'] = {
             'cancelled_at': time(),
             'cancelled_from_state': current_state,
-            'cancelled_by': buyer,
-            'reason': reason or 'No se proporcionó razón',
-            'type': 'DISPUTE'
+            'cancelled_by': cancelled_by,
+            'reason': reason,
+            'type': cancellation_type
         }
         
         # Actualizar estado después de guardar los detalles
-        agreement['status'] = 'CANCELLED'
+        self.set_status(agreement_id, 'CANCELLED')
         
-        print(f"Reembolso enviado a mempool")
-        print(f"Estado previo: {current_state}")
-        print(f"Estado actualizado: CANCELLED")
-        return True
\ No newline at end of file
+        logger.info("Acuerdo %s cancelado desde %s, reembolso enviado a mempool", agreement_id, current_state)
+
+    def expire_agreements(self, now=None, limit=EXPIRY_BATCH):
+        """
+        Aplica los vencimientos pendientes: un acuerdo que el vendedor no
+        aceptó o no envió a tiempo se reembolsa al comprador, y uno enviado
+        que el comprador no confirmó ni disputó se libera al vendedor.
+        Devuelve los IDs procesados.
+
+        Si un acuerdo falla se registra el error y se reintenta en
+        EXPIRY_RETRY segundos; el resto de la pasada sigue su curso.
+        """
+        now = time() if now is None else now
+        expired = []
+        for _ in range(limit):
+            entry = self.scheduler.pop_expired(now)
+            if entry is None:
+                break
+            agreement_id, status = entry
+            agreement = self.state['agreements'][agreement_id]
+            try:
+                if status == 'SHIPPED':
+                    self.release_funds(agreement_id)
+                    agreement['auto_released'] = True
+                else:
+                    self.refund(agreement_id, 'scheduler', f"Plazo vencido en estado {status}", 'EXPIRED')
+            except Exception as e:
+                logger.exception("No se pudo aplicar el vencimiento del acuerdo %s: %s", agreement_id, e)
+                if agreement['status'] == status and agreement_id not in self.scheduler.deadlines:
+                    self.scheduler.retry(agreement_id, status, now + EXPIRY_RETRY)
+                continue
+            expired.append(agreement_id)
+        if expired:
+            logger.info("Vencimientos del escrow: %s acuerdos procesados", len(expired))
+        return expired
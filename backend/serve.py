@@ -0,0 +1,127 @@
+# serve.py
+"""
+Servidor de producción del backend. app.py con `python app.py` usa el
+servidor de desarrollo de Flask (recarga, depurador, un hilo por petición
+sin límite); este módulo sirve la misma app con un servidor real:
+
+    python serve.py [--host 0.0.0.0] [--port 5000] [--threads 8] [--sse-clients 8] [--server auto]
+
+Cada cliente de /events (Server-Sent Events) ocupa un hilo mientras está
+conectado. Por eso el pool tiene --threads hilos para las demás rutas más
+--sse-clients hilos para los flujos de eventos, y /events responde 503 a
+los clientes que exceden --sse-clients: nunca pueden dejar sin hilos a
+las demás peticiones.
+
+Servidores disponibles (--server):
+
+- waitress: WSGI con un pool fijo de hilos (pip install waitress). Es el
+  que se usa con 'auto' si está instalado.
+- werkzeug: servidor con hilos de Werkzeug sin recarga ni depurador; no
+  requiere dependencias adicionales. Crea un hilo por conexión, sin
+  límite, así que no acepta --threads.
+- asgi: uvicorn sirve la app a través de a2wsgi, que la ejecuta en un
+  pool del mismo tamaño (pip install uvicorn a2wsgi).
+
+También se puede usar cualquier servidor WSGI con serve:application, por
+ejemplo `gunicorn -w 1 --threads 16 serve:application` (los hilos deben
+cubrir también los clientes de /events). Siempre con un solo proceso: el
+estado del nodo vive en memoria dentro del proceso.
+
+SIGTERM y SIGINT detienen el servidor de forma ordenada: se detiene el
+minado en curso, se guarda el snapshot de estado y se cierra el almacén de
+bloques (Blockchain.shutdown).
+"""
+
+import argparse
+import logging
+import os
+import signal
+
+from app import app, blockchain
+
+DEFAULT_THREADS = 8      # Hilos para las rutas que no son /events
+DEFAULT_SSE_CLIENTS = 8  # Clientes de /events simultáneos; cada uno ocupa un hilo más
+
+logger = logging.getLogger(__name__)
+
+application = app
+
+
+def serve_waitress(host, port, threads):
+    from waitress import serve
+    serve(application, host=host, port=port, threads=threads)
+
+
+def serve_werkzeug(host, port, threads=None):
+    # Un hilo por conexión: no hay pool que dimensionar (main() rechaza --threads)
+    from werkzeug.serving import make_server
+    server = make_server(host, port, application, threaded=True)
+    server.serve_forever()
+
+
+def serve_asgi(host, port, threads):
+    import uvicorn
+    from a2wsgi import WSGIMiddleware
+    # asgiref.wsgi.WsgiToAsgi ejecuta todas las peticiones en un único hilo
+    # compartido (un solo cliente de /events bloquearía al resto); a2wsgi usa
+    # un pool de tamaño fijo
+    uvicorn.run(WSGIMiddleware(application, workers=threads), host=host, port=port, workers=1)
+
+
+SERVERS = {
+    'waitress': serve_waitress,
+    'werkzeug': serve_werkzeug,
+    'asgi': serve_asgi
+}
+
+
+def pick_server(name):
+    """Devuelve la función que arranca el servidor pedido ('auto' elige waitress si está instalado)"""
+    if name != 'auto':
+        return SERVERS[name]
+    try:
+        import waitress  # noqa: F401
+        return serve_waitress
+    except ImportError:
+        logger.warning("waitress no está instalado; se usa el servidor con hilos de Werkzeug")
+        return serve_werkzeug
+
+
+def handle_termination(signum, frame):
+    # Se convierte en SystemExit para que el servidor salga de su bucle y corra el finally de main()
+    raise SystemExit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción del simulador de blockchain")
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--threads', type=int, default=os.environ.get('SERVER_THREADS'),
+                        help=f"hilos para las rutas que no son /events (por defecto {DEFAULT_THREADS})")
+    parser.add_argument('--sse-clients', type=int, default=int(os.environ.get('SSE_CLIENTS', DEFAULT_SSE_CLIENTS)),
+                        help="clientes de /events simultáneos; se suman al pool de hilos")
+    parser.add_argument('--server', choices=['auto'] + list(SERVERS), default=os.environ.get('SERVER', 'auto'))
+    args = parser.parse_args()
+
+    run = pick_server(args.server)
+    if run is serve_werkzeug:
+        if args.threads is not None:
+            parser.error("--threads no aplica al servidor werkzeug: crea un hilo por conexión")
+        threads = None
+    else:
+        threads = (args.threads or DEFAULT_THREADS) + args.sse_clients
+    app.config['MAX_EVENT_CLIENTS'] = args.sse_clients
+
+    signal.signal(signal.SIGTERM, handle_termination)
+    logger.info("Sirviendo en %s:%s con %s (%s, hasta %s clientes de /events)", args.host, args.port, run.__name__,
+                f"{threads} hilos" if threads else "un hilo por conexión", args.sse_clients)
+    try:
+        run(args.host, args.port, threads)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Señal de parada recibida")
+    finally:
+        blockchain.shutdown()
+
+
+if __name__ == '__main__':
+    main()
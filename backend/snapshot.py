@@ -0,0 +1,120 @@
+# snapshot.py
+
+import json
+import logging
+import os
+import zlib
+
+from amounts import AGREEMENT_AMOUNT_FIELDS, to_units
+
+SNAPSHOT_MAGIC = b'BBCSNAP1'
+SNAPSHOT_VERSION = 2  # 2: montos en unidades enteras (ver amounts.py)
+SNAPSHOT_FILE = 'state.snapshot'
+WALLET_JOURNAL_FILE = 'wallets.journal'  # Registros de wallets y direcciones, uno por línea
+DEFAULT_SNAPSHOT_INTERVAL = 10  # Bloques entre snapshots automáticos
+
+logger = logging.getLogger(__name__)
+
+
+def encode_state(state):
+    """
+    Serializa el estado a bytes. Debe llamarse con el lock de lectura tomado:
+    el estado capturado comparte dicts con el nodo (acuerdos, índice de la
+    cadena) y solo los bytes resultantes se pueden escribir fuera del lock.
+    """
+    return json.dumps(state, separators=(',', ':')).encode()
+
+
+def write_snapshot(path, data, sync=True):
+    """
+    Escribe el estado ya serializado (ver encode_state) en path de forma
+    atómica: se escribe un archivo temporal en el mismo directorio, se
+    sincroniza a disco y se renombra encima del anterior. Una caída a mitad
+    de la escritura deja intacto el snapshot previo.
+    """
+    payload = SNAPSHOT_MAGIC + zlib.compress(data, 6)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if sync:
+        # El renombrado solo es durable cuando se sincroniza el directorio
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    return len(payload)
+
+
+def append_journal(path, entry, sync=True):
+    """
+    Añade una entrada al diario de wallets. Las wallets y direcciones se
+    registran fuera de la cadena; sin el diario, las creadas después del
+    último snapshot se perderían en una caída.
+    """
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+
+
+def read_journal(path):
+    """Entradas del diario de wallets; una última línea incompleta (caída a mitad) se ignora"""
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            logger.warning("Diario de wallets: se ignora una entrada incompleta")
+    return entries
+
+
+def read_snapshot(path):
+    """Lee un snapshot; devuelve None si no existe o no es válido"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if not data.startswith(SNAPSHOT_MAGIC):
+        logger.warning("Snapshot %s ignorado: formato desconocido", path)
+        return None
+    try:
+        state = json.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC):]))
+    except (zlib.error, ValueError) as e:
+        logger.warning("Snapshot %s ignorado: %s", path, e)
+        return None
+    if state.get('version') == 1:
+        return upgrade_v1(state)
+    if state.get('version') != SNAPSHOT_VERSION:
+        logger.warning("Snapshot %s ignorado: versión %s no soportada", path, state.get('version'))
+        return None
+    return state
+
+
+def upgrade_v1(state):
+    """
+    Pasa a unidades los montos de un snapshot de la versión 1 (floats en BBC).
+    La mempool no se toca: sus transacciones están firmadas con esos montos.
+    """
+    state['balances'] = {address: to_units(value) for address, value in state['balances'].items()}
+    escrow = state['escrow']
+    escrow['locked_funds'] = {address: to_units(value) for address, value in escrow['locked_funds'].items()}
+    for agreement in escrow['agreements'].values():
+        for field in AGREEMENT_AMOUNT_FIELDS:
+            if field in agreement:
+                agreement[field] = to_units(agreement[field])
+    state['version'] = SNAPSHOT_VERSION
+    logger.info("Snapshot de la versión 1 convertido a montos en unidades")
+    return state
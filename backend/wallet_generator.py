@@ -2,9 +2,12 @@ import secrets
 import hashlib
 import hmac
 import binascii
+import logging
 from typing import Tuple
 from ecdsa import SigningKey, SECP256k1
 
+logger = logging.getLogger(__name__)
+
 class WalletGenerator:
     BIP39_WORDS = [
         "abandon", "ability", "able", "about", "above", "absent", "absorb", "abstract",
@@ -290,23 +293,23 @@ class WalletGenerator:
         checksum = hashlib.sha256(entropy).digest()
         checksum_int = int.from_bytes(checksum, 'big')
         
-        print(f"Bits de entropía: {ent}")
-        print(f"Bits de checksum: {checksum_bits}")
-        print(f"Checksum completo: {checksum.hex()}")
-        print(f"Primeros {checksum_bits} bits usados: {bin(checksum_int >> (256 - checksum_bits))[2:].zfill(checksum_bits)}")
+        logger.debug("Bits de entropía: %s", ent)
+        logger.debug("Bits de checksum: %s", checksum_bits)
+        logger.debug("Checksum completo: %s", checksum.hex())
+        logger.debug("Primeros %s bits usados: %s", checksum_bits, bin(checksum_int >> (256 - checksum_bits))[2:].zfill(checksum_bits))
         
         # 2. Combinar entropía con checksum
         total_bits = ent + checksum_bits
         entropy_int = int.from_bytes(entropy, 'big')
         combined = (entropy_int << checksum_bits) | (checksum_int >> (256 - checksum_bits))
         
-        print(f"\nEntropía + checksum (bits): {bin(combined)[2:].zfill(total_bits)}")
+        logger.debug("Entropía + checksum (bits): %s", bin(combined)[2:].zfill(total_bits))
         
         # 3. Dividir en grupos de 11 bits y convertir a palabras
         words = []
         for i in range(total_bits // 11):
             word_index = (combined >> (total_bits - (i + 1) * 11)) & ((1 << 11) - 1)
-            print(f"Grupo {i+1} (11 bits): {bin(word_index)[2:].zfill(11)} = {word_index} = {self.BIP39_WORDS[word_index]}")
+            logger.debug("Grupo %s (11 bits): %s = %s = %s", i+1, bin(word_index)[2:].zfill(11), word_index, self.BIP39_WORDS[word_index])
             words.append(self.BIP39_WORDS[word_index])
         
         self.mnemonic = ' '.join(words)
@@ -333,84 +336,84 @@ class WalletGenerator:
         """
         # HMAC-SHA512 con la clave "Bitcoin seed"
         key = b"Bitcoin seed"
-        print(f"\nHMAC-SHA512:")
-        print(f"Key: {key.hex()}")
-        print(f"Message (seed): {seed.hex()}")
+        logger.debug("HMAC-SHA512:")
+        logger.debug("Key: %s", key.hex())
+        logger.debug("Message (seed): %s", seed.hex())
         
         hmac_obj = hmac.new(key, seed, hashlib.sha512)
         result = hmac_obj.digest()
-        print(f"HMAC result (64 bytes): {result.hex()}")
+        logger.debug("HMAC result (64 bytes): %s", result.hex())
         
         # Los primeros 32 bytes son la clave privada
         self.private_key = result[:32]
         # Los siguientes 32 bytes son el chain code
         chain_code = result[32:]
         
-        print(f"\nSeparación del resultado:")
-        print(f"Master private key (32 bytes): {self.private_key.hex()}")
-        print(f"Chain code (32 bytes): {chain_code.hex()}")
+        logger.debug("Separación del resultado:")
+        logger.debug("Master private key (32 bytes): %s", self.private_key.hex())
+        logger.debug("Chain code (32 bytes): %s", chain_code.hex())
         
         return self.private_key, chain_code
 
     def generate_wallet(self) -> dict:
         try:
-            print("\n=== GENERANDO NUEVA WALLET ===")
-            print("\n1. Generando entropía inicial (128 bits)")
+            logger.debug("=== GENERANDO NUEVA WALLET ===")
+            logger.debug("1. Generando entropía inicial (128 bits)")
             entropy = self.generate_entropy()
-            print(f"Entropía (hex): {entropy.hex()}")
+            logger.debug("Entropía (hex): %s", entropy.hex())
             
-            print("\n2. Convirtiendo entropía a frase mnemónica")
-            print("- Calculando checksum SHA256 de la entropía")
-            print("- Tomando primeros 4 bits del checksum (ENT/32)")
-            print("- Combinando entropía + checksum")
-            print("- Dividiendo en grupos de 11 bits")
+            logger.debug("2. Convirtiendo entropía a frase mnemónica")
+            logger.debug("- Calculando checksum SHA256 de la entropía")
+            logger.debug("- Tomando primeros 4 bits del checksum (ENT/32)")
+            logger.debug("- Combinando entropía + checksum")
+            logger.debug("- Dividiendo en grupos de 11 bits")
             mnemonic = self.entropy_to_mnemonic(entropy)
-            print(f"Frase mnemónica (12 palabras): {mnemonic}")
+            logger.debug("Frase mnemónica (12 palabras): %s", mnemonic)
             
-            print("\n3. Derivando semilla desde mnemónico")
-            print("- Aplicando PBKDF2-HMAC-SHA512")
-            print("- 2048 iteraciones")
-            print("- Salt: 'mnemonic' + passphrase")
+            logger.debug("3. Derivando semilla desde mnemónico")
+            logger.debug("- Aplicando PBKDF2-HMAC-SHA512")
+            logger.debug("- 2048 iteraciones")
+            logger.debug("- Salt: 'mnemonic' + passphrase")
             seed = self.mnemonic_to_seed(mnemonic)
-            print(f"Semilla (64 bytes hex): {seed.hex()}")
+            logger.debug("Semilla (64 bytes hex): %s", seed.hex())
             
-            print("\n4. Derivando clave maestra (BIP32)")
-            print("- HMAC-SHA512(key='Bitcoin seed', data=seed)")
-            print("- Dividiendo resultado en clave privada (32 bytes) y chain code (32 bytes)")
+            logger.debug("4. Derivando clave maestra (BIP32)")
+            logger.debug("- HMAC-SHA512(key='Bitcoin seed', data=seed)")
+            logger.debug("- Dividiendo resultado en clave privada (32 bytes) y chain code (32 bytes)")
             private_key, chain_code = self.derive_master_key(seed)
-            print(f"Clave privada maestra (32 bytes hex): {private_key.hex()}")
-            print(f"Chain code (32 bytes hex): {chain_code.hex()}")
+            logger.debug("Clave privada maestra (32 bytes hex): %s", private_key.hex())
+            logger.debug("Chain code (32 bytes hex): %s", chain_code.hex())
             
-            print("\n5. Generando clave pública (SECP256k1)")
-            print("- Multiplicación punto curva elíptica (G * private_key)")
+            logger.debug("5. Generando clave pública (SECP256k1)")
+            logger.debug("- Multiplicación punto curva elíptica (G * private_key)")
             sk = SigningKey.from_string(private_key, curve=SECP256k1)
             vk = sk.get_verifying_key()
             public_key = binascii.hexlify(vk.to_string()).decode('ascii')
-            print(f"Clave pública sin comprimir (64 bytes hex): {public_key}")
+            logger.debug("Clave pública sin comprimir (64 bytes hex): %s", public_key)
             
-            print("\n6. Generando dirección")
-            print("- SHA256 de la clave pública")
+            logger.debug("6. Generando dirección")
+            logger.debug("- SHA256 de la clave pública")
             public_key_bytes = bytes.fromhex(public_key)
             sha256_hash = hashlib.sha256(public_key_bytes).digest()
-            print(f"Hash SHA256: {sha256_hash.hex()}")
+            logger.debug("Hash SHA256: %s", sha256_hash.hex())
             
-            print("- RIPEMD160 del resultado SHA256")
+            logger.debug("- RIPEMD160 del resultado SHA256")
             ripemd160_hash = hashlib.new('ripemd160', sha256_hash).hexdigest()
-            print(f"Dirección final (RIPEMD160): {ripemd160_hash}")
+            logger.debug("Dirección final (RIPEMD160): %s", ripemd160_hash)
 
-            print("\n7. Cifrando clave privada")
-            print("- Usando AES-256-CBC")
-            print("- Generando salt aleatorio de 16 bytes")
-            print("- Derivando clave de cifrado con PBKDF2")
+            logger.debug("7. Cifrando clave privada")
+            logger.debug("- Usando AES-256-CBC")
+            logger.debug("- Generando salt aleatorio de 16 bytes")
+            logger.debug("- Derivando clave de cifrado con PBKDF2")
             private_key_hex = binascii.hexlify(private_key).decode('ascii')
             from app import encrypt_private_key
             encrypted_private_key = encrypt_private_key(private_key_hex, "1234")
-            print(f"Clave privada cifrada (base64): {encrypted_private_key[:64]}...")
+            logger.debug("Clave privada cifrada (base64): %s...", encrypted_private_key[:64])
             
-            print("\n=== WALLET GENERADA EXITOSAMENTE ===")
-            print(f"Dirección: {ripemd160_hash}")
-            print(f"Longitud clave privada: {len(private_key_hex)} bytes")
-            print(f"Longitud clave pública: {len(public_key)} bytes")
+            logger.debug("=== WALLET GENERADA EXITOSAMENTE ===")
+            logger.debug("Dirección: %s", ripemd160_hash)
+            logger.debug("Longitud clave privada: %s bytes", len(private_key_hex))
+            logger.debug("Longitud clave pública: %s bytes", len(public_key))
             
             return {
                 'mnemonic': mnemonic,
@@ -420,7 +423,7 @@ class WalletGenerator:
                 'address': ripemd160_hash
             }
         except Exception as e:
-            print(f"\nERROR en generate_wallet: {str(e)}")
+            logger.error("ERROR en generate_wallet: %s", e)
             raise
         
     def private_to_public(self, private_key_hex):
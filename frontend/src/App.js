@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import './App.css';
 import Wallet from './components/Wallet';
 import Transaction from './components/Transaction';
@@ -7,14 +7,17 @@ import VerifyBlock from './components/VerifyBlock';
 import Mempool from './components/Mempool';
 import Escrow from './components/Escrow';
 import Settings from './components/Settings';
+import { subscribe } from './eventStream';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
+const CHAIN_PAGE_SIZE = 100;
 
 function App() {
   const [wallets, setWallets] = useState([]);
   const [activeWallet, setActiveWallet] = useState(null);
   const [balance, setBalance] = useState(null);
   const [blockchain, setBlockchain] = useState([]);
+  const chainRef = useRef([]);
   const [error, setError] = useState(null);
   const [activeTab, setActiveTab] = useState('wallet');
   const [verifyResult, setVerifyResult] = useState(null);
@@ -36,10 +39,28 @@ function App() {
 
   const fetchBlockchain = useCallback(async () => {
     try {
-      const response = await fetch(`${API_URL}/chain`);
-      if (!response.ok) throw new Error('Network response was not ok');
-      const data = await response.json();
-      setBlockchain(data.chain);
+      // Solo se descargan los bloques nuevos. Se vuelve a pedir el último bloque
+      // conocido para detectar si la cadena cambió y hay que recargarla completa.
+      let chain = chainRef.current;
+      let nextHeight = Math.max(chain.length, 1);
+      while (nextHeight) {
+        const response = await fetch(`${API_URL}/chain?from_height=${nextHeight}&limit=${CHAIN_PAGE_SIZE}`);
+        if (!response.ok) throw new Error('Network response was not ok');
+        const data = await response.json();
+        let blocks = data.chain;
+        if (chain.length > 0 && nextHeight === chain.length) {
+          if (blocks.length === 0 || blocks[0].hash !== chain[chain.length - 1].hash) {
+            chain = [];
+            nextHeight = 1;
+            continue;
+          }
+          blocks = blocks.slice(1);
+        }
+        chain = [...chain, ...blocks];
+        nextHeight = data.next_height;
+      }
+      chainRef.current = chain;
+      setBlockchain(chain);
     } catch (error) {
       setError('Failed to fetch blockchain data');
     }
@@ -63,14 +84,26 @@ function App() {
   }, [fetchBalance, fetchBlockchain]);
 
   useEffect(() => {
-    const intervalId = setInterval(() => {
+    // El servidor avisa por /events cuando hay bloques nuevos o cambian balances;
+    // al (re)conectar o perder eventos se recarga el estado completo
+    const resync = () => {
       if (activeWallet?.address) {
         fetchBalance(activeWallet.address);
       }
       fetchBlockchain();
-    }, 10000);
+    };
+    const unsubscribers = [
+      subscribe('open', resync),
+      subscribe('overflow', resync),
+      subscribe('block-appended', fetchBlockchain),
+      subscribe('balance-changed', (data) => {
+        if (data.address === activeWallet?.address) {
+          setBalance(data.balance);
+        }
+      })
+    ];
 
-    return () => clearInterval(intervalId);
+    return () => unsubscribers.forEach(unsubscribe => unsubscribe());
   }, [activeWallet, fetchBalance, fetchBlockchain]);
 
   const generateWallet = async () => {
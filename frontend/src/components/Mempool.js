@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import './Mempool.css';
 import MiningProgress from './MiningProgress';
+import { subscribe } from '../eventStream';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
 
@@ -11,6 +12,7 @@ const Mempool = ({ onRefresh, wallet, onError }) => {
   const [selectedTransactions, setSelectedTransactions] = useState([]);
   const [showMiningProgress, setShowMiningProgress] = useState(false);
   const [isPolling, setIsPolling] = useState(false);
+  const [miningJobId, setMiningJobId] = useState(null);
   const [miningProgress, setMiningProgress] = useState({
     status: 'not_started',
     nonce: 0,
@@ -36,58 +38,77 @@ const Mempool = ({ onRefresh, wallet, onError }) => {
 
   useEffect(() => {
     fetchMempool();
-    const interval = setInterval(fetchMempool, 5000);
-    return () => clearInterval(interval);
+    const unsubscribers = [
+      subscribe('open', fetchMempool),
+      subscribe('overflow', fetchMempool),
+      subscribe('mempool-changed', fetchMempool)
+    ];
+    return () => unsubscribers.forEach(unsubscribe => unsubscribe());
   }, [fetchMempool]);
 
   useEffect(() => {
-    let pollInterval;
-    if (isPolling) {
-      pollInterval = setInterval(async () => {
-        try {
-          const response = await fetch(`${API_URL}/mine/progress`);
-          if (!response.ok) throw new Error('Failed to fetch mining progress');
-          
-          const data = await response.json();
-          console.log('Mining progress:', data);  // Para debugging
-          
-          setMiningProgress(data);
-          
-          if (data.status === 'completed' || data.found) {
-            clearInterval(pollInterval);
-            setIsPolling(false);
-            setLoading(false);
-            await fetchMempool();
-            if (onRefresh) onRefresh();
-          }
-        } catch (error) {
-          console.error('Error polling progress:', error);
-          setIsPolling(false);
-          clearInterval(pollInterval);
-        }
-      }, 1000);
-    }
-    return () => {
-      if (pollInterval) {
-        clearInterval(pollInterval);
+    if (!isPolling) return undefined;
+    // El progreso llega por /events en lugar de consultar /mine/progress cada segundo
+    return subscribe('mining-progress', setMiningProgress);
+  }, [isPolling]);
+
+  useEffect(() => {
+    if (!miningJobId) return undefined;
+
+    // El minado corre como trabajo en segundo plano; se termina cuando el trabajo termina
+    const handleJobUpdate = async (job) => {
+      if (job.id !== miningJobId) return;
+      if (job.status === 'completed') {
+        setMiningProgress(prev => ({
+          ...prev,
+          status: 'completed',
+          found: true,
+          final_nonce: job.result.nonce,
+          final_hash: job.result.hash
+        }));
+        setSelectedTransactions([]);
+      } else if (job.status === 'failed' || job.status === 'cancelled') {
+        onError(`Error al minar: ${job.error}`);
+        setMiningProgress(prev => ({
+          ...prev,
+          status: 'error',
+          error: job.error
+        }));
+      } else {
+        return;
       }
+
+      setMiningJobId(null);
+      setLoading(false);
+      setIsPolling(false);
+      await fetchMempool();
+      if (onRefresh) onRefresh();
     };
-  }, [isPolling, fetchMempool, onRefresh]);
 
-  const handleTransactionSelect = (index) => {
+    const unsubscribe = subscribe('mining-job', handleJobUpdate);
+    // Por si el trabajo terminó antes de suscribirse
+    fetch(`${API_URL}/mine/jobs/${miningJobId}`)
+      .then(response => (response.ok ? response.json() : null))
+      .then(job => job && handleJobUpdate(job))
+      .catch(error => console.error('Error fetching mining job:', error));
+    return unsubscribe;
+  }, [miningJobId, fetchMempool, onRefresh, onError]);
+
+  const handleTransactionSelect = (txid) => {
     setSelectedTransactions(prev => {
-      if (prev.includes(index)) {
-        return prev.filter(i => i !== index);
+      if (prev.includes(txid)) {
+        return prev.filter(id => id !== txid);
       } else if (prev.length < 3) {
-        return [...prev, index];
+        return [...prev, txid];
       }
       return prev;
     });
   };
 
   const calculateTotalReward = () => {
-    const selectedFees = selectedTransactions.reduce((total, index) => {
-      return total + (mempool[index]?.fee || 0);
+    const selectedFees = selectedTransactions.reduce((total, txid) => {
+      const tx = mempool.find(t => t.txid === txid);
+      return total + (tx?.fee || 0);
     }, 0);
     return blockReward + selectedFees;
   };
@@ -149,24 +170,8 @@ const Mempool = ({ onRefresh, wallet, onError }) => {
       }
   
       const data = await response.json();
-      console.log('Mining completed:', data);
-  
-      // Actualizar el estado con el resultado final
-      setMiningProgress(prev => ({
-        ...prev,
-        status: 'completed',
-        found: true,
-        final_nonce: data.nonce,
-        final_hash: data.hash
-      }));
-  
-      // Actualizar la interfaz
-      await fetchMempool();
-      if (onRefresh) onRefresh();
-      
-      setLoading(false);
-      setIsPolling(false);
-      setSelectedTransactions([]);
+      console.log('Mining job queued:', data);
+      setMiningJobId(data.job_id);
   
     } catch (error) {
       console.error('Mining error:', error);
@@ -224,11 +229,11 @@ const Mempool = ({ onRefresh, wallet, onError }) => {
         <p>No hay transacciones pendientes</p>
       ) : (
         <div className="transactions-list">
-          {mempool.map((tx, index) => (
+          {mempool.map((tx) => (
             <div 
-              key={`${tx.sender}-${tx.recipient}-${tx.amount}-${index}`}
-              className={`transaction-item ${selectedTransactions.includes(index) ? 'selected' : ''}`}
-              onClick={() => handleTransactionSelect(index)}
+              key={tx.txid}
+              className={`transaction-item ${selectedTransactions.includes(tx.txid) ? 'selected' : ''}`}
+              onClick={() => handleTransactionSelect(tx.txid)}
             >
               <div><strong>De:</strong> {tx.sender}</div>
               <div><strong>Para:</strong> {tx.recipient}</div>
@@ -236,7 +241,7 @@ const Mempool = ({ onRefresh, wallet, onError }) => {
               <div><strong>Comisión:</strong> {tx.fee} BBC</div>
               <div>
                 <strong>Estado:</strong> 
-                {selectedTransactions.includes(index) ? 'Seleccionada' : 'No seleccionada'}
+                {selectedTransactions.includes(tx.txid) ? 'Seleccionada' : 'No seleccionada'}
               </div>
             </div>
           ))}
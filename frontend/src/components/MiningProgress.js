@@ -32,6 +32,9 @@ const MiningProgress = ({ isVisible, progress }) => {
             </div>
             <div className="mt-2 font-mono text-sm">
               <div>Nonce actual: {progress.nonce}</div>
+              {progress.hash_rate > 0 && (
+                <div>Velocidad: {Math.round(progress.hash_rate).toLocaleString()} hashes/s</div>
+              )}
               {progress.hash && (
                 <div className="mt-1 break-all">
                   Hash actual: {progress.hash}
@@ -30,7 +30,7 @@ const VerifyBlock = ({ onVerifyBlock }) => {
   useEffect(() => {
     const fetchBlockList = async () => {
       try {
-        const response = await fetch(`${API_URL}/chain`);
+        const response = await fetch(`${API_URL}/chain?view=headers`);
         if (!response.ok) {
           throw new Error('Error al obtener la lista de bloques');
         }
@@ -0,0 +1,35 @@
+const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
+
+const EVENT_TYPES = [
+  'block-appended',
+  'mempool-changed',
+  'mining-progress',
+  'balance-changed',
+  'mining-job',
+  'overflow'
+];
+
+// Una sola conexión /events compartida por todos los componentes
+let source = null;
+const handlers = {};
+
+const dispatch = (type, data) => {
+  (handlers[type] || []).forEach(handler => handler(data));
+};
+
+const connect = () => {
+  source = new EventSource(`${API_URL}/events`);
+  // 'open' también se emite al reconectar: los componentes recargan su estado
+  source.onopen = () => dispatch('open', null);
+  EVENT_TYPES.forEach(type => {
+    source.addEventListener(type, (event) => dispatch(type, JSON.parse(event.data)));
+  });
+};
+
+export const subscribe = (type, handler) => {
+  if (!source) connect();
+  handlers[type] = [...(handlers[type] || []), handler];
+  return () => {
+    handlers[type] = handlers[type].filter(h => h !== handler);
+  };
+};